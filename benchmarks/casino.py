@@ -0,0 +1,313 @@
+"""
+Load benchmark for the casino commands.
+
+Replays a synthetic command mix against the casino plugin's handlers, with
+fake contexts, members and guilds standing in for Discord, and the real
+economies and ledgers underneath. Commands arrive at a fixed average rate
+(Poisson arrivals) from users picked with a Zipf distribution, so a few
+heavy users make most of the calls like in a real server. passive_income
+runs on its own timer alongside.
+
+Latency is measured from when a command arrives to when its handler returns,
+so time spent queueing behind other commands counts. Reports p50, p99 and
+the share of time spent in storage per command, and the throughput reached.
+A rate of 0 sends commands back to back to find the maximum throughput.
+
+Usage: python -m benchmarks.casino [--users 10000] [--rate 500] [--seconds 10]
+       [--mix balance=30,roll=30,give=20,top=10,rank=10] [--zipf 1.1]
+       [--guilds 1] [--income-every 1] [--rest-latency 0]
+"""
+
+import argparse
+import asyncio
+import bisect
+import itertools
+import random
+import tempfile
+import time
+import types
+import typing as t
+
+import rotibot.database as db
+import rotibot.economy as econ
+import rotibot.metrics as metrics
+import rotibot.startup as startup
+from rotibot.extensions import casino
+
+FIRST_ID = 100000000000000000
+GUILD_ID = 900000000000000000
+
+"""
+Fakes with the attributes the casino handlers use
+"""
+
+
+class FakeMember:
+    def __init__(self, user_id: int, guild_id: int) -> None:
+        self.id = user_id
+        self.guild_id = guild_id
+        self.username = f"user{user_id - FIRST_ID}"
+        self.display_name = self.username
+        self.mention = f"<@{user_id}>"
+        self.accent_colour = None
+
+    def __int__(self) -> int:
+        return self.id
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, members: t.Dict[int, FakeMember]) -> None:
+        self.id = guild_id
+        self._members = members
+
+    def get_member(self, user: t.Any) -> t.Optional[FakeMember]:
+        return self._members.get(int(user))
+
+
+class FakeContext:
+    def __init__(
+        self,
+        guild: FakeGuild,
+        member: FakeMember,
+        rest_latency: float = 0,
+        **options: t.Any,
+    ) -> None:
+        self.guild_id = guild.id
+        self.user = self.author = self.member = member
+        self.options = types.SimpleNamespace(**options)
+        self.responses: t.List[t.Any] = []
+        self._guild = guild
+        self._rest_latency = rest_latency
+
+    def get_guild(self) -> FakeGuild:
+        return self._guild
+
+    async def respond(self, *args: t.Any, **kwargs: t.Any) -> None:
+        with metrics.phase("rest"):
+            if self._rest_latency:
+                await asyncio.sleep(self._rest_latency)
+        self.responses.append(args[0] if args else kwargs.get("embed"))
+
+
+"""
+Traffic
+"""
+
+
+class ZipfUsers:
+    def __init__(self, members: t.List[FakeMember], s: float, rng: random.Random):
+        weights = [1 / rank**s for rank in range(1, len(members) + 1)]
+        self._cum_weights = list(itertools.accumulate(weights))
+        # Which users are heavy shouldn't depend on their IDs
+        self._members = rng.sample(members, len(members))
+        self._rng = rng
+
+    def pick(self) -> FakeMember:
+        x = self._rng.random() * self._cum_weights[-1]
+        return self._members[bisect.bisect(self._cum_weights, x)]
+
+
+def build_context(
+    name: str,
+    guild: FakeGuild,
+    users: ZipfUsers,
+    rng: random.Random,
+    rest_latency: float,
+) -> FakeContext:
+    user = users.pick()
+    if name == "balance" or name == "rank":
+        target = users.pick() if rng.random() < 0.3 else None
+        return FakeContext(guild, user, rest_latency, target=target)
+    if name == "roll":
+        bet = "all" if rng.random() < 0.05 else str(rng.randrange(1, 2000))
+        return FakeContext(guild, user, rest_latency, bet=bet)
+    if name == "give":
+        target = users.pick()
+        amount = rng.randrange(1, 500)
+        return FakeContext(guild, user, rest_latency, user=target, amount=amount)
+    if name == "top":
+        return FakeContext(guild, user, rest_latency, number_of_users=10)
+    raise ValueError(f"Unknown command {name}")
+
+
+HANDLERS = {
+    "balance": casino.balance.callback,
+    "roll": casino.roll.callback,
+    "give": casino.give.callback,
+    "top": casino.top.callback,
+    "rank": casino.rank.callback,
+}
+
+
+class Results:
+    def __init__(self) -> None:
+        self.latencies: t.Dict[str, t.List[float]] = dict()
+        self.storage: t.Dict[str, float] = dict()
+        self.errors: t.Dict[str, int] = dict()
+
+    def record(self, name: str, latency: float, phases: t.Dict[str, float]) -> None:
+        self.latencies.setdefault(name, []).append(latency)
+        self.storage[name] = self.storage.get(name, 0.0) + phases["storage"]
+
+
+async def run_command(
+    name: str, ctx: FakeContext, arrived: float, results: Results
+) -> None:
+    with metrics.measure() as phases:
+        try:
+            await HANDLERS[name](ctx)
+        except Exception:
+            results.errors[name] = results.errors.get(name, 0) + 1
+    results.record(name, time.perf_counter() - arrived, phases)
+
+
+async def run_income(every: float, durations: t.List[float]) -> None:
+    while True:
+        await asyncio.sleep(every)
+        start = time.perf_counter()
+        await casino.passive_income()
+        durations.append(time.perf_counter() - start)
+
+
+"""
+Report
+"""
+
+
+def percentile(values: t.List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def report(results: Results, income: t.List[float], elapsed: float) -> None:
+    total = sum(len(latencies) for latencies in results.latencies.values())
+    print(f"  {total} commands in {elapsed:.2f}s, {total / elapsed:,.0f} commands/s")
+    print(
+        f"  {'command':<10} {'count':>7} {'p50 ms':>9} {'p99 ms':>9}"
+        f" {'max ms':>9} {'storage':>8} {'errors':>7}"
+    )
+    everything = []
+    for name, latencies in sorted(results.latencies.items()):
+        everything.extend(latencies)
+        storage = results.storage[name] / sum(latencies)
+        print(
+            f"  {name:<10} {len(latencies):>7}"
+            f" {percentile(latencies, 0.5) * 1000:>9.3f}"
+            f" {percentile(latencies, 0.99) * 1000:>9.3f}"
+            f" {max(latencies) * 1000:>9.3f}"
+            f" {storage:>8.0%} {results.errors.get(name, 0):>7}"
+        )
+    if everything:
+        print(
+            f"  {'all':<10} {len(everything):>7}"
+            f" {percentile(everything, 0.5) * 1000:>9.3f}"
+            f" {percentile(everything, 0.99) * 1000:>9.3f}"
+            f" {max(everything) * 1000:>9.3f}"
+        )
+    if income:
+        print(
+            f"  passive_income: {len(income)} runs,"
+            f" p50 {percentile(income, 0.5) * 1000:.3f}ms,"
+            f" max {max(income) * 1000:.3f}ms"
+        )
+
+
+def parse_mix(mix: str) -> t.Dict[str, float]:
+    weights = dict()
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in HANDLERS:
+            raise SystemExit(f"Unknown command {name!r} in mix")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    rest_latency = args.rest_latency / 1000
+
+    # Offline, the economies mustn't restore from or back up to a database
+    db.DB_URI = None
+
+    with tempfile.TemporaryDirectory() as directory:
+        economies = econ.economies = econ.Economies(directory=directory)
+        economies.open()
+        startup.ledger_loaded.set()
+
+        guilds = []
+        for index in range(args.guilds):
+            guild_id = GUILD_ID + index
+            members = {
+                FIRST_ID + i: FakeMember(FIRST_ID + i, guild_id)
+                for i in range(args.users)
+            }
+            guilds.append(
+                (
+                    FakeGuild(guild_id, members),
+                    ZipfUsers(list(members.values()), args.zipf, rng),
+                )
+            )
+
+        print(
+            f"{args.users} users in {args.guilds} guild(s), zipf s={args.zipf},"
+            f" {'unthrottled' if not args.rate else f'{args.rate:g} commands/s'}"
+            f" for {args.seconds:g}s, mix {mix}"
+        )
+
+        results = Results()
+        income: t.List[float] = []
+        income_task = asyncio.create_task(run_income(args.income_every, income))
+        pending: t.Set[asyncio.Task] = set()
+
+        start = time.perf_counter()
+        deadline = start + args.seconds
+        next_arrival = start
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+
+            guild, users = rng.choice(guilds)
+            name = rng.choices(names, weights)[0]
+            ctx = build_context(name, guild, users, rng, rest_latency)
+
+            if args.rate:
+                next_arrival += rng.expovariate(args.rate)
+                # Yields even when behind, so the commands already sent run
+                await asyncio.sleep(max(0.0, next_arrival - now))
+                # Timed from when it is sent, sleep overshoot isn't the bot's
+                task = asyncio.create_task(
+                    run_command(name, ctx, time.perf_counter(), results)
+                )
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            else:
+                await run_command(name, ctx, now, results)
+                # Let passive_income in
+                await asyncio.sleep(0)
+
+        if pending:
+            await asyncio.wait(pending)
+        elapsed = time.perf_counter() - start
+        income_task.cancel()
+
+        report(results, income, elapsed)
+        accounts = sum(len(economy.ledger) for economy in economies)
+        print(f"  {accounts} accounts in {len(economies)} economies")
+        economies.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=500, help="0 for unthrottled")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--mix", default="balance=30,roll=30,give=20,top=10,rank=10")
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--income-every", type=float, default=1)
+    parser.add_argument("--rest-latency", type=float, default=0, help="ms")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
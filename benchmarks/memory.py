@@ -0,0 +1,53 @@
+"""
+Memory benchmark for the account store.
+
+Compares the dict-of-dicts layout returned by read_csv with AccountStore at
+10k, 100k and 1M accounts.
+
+Usage: python -m benchmarks.memory [accounts ...]
+"""
+
+import sys
+import tracemalloc
+
+from rotibot.storage import AccountStore
+
+FIRST_ID = 100000000000000000
+
+
+def build_dicts(num_accounts: int) -> dict:
+    users = dict()
+    for i in range(num_accounts):
+        users[FIRST_ID + i] = {"username": f"user{i % 5000}", "balance": 10000 + i}
+    return users
+
+
+def build_store(num_accounts: int) -> AccountStore:
+    accounts = AccountStore()
+    for i in range(num_accounts):
+        accounts.put(FIRST_ID + i, f"user{i % 5000}", 10000 + i, 0)
+    return accounts
+
+
+def measure(build, num_accounts: int) -> int:
+    tracemalloc.start()
+    result = build(num_accounts)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main(sizes) -> None:
+    print(f"{'accounts':>10} {'dicts':>12} {'store':>12} {'saving':>8}")
+    for num_accounts in sizes:
+        dicts = measure(build_dicts, num_accounts)
+        store = measure(build_store, num_accounts)
+        print(
+            f"{num_accounts:>10,} {dicts / 2**20:>10.1f}MB {store / 2**20:>10.1f}MB"
+            f" {dicts / store:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,89 @@
+"""
+Load time benchmark for ledger snapshots.
+
+Writes the same accounts as users.csv and as a binary snapshot, then times
+loading each into an AccountStore the way Ledger.load does. Also times looking accounts up in the memory-mapped binary
+snapshot without loading it.
+
+Usage: python -m benchmarks.snapshot [accounts ...]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from rotibot import storage
+from rotibot.storage import AccountStore
+
+FIRST_ID = 100000000000000000
+LOOKUPS = 10000
+
+
+def build_rows(num_accounts: int) -> list:
+    rng = random.Random(0)
+    ids = rng.sample(range(FIRST_ID, FIRST_ID + num_accounts * 10), num_accounts)
+    return [
+        (discordID, f"user{i % 5000}", rng.randrange(100000))
+        for i, discordID in enumerate(ids)
+    ]
+
+
+def load_csv(path: str) -> AccountStore:
+    accounts = AccountStore()
+    for discordID, user in storage.read_csv(path).items():
+        accounts.put(discordID, user["username"], user["balance"], 0)
+    return accounts
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def lookups(path: str, user_ids: list) -> None:
+    with storage.SnapshotFile(path) as snapshot:
+        for user_id in user_ids:
+            snapshot.find(user_id)
+
+
+def main(sizes: list) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "users.csv")
+        binary_path = os.path.join(directory, "users.snapshot")
+
+        for num_accounts in sizes:
+            rows = build_rows(num_accounts)
+            storage.write_csv(
+                {discordID: {"username": u, "balance": b} for discordID, u, b in rows},
+                csv_path,
+            )
+            storage.write_snapshot(binary_path, 0, 0, rows)
+
+            user_ids = [row[0] for row in random.sample(rows, min(LOOKUPS, len(rows)))]
+            results = [
+                ("users.csv", csv_path, timed(load_csv, csv_path)),
+                (
+                    "binary snapshot",
+                    binary_path,
+                    timed(storage.read_snapshot, binary_path),
+                ),
+            ]
+
+            print(f"{num_accounts:,} accounts")
+            for name, path, seconds in results:
+                print(
+                    f"  {name:<16} {os.path.getsize(path) / 1e6:>8.1f} MB"
+                    f"  load {seconds * 1000:>9.1f} ms"
+                )
+            seconds = timed(lookups, binary_path, user_ids)
+            print(
+                f"  {len(user_ids):,} lookups in the mapped binary snapshot:"
+                f" {seconds * 1000:.1f} ms, {seconds / len(user_ids) * 1e6:.1f} us each"
+            )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
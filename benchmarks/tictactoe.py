@@ -0,0 +1,56 @@
+"""
+Benchmark for the board game engine.
+
+Plays random tic-tac-toe games to completion and reports moves per second,
+then has the computer opponent play itself on larger boards and reports how
+long its moves take against the time budget.
+
+Usage: python -m benchmarks.tictactoe [games]
+"""
+
+import random
+import sys
+import time
+
+from rotibot.games import Board, BoardAI, TicTacToe
+
+
+def main(num_games: int) -> None:
+    rng = random.Random(0)
+    moves = 0
+    outcomes = [0, 0, 0]
+
+    start = time.perf_counter()
+    for _ in range(num_games):
+        game = TicTacToe()
+        cells = list(range(9))
+        rng.shuffle(cells)
+        for index in cells:
+            moves += 1
+            if game.play(index):
+                break
+        outcomes[game.winner] += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{num_games:,} random games, {moves:,} moves in {elapsed:.3f}s")
+    print(f"  {moves / elapsed:,.0f} moves/s, {elapsed / moves * 1e6:.2f}us per move")
+    print(f"  X won {outcomes[1]:,}, O won {outcomes[2]:,}, tied {outcomes[0]:,}")
+
+    for width, height, k in ((3, 3, 3), (4, 4, 3), (5, 5, 4)):
+        board = Board(width, height, k)
+        ai = BoardAI(budget=0.5)
+        move_times = []
+        while not board.is_over:
+            start = time.perf_counter()
+            board.play(ai.choose(board))
+            move_times.append(time.perf_counter() - start)
+
+        print(
+            f"AI self-play {width}x{height} connect {k}: winner {board.winner},"
+            f" {len(move_times)} moves, max {max(move_times) * 1000:.0f}ms"
+            f" (budget {ai.budget * 1000:.0f}ms)"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,70 @@
+"""
+Stress benchmark for concurrent ledger transfers.
+
+Fires thousands of concurrent gives between a small set of accounts so that
+most of them contend for the same locks, then checks that no points were
+created or destroyed.
+
+Usage: python -m benchmarks.transfers [accounts] [gives]
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from rotibot.storage import Ledger
+
+
+# Same shape as the give command: read, yield to the event loop, then write
+async def slow_give(ledger: Ledger, src: int, dst: int, amount: int) -> bool:
+    async with ledger.lock(src, dst):
+        balance = ledger.get_balance(src)
+        await asyncio.sleep(0)
+        if balance < amount:
+            return False
+        ledger.add_balance(src, -amount)
+        ledger.add_balance(dst, amount)
+        return True
+
+
+async def main(num_accounts: int, num_gives: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        ledger = Ledger(os.path.join(directory, "users"))
+        ledger.load()
+        for user_id in range(num_accounts):
+            ledger.create_account(user_id, f"user{user_id}")
+        total = sum(balance for _, _, balance in ledger.items())
+
+        gives = []
+        for i in range(num_gives):
+            src, dst = random.sample(range(num_accounts), 2)
+            amount = random.randint(1, 5000)
+            if i % 2:
+                gives.append(ledger.transfer(src, dst, amount))
+            else:
+                gives.append(slow_give(ledger, src, dst, amount))
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*gives)
+        elapsed = time.perf_counter() - start
+        ledger.close()
+
+        after = sum(balance for _, _, balance in ledger.items())
+        print(f"{num_gives} gives between {num_accounts} accounts")
+        print(f"  completed: {sum(results)}, refused: {len(results) - sum(results)}")
+        print(f"  {elapsed:.3f}s, {num_gives / elapsed:,.0f} gives/s")
+        print(f"  total balance before {total:,}, after {after:,}")
+
+        if after != total or any(b < 0 for _, _, b in ledger.items()):
+            print("  FAILED: balance not conserved")
+            sys.exit(1)
+        print("  OK: balance conserved")
+
+
+if __name__ == "__main__":
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    gives = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    asyncio.run(main(accounts, gives))
@@ -1,38 +1,122 @@
 from code import interact
+import asyncio
+import logging
 import os
+import sys
 from pathlib import Path
 
-import aiohttp
+# Imported first so the startup timings cover the imports below
+import rotibot.startup as startup
+
 import hikari
 import lightbulb
 from dotenv import load_dotenv
 from lightbulb.ext import tasks
 
+import rotibot.cluster as cluster
 import rotibot.database as db
+import rotibot.economy as econ
+import rotibot.gateway as gateway
+import rotibot.instrument as instrument
+import rotibot.network as network
+
+startup.timer.record("imports")
 
 load_dotenv()
 env_path = Path("..") / ".env"
 load_dotenv(dotenv_path=env_path)
 
-bot = lightbulb.BotApp(
+# Launcher mode, this process serves the economies to the worker processes
+if __name__ == "__main__" and cluster.WORKERS > 1 and cluster.WORKER is None:
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(cluster.launch())
+
+# Worker mode, the economies live in the launcher
+if cluster.WORKER is not None:
+    econ.economies = cluster.connect_economies()
+    if cluster.FAKE_GATEWAY:
+        logging.basicConfig(level=logging.INFO)
+        asyncio.run(cluster.run_fake_gateway(econ.economies))
+        sys.exit(0)
+
+startup.timer.mark("bot setup")
+extensions = gateway.extension_modules("./rotibot/extensions")
+intents, cache_components = gateway.profile(extensions)
+
+bot = instrument.InstrumentedBotApp(
     token=os.getenv("TOKEN"),
     prefix="!",
-    intents=hikari.Intents.ALL,
+    intents=intents,
+    cache_settings=hikari.impl.CacheSettings(components=cache_components),
     # default_enabled_guilds=int(os.getenv("GUILD_ID")),
     help_slash_command=True,
 )
+logger = logging.getLogger("rotibot")
+
+instrument.attach(bot, port_offset=cluster.WORKER or 0)
+
+if gateway.STATS_INTERVAL > 0:
+    gateway.GatewayMonitor(bot, gateway.STATS_INTERVAL).attach()
+
+
+"""
+Startup. The gateway connects while the economies open, casino commands and
+tasks wait for them before touching a ledger.
+"""
 
 
 @bot.listen()
 async def on_starting(event: hikari.StartingEvent) -> None:
+    startup.timer.record("gateway info", since="run")
+    startup.timer.mark("gateway connect")
+    bot.d.ledger_task = asyncio.create_task(load_ledger())
+    bot.d.aio_session = network.build_session()
+    bot.d.http_stats = network.stats
+
+
+@bot.listen()
+async def on_started(event: hikari.StartedEvent) -> None:
+    startup.timer.record("gateway connect", since="gateway connect")
     channel = await bot.rest.fetch_channel(os.getenv("STDOUT_CHANNEL_ID"))
-    db.loadAllUsers()
     await channel.send("Rotibot has been started!")
-    bot.d.aio_session = aiohttp.ClientSession()
+
+    await startup.ledger_loaded.wait()
+    logger.info(startup.timer.report())
+
+
+async def load_ledger() -> None:
+    # The launcher serves the economies to the workers
+    if cluster.WORKER is not None:
+        startup.ledger_loaded.set()
+        return
+
+    economies = econ.economies
+    try:
+        if db.DB_URI:
+            with startup.timer.phase("schema upgrade"):
+                await db.upgradeSchemaAsync()
+        with startup.timer.phase("economies open"):
+            economies.open()
+
+        # Guilds load on first use, except the one that owned the ledger from
+        # before economies were split, which is likely to be used right away
+        if economies.legacy_guild_id:
+            with startup.timer.phase("legacy economy load"):
+                await economies.get(economies.legacy_guild_id)
+    except Exception as e:
+        # Leave the economies unavailable rather than serving empty accounts
+        logger.exception("Opening the economies failed")
+        startup.ledger_loaded.fail(e)
+        return
+
+    startup.ledger_loaded.set()
 
 
 @bot.listen()
 async def on_stopping(event: hikari.StoppingEvent) -> None:
+    # Closing the ledgers writes out their buffered journal records, this
+    # waits for them to be on disk
+    econ.economies.close()
     await bot.d.aio_session.close()
 
 
@@ -58,6 +142,8 @@ async def on_error(event: lightbulb.CommandErrorEvent) -> None:
         await event.context.respond(
             f"{event.context.author.mention}, something went wrong during invocation of command {commandName}."
         )
+    elif isinstance(exception, lightbulb.CheckFailure):
+        await event.context.respond(f"{event.context.author.mention}, {exception}")
     else:
         raise exception
 
@@ -81,6 +167,7 @@ async def get_command_name(interaction: hikari.CommandInteraction) -> str:
 
 tasks.load(bot)
 bot.load_extensions_from("./rotibot/extensions", must_exist=True)
+startup.timer.record("bot setup", since="bot setup")
 
 
 if __name__ == "__main__":
@@ -88,4 +175,8 @@ if __name__ == "__main__":
         import uvloop
 
         uvloop.install()
-    bot.run()
+    startup.timer.mark("run")
+    if cluster.WORKER is not None:
+        bot.run(shard_ids=cluster.SHARD_IDS, shard_count=cluster.SHARD_COUNT)
+    else:
+        bot.run()
@@ -0,0 +1,75 @@
+import asyncio
+import collections
+import logging
+import time
+import typing as t
+
+import rotibot.metrics as metrics
+
+logger = logging.getLogger("rotibot.cache")
+
+"""
+Pool of ready-to-serve payloads from an external API. Payloads are fetched
+ahead of time in the background, so commands can respond from memory instead
+of waiting on a round trip. Each payload is served once, and payloads older
+than ttl seconds are dropped since image links and posts go stale.
+"""
+
+
+class PrefetchPool:
+    def __init__(
+        self,
+        fetch: t.Callable[[], t.Awaitable[t.Optional[t.Any]]],
+        size: int = 5,
+        ttl: float = 600,
+    ) -> None:
+        self.fetch = fetch
+        self.size = size
+        self.ttl = ttl
+        self._payloads: t.Deque[t.Tuple[float, t.Any]] = collections.deque()
+        self._refill_task: t.Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    # Returns a prefetched payload, or fetches one directly if the pool is
+    # empty. None means the API didn't return a usable payload.
+    async def get(self) -> t.Optional[t.Any]:
+        self._evict_expired()
+
+        if self._payloads:
+            _, payload = self._payloads.popleft()
+        else:
+            payload = await self.fetch()
+
+        self.refill()
+        return payload
+
+    # Start topping the pool up in the background if it isn't already
+    def refill(self) -> None:
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    def close(self) -> None:
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+        self._payloads.clear()
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        while self._payloads and self._payloads[0][0] <= now:
+            self._payloads.popleft()
+
+    async def _refill(self) -> None:
+        metrics.detach()
+        while len(self._payloads) < self.size:
+            try:
+                payload = await self.fetch()
+            except Exception:
+                # Try again on the next get instead of hammering a failing API
+                logger.exception("Prefetching payload failed")
+                return
+
+            if payload is None:
+                return
+            self._payloads.append((time.monotonic() + self.ttl, payload))
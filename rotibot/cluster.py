@@ -0,0 +1,379 @@
+import asyncio
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import typing as t
+from multiprocessing.managers import BaseManager
+
+import rotibot.database as db
+import rotibot.economy as econ
+import rotibot.metrics as metrics
+import rotibot.storage as store
+
+logger = logging.getLogger("rotibot.cluster")
+
+"""
+Multi-process mode. With WORKERS set above 1, `python -m rotibot` becomes a
+launcher: it serves the casino economies to the other processes over a local
+socket and starts WORKERS bot processes, each connecting a share of the
+gateway shards. Discord sends every event of a guild to the same shard, so
+sessions, caches and cooldowns can stay local to a worker, only the economies
+are shared.
+"""
+
+WORKERS = int(os.getenv("WORKERS", 1))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", WORKERS))
+LEDGER_ADDRESS = os.getenv("LEDGER_ADDRESS", "127.0.0.1:0")
+
+# Set by the launcher for the worker processes it starts
+WORKER = int(os.environ["ROTIBOT_WORKER"]) if "ROTIBOT_WORKER" in os.environ else None
+SHARD_IDS = [int(shard) for shard in os.getenv("SHARD_IDS", "").split(",") if shard]
+
+# Number of synthetic events each worker handles instead of connecting to
+# Discord, for trying the cluster out locally
+FAKE_GATEWAY = int(os.getenv("FAKE_GATEWAY", 0))
+
+
+# Shard that receives a guild's events
+def shard_for(guild_id: int, shard_count: int = SHARD_COUNT) -> int:
+    return (int(guild_id) >> 22) % shard_count
+
+
+# The process that owns the economies runs their periodic tasks (income,
+# compaction, eviction, backups): the bot itself, or the launcher when
+# clustered
+def owns_ledger() -> bool:
+    return WORKER is None
+
+
+"""
+Launcher side. Every call runs on the launcher's event loop, so a guild's
+ledger is never touched by two threads at once and its per-account locks work
+the same as in a single process.
+"""
+
+# Methods workers may call on a guild's ledger and leaderboard
+EXPOSED = {
+    "ledger": {
+        "get_balance",
+        "get_username",
+        "get_score",
+        "create_account",
+        "apply_delta",
+        "transfer",
+        "sync_members",
+    },
+    "leaderboard": {"size", "top", "rank"},
+}
+
+
+class LedgerService:
+    def __init__(
+        self, economies: econ.Economies, loop: asyncio.AbstractEventLoop
+    ) -> None:
+        self.economies = economies
+        self.loop = loop
+
+    def known(self, guild_id: int) -> bool:
+        return self.economies.known(guild_id)
+
+    # Load the guild's economy if it isn't loaded yet
+    def load(self, guild_id: int) -> None:
+        async def run() -> None:
+            await self.economies.get(guild_id)
+
+        asyncio.run_coroutine_threadsafe(run(), self.loop).result()
+
+    def call(self, guild_id: int, target: str, name: str, *args: t.Any) -> t.Any:
+        if name not in EXPOSED.get(target, ()):
+            raise AttributeError(f"{target}.{name} can't be called remotely")
+
+        async def run() -> t.Any:
+            economy = await self.economies.get(guild_id)
+            result = getattr(getattr(economy, target), name)(*args)
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result
+
+        return asyncio.run_coroutine_threadsafe(run(), self.loop).result()
+
+
+class LedgerManager(BaseManager):
+    pass
+
+
+"""
+Worker side. Stands in for the economies in the casino. Every call is a round
+trip to the launcher, which may have to load the guild or wait on an account
+lock first, so calls go through a thread and the worker's event loop keeps
+running meanwhile.
+"""
+
+
+class _RemoteObject:
+    def __init__(self, service: t.Any, guild_id: int, target: str) -> None:
+        self._service = service
+        self._guild_id = guild_id
+        self._target = target
+
+    async def _call(self, name: str, *args: t.Any) -> t.Any:
+        loop = asyncio.get_running_loop()
+        with metrics.phase("storage"):
+            return await loop.run_in_executor(
+                None, self._service.call, self._guild_id, self._target, name, *args
+            )
+
+
+class RemoteLeaderboard(_RemoteObject):
+    async def size(self) -> int:
+        return await self._call("size")
+
+    async def top(self, num_users: int) -> t.List[t.Tuple[int, str, int]]:
+        return await self._call("top", num_users)
+
+    async def rank(self, user_id: int) -> int:
+        return await self._call("rank", int(user_id))
+
+
+class RemoteLedger(_RemoteObject):
+    async def get_balance(self, user_id: int) -> int:
+        return await self._call("get_balance", int(user_id))
+
+    async def get_username(self, user_id: int) -> str:
+        return await self._call("get_username", int(user_id))
+
+    async def get_score(self, user_id: int) -> int:
+        return await self._call("get_score", int(user_id))
+
+    async def create_account(
+        self, user_id: int, username: str, balance: int = store.DEFAULT_BALANCE
+    ) -> bool:
+        return await self._call("create_account", int(user_id), username, balance)
+
+    async def apply_delta(self, user_id: int, delta: int) -> t.Optional[int]:
+        return await self._call("apply_delta", int(user_id), delta)
+
+    async def transfer(self, src: int, dst: int, amount: int) -> bool:
+        return await self._call("transfer", int(src), int(dst), amount)
+
+    async def sync_members(
+        self, members: t.Iterable[t.Tuple[int, str]], create: bool = True
+    ) -> t.Tuple[int, int]:
+        members = [(int(user_id), username) for user_id, username in members]
+        return await self._call("sync_members", members, create)
+
+
+class RemoteEconomy:
+    def __init__(self, service: t.Any, guild_id: int) -> None:
+        self.guild_id = guild_id
+        self.ledger = RemoteLedger(service, guild_id, "ledger")
+        self.leaderboard = RemoteLeaderboard(service, guild_id, "leaderboard")
+
+
+class RemoteEconomies:
+    def __init__(self, service: t.Any) -> None:
+        self._service = service
+
+    # The launcher owns the files
+    def close(self) -> None:
+        pass
+
+    async def known(self, guild_id: int) -> bool:
+        loop = asyncio.get_running_loop()
+        with metrics.phase("storage"):
+            return await loop.run_in_executor(None, self._service.known, int(guild_id))
+
+    async def get(self, guild_id: int) -> RemoteEconomy:
+        loop = asyncio.get_running_loop()
+        with metrics.phase("storage"):
+            await loop.run_in_executor(None, self._service.load, int(guild_id))
+        return RemoteEconomy(self._service, int(guild_id))
+
+
+def _parse_address(address: str) -> t.Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+# Connect a worker to the launcher's economies
+def connect_economies() -> RemoteEconomies:
+    LedgerManager.register("economies")
+    manager = LedgerManager(
+        address=_parse_address(os.environ["LEDGER_ADDRESS"]),
+        authkey=bytes.fromhex(os.environ["LEDGER_AUTHKEY"]),
+    )
+    manager.connect()
+    return RemoteEconomies(manager.economies())
+
+
+"""
+Launcher. Serves the economies and runs their periodic tasks, then runs the
+workers until they exit or the launcher is told to stop, in which case the
+workers are stopped first.
+"""
+
+
+async def _every(seconds: float, job: t.Callable[[], t.Any]) -> None:
+    while True:
+        await asyncio.sleep(seconds)
+        try:
+            result = job()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            logger.exception("Running %s failed", job.__name__)
+
+
+# Every worker needs at least one shard, or it would connect nothing
+def check_config(workers: int = WORKERS, shard_count: int = SHARD_COUNT) -> None:
+    if workers < 1:
+        raise RuntimeError(f"WORKERS must be at least 1, got {workers}")
+    if shard_count < workers:
+        raise RuntimeError(
+            f"SHARD_COUNT ({shard_count}) must be at least WORKERS ({workers}),"
+            " every worker needs a shard"
+        )
+
+
+def launch() -> int:
+    check_config()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    db.upgradeSchema()
+    economies = econ.economies
+    economies.open()
+    jobs = [
+        loop.create_task(_every(300, economies.accrue_income)),
+        loop.create_task(_every(60, economies.compact)),
+        loop.create_task(_every(60, economies.evict_idle)),
+    ]
+    if db.DB_URI:
+        jobs.append(loop.create_task(_every(600, economies.backup)))
+
+    service = LedgerService(economies, loop)
+    LedgerManager.register("economies", callable=lambda: service)
+    authkey = os.urandom(16)
+    server = LedgerManager(
+        address=_parse_address(LEDGER_ADDRESS), authkey=authkey
+    ).get_server()
+    threading.Thread(
+        target=server.serve_forever, name="rotibot-ledger", daemon=True
+    ).start()
+    host, port = server.address
+    logger.info("Serving the economies on %s:%d", host, port)
+
+    workers = []
+    for index in range(WORKERS):
+        shard_ids = [shard for shard in range(SHARD_COUNT) if shard % WORKERS == index]
+        env = dict(
+            os.environ,
+            ROTIBOT_WORKER=str(index),
+            SHARD_COUNT=str(SHARD_COUNT),
+            SHARD_IDS=",".join(map(str, shard_ids)),
+            LEDGER_ADDRESS=f"{host}:{port}",
+            LEDGER_AUTHKEY=authkey.hex(),
+        )
+        workers.append(subprocess.Popen([sys.executable, "-m", "rotibot"], env=env))
+        logger.info("Started worker %d with shards %s", index, shard_ids)
+
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stopping.set)
+        except NotImplementedError:
+            # Windows, Ctrl+C still reaches the workers directly
+            pass
+
+    async def supervise() -> None:
+        while not stopping.is_set():
+            if all(worker.poll() is not None for worker in workers):
+                return
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        # Keep serving the economies while the workers shut down
+        while any(worker.poll() is None for worker in workers):
+            await asyncio.sleep(0.1)
+
+    try:
+        loop.run_until_complete(supervise())
+    finally:
+        for job in jobs:
+            job.cancel()
+        loop.run_until_complete(asyncio.gather(*jobs, return_exceptions=True))
+        logger.info(
+            "Workers exited with %s, %d guilds loaded holding %d accounts",
+            [worker.returncode for worker in workers],
+            len(economies),
+            sum(len(economy.ledger) for economy in economies),
+        )
+        economies.close()
+        loop.close()
+
+    return max((abs(worker.returncode) for worker in workers), default=0)
+
+
+"""
+Fake gateway for running the cluster without Discord. Each worker makes up
+guilds whose shards it owns and plays casino commands (new members, rolls,
+gives and leaderboard lookups) against the shared economies, then reports how
+many it handled.
+"""
+
+
+async def run_fake_gateway(
+    economies: RemoteEconomies, num_events: int = FAKE_GATEWAY
+) -> None:
+    if not SHARD_IDS:
+        raise RuntimeError(f"Worker {WORKER} has no shards to make up guilds for")
+    rng = random.Random(WORKER)
+    guilds = []
+    while len(guilds) < 8:
+        guild_id = rng.getrandbits(63)
+        if shard_for(guild_id) in SHARD_IDS:
+            guilds.append(guild_id)
+    # Member IDs are shared between guilds, like real users in several servers
+    members = [rng.getrandbits(63) for _ in range(200)]
+
+    counts = {"join": 0, "roll": 0, "give": 0, "top": 0}
+    start = time.perf_counter()
+    for _ in range(num_events):
+        guild_id, user_id = rng.choice(guilds), rng.choice(members)
+        kind = rng.choices(("join", "roll", "give", "top"), (1, 5, 3, 1))[0]
+        counts[kind] += 1
+
+        economy = await economies.get(guild_id)
+        ledger = economy.ledger
+        await ledger.create_account(user_id, f"fake-{user_id}")
+        if kind == "roll":
+            bet = rng.randrange(1, 1000)
+            await ledger.apply_delta(user_id, bet if rng.random() < 0.5 else -bet)
+        elif kind == "give":
+            target_id = rng.choice(members)
+            await ledger.create_account(target_id, f"fake-{target_id}")
+            if target_id != user_id:
+                await ledger.transfer(user_id, target_id, rng.randrange(1, 100))
+        elif kind == "top":
+            await economy.leaderboard.top(5)
+    elapsed = time.perf_counter() - start
+
+    logger.info(
+        "Worker %d (shards %s) handled %d fake events in %.2fs, %.0f/s: %s",
+        WORKER,
+        SHARD_IDS,
+        num_events,
+        elapsed,
+        num_events / elapsed,
+        counts,
+    )
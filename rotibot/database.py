@@ -1,84 +1,144 @@
+import asyncio
+import importlib
 import os
 import typing as t
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from dotenv import load_dotenv
-from sqlalchemy import Column, Integer, String, create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-import rotibot.storage as store
 
 load_dotenv()
 env_path = Path("..") / ".env"
 load_dotenv(dotenv_path=env_path)
 
 DB_URI = os.getenv("DB_URI")
+# Balances saved before economies were split per guild belong to this guild
+LEGACY_GUILD_ID = int(os.getenv("GUILD_ID") or 0)
+
+# Database calls are blocking, they run on this thread instead of the event
+# loop. A single worker keeps backups from overlapping each other.
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rotibot-db")
+
+"""
+SQLAlchemy and the engine live in rotibot.models, which is only imported the
+first time the database is used. Importing this module stays cheap, so the
+bot can connect to the gateway without waiting for them.
+"""
+
+
+def __getattr__(name: str) -> t.Any:
+    if name in ("engine", "Session", "base", "User"):
+        return getattr(importlib.import_module("rotibot.models"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 """
-PostgreSQL Database setup
+Function to create the User table, or upgrade it from an older schema. Run
+once at startup before the economies open, it raises if the table can't be
+upgraded so startup fails instead of losing balances.
 """
-engine = create_engine(DB_URI)
-base = declarative_base()
 
 
-class User(base):
-    __tablename__ = "User"
-    discordID = Column(Integer, primary_key=True)
-    username = Column(String)
-    balance = Column(Integer)
+def upgradeSchema() -> None:
+    if not DB_URI:
+        return
 
-    def __repr__(self):
-        return "<User(discordID={}, username='{}', balance={})>".format(
-            self.discordID, self.username, self.balance
-        )
+    from rotibot.models import upgrade_schema
+
+    upgrade_schema()
+
+
+"""
+Function to upsert changed user rows from a guild's ledger into PostgreSQL
+database. Passive income accrued by every account of the guild is applied with
+one UPDATE first, then changed rows are written with a single INSERT ... ON
+CONFLICT, all in one transaction so a failed backup leaves the table as it was.
+"""
+
+
+def saveUsers(
+    guildID: int, rows: t.List[t.Tuple[int, str, int]], income: int = 0
+) -> None:
+    if not rows and not income:
+        return
+
+    from sqlalchemy import update
+    from sqlalchemy.dialects import postgresql, sqlite
+
+    from rotibot.models import Session, User, engine
+
+    if engine.dialect.name == "sqlite":
+        insert = sqlite.insert
+    else:
+        insert = postgresql.insert
+
+    stmt = insert(User.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.guildID, User.discordID],
+        set_={"username": stmt.excluded.username, "balance": stmt.excluded.balance},
+    )
+
+    with Session() as session, session.begin():
+        if income:
+            session.execute(
+                update(User)
+                .where(User.guildID == guildID)
+                .values(balance=User.balance + income)
+            )
+        if rows:
+            session.execute(
+                stmt,
+                [
+                    {
+                        "guildID": guildID,
+                        "discordID": discordID,
+                        "username": username,
+                        "balance": balance,
+                    }
+                    for discordID, username, balance in rows
+                ],
+            )
 
 
 """
-Function to save all user data from CSV file into PostgreSQL database
+Function to load a guild's user data from PostgreSQL database into a Dictionary
 """
 
 
-def saveAllUsers(users: t.Dict[int, t.Dict]) -> None:
-    Session = sessionmaker(engine)
-    session = Session()
+def loadGuildUsers(guildID: int) -> t.Dict[int, t.Dict]:
+    from rotibot.models import Session, User
 
-    try:
-        session.query(User).delete()
-        session.commit()
-    except:
-        session.rollback()
-        raise Exception
+    with Session() as session:
+        users = session.query(User).filter(User.guildID == guildID)
 
-    for user in users:
-        user_row = User(
-            discordID=user,
-            username=users[user]["username"],
-            balance=users[user]["balance"],
-        )
-        session.add(user_row)
-    session.commit()
+        outerDict = dict()
+        for user in users:
+            innerDict = dict()
+            innerDict["username"] = user.username
+            innerDict["balance"] = int(user.balance)
+            outerDict[int(user.discordID)] = innerDict
 
-    session.close()
+    return outerDict
 
 
 """
-Function to load all user data from PostgreSQL database into CSV file
+Async versions of the functions above, run on the database executor so the
+event loop keeps serving the gateway while the database round trip happens.
 """
 
 
-def loadAllUsers() -> None:
-    Session = sessionmaker(engine)
-    session = Session()
+async def upgradeSchemaAsync() -> None:
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, upgradeSchema)
+
 
-    users = session.query(User)
+async def saveUsersAsync(
+    guildID: int, rows: t.List[t.Tuple[int, str, int]], income: int = 0
+) -> None:
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, saveUsers, guildID, rows, income)
 
-    outerDict = dict()
-    for user in users:
-        innerDict = dict()
-        innerDict["username"] = user.username
-        innerDict["balance"] = int(user.balance)
-        outerDict[int(user.discordID)] = innerDict
 
-    store.write_csv(outerDict)
-    session.close()
+async def loadGuildUsersAsync(guildID: int) -> t.Dict[int, t.Dict]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, loadGuildUsers, guildID)
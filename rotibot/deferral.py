@@ -0,0 +1,76 @@
+import asyncio
+import functools
+import os
+import typing as t
+
+import hikari
+import lightbulb
+
+import rotibot.metrics as metrics
+
+# Seconds a slash command may take before its interaction is deferred.
+# Discord fails an interaction that isn't acknowledged within 3 seconds.
+DEFER_BUDGET = float(os.getenv("DEFER_BUDGET", 2.0))
+
+"""
+Context handed to a deferring command. Behaves like the real context, but
+responses are serialised with the deferral timer so the two can't both send
+the initial response.
+"""
+
+
+class _DeferringContext:
+    def __init__(self, ctx: lightbulb.Context, lock: asyncio.Lock) -> None:
+        self._ctx = ctx
+        self._lock = lock
+
+    def __getattr__(self, name: str) -> t.Any:
+        return getattr(self._ctx, name)
+
+    async def respond(self, *args: t.Any, **kwargs: t.Any) -> lightbulb.ResponseProxy:
+        async with self._lock:
+            return await self._ctx.respond(*args, **kwargs)
+
+
+"""
+Decorator for commands that may be slow to send their first response. If a
+slash command hasn't responded within budget seconds, the interaction is
+deferred and the command's responses become followups to it.
+"""
+
+
+def defer_after(
+    budget: float = DEFER_BUDGET,
+) -> t.Callable[
+    [t.Callable[[lightbulb.Context], t.Awaitable[None]]],
+    t.Callable[[lightbulb.Context], t.Awaitable[None]],
+]:
+    def decorator(
+        callback: t.Callable[[lightbulb.Context], t.Awaitable[None]],
+    ) -> t.Callable[[lightbulb.Context], t.Awaitable[None]]:
+        @functools.wraps(callback)
+        async def wrapper(ctx: lightbulb.Context) -> None:
+            if not isinstance(ctx, lightbulb.ApplicationContext):
+                await callback(ctx)
+                return
+
+            lock = asyncio.Lock()
+
+            async def defer_later() -> None:
+                await asyncio.sleep(budget)
+                async with lock:
+                    if not ctx.responses and not ctx.deferred:
+                        await ctx.respond(hikari.ResponseType.DEFERRED_MESSAGE_CREATE)
+                        metrics.registry.count_deferral(
+                            (ctx.invoked or ctx.command).qualname
+                        )
+
+            timer = asyncio.create_task(defer_later())
+            try:
+                await callback(_DeferringContext(ctx, lock))
+            finally:
+                timer.cancel()
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+import time
+import typing as t
+
+import rotibot.database as db
+import rotibot.metrics as metrics
+import rotibot.storage as store
+from rotibot.leaderboard import Leaderboard
+
+logger = logging.getLogger("rotibot.economy")
+
+"""
+Per-guild casino economies. Every guild has its own ledger files and
+leaderboard, loaded the first time the guild uses the casino and evicted from
+memory once it has been idle for a while. Work done for one guild (saving a
+change, compacting, backing up, ranking) only ever touches that guild's
+partition.
+
+Passive income is counted in epochs shared by all guilds. The current epoch
+is kept in a file next to the partitions, and a partition that was not
+loaded while income was paid catches up with one journal record when it is
+loaded again.
+"""
+
+
+# Ledger files from before economies were split per guild
+LEGACY_PATH = "users"
+
+
+def ledger_exists(path: str) -> bool:
+    return any(
+        os.path.exists(path + suffix) for suffix in (".snapshot", ".journal", ".csv")
+    )
+
+
+# Written like snapshots, to a temporary file renamed into place
+def write_epoch(path: str, epoch: int) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        file.write(str(epoch))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class Economy:
+    def __init__(self, guild_id: int, ledger: store.Ledger) -> None:
+        self.guild_id = guild_id
+        self.ledger = ledger
+        # Attached before the ledger loads so the load builds its index
+        self.leaderboard = Leaderboard(ledger)
+        self.last_used = time.monotonic()
+
+
+class Economies:
+    def __init__(
+        self,
+        directory: str = "economies",
+        income: int = store.PASSIVE_INCOME,
+        idle_timeout: float = 900,
+        legacy_guild_id: int = 0,
+    ) -> None:
+        self.directory = directory
+        self.income = income
+        self.idle_timeout = idle_timeout
+        # The guild that owns the ledger files from before the split
+        self.legacy_guild_id = legacy_guild_id
+        self.epoch_path = os.path.join(directory, "epoch")
+        self.epoch = 0
+        self._economies: t.Dict[int, Economy] = dict()
+        self._loading: t.Dict[int, asyncio.Future] = dict()
+
+    def __len__(self) -> int:
+        return len(self._economies)
+
+    def __iter__(self) -> t.Iterator[Economy]:
+        return iter(list(self._economies.values()))
+
+    def open(self) -> None:
+        # Without the guild that owns them the legacy files would never be
+        # loaded, and their balances would be silently left behind
+        if not self.legacy_guild_id and ledger_exists(LEGACY_PATH):
+            raise RuntimeError(
+                f"Found the ledger from before economies were split per guild"
+                f" ({LEGACY_PATH}.*), set GUILD_ID to the guild it belongs to"
+            )
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.epoch_path):
+            with open(self.epoch_path) as file:
+                self.epoch = int(file.read() or 0)
+
+    # Only at shutdown, it waits for the journal writes to reach the disk
+    def close(self) -> None:
+        for economy in self._economies.values():
+            economy.ledger.close()
+        self._economies = dict()
+        store.writer.wait()
+
+    def path_for(self, guild_id: int) -> str:
+        if self.legacy_guild_id and guild_id == self.legacy_guild_id:
+            return LEGACY_PATH
+        return os.path.join(self.directory, str(guild_id))
+
+    # Whether the guild has an economy, loaded or not. Guilds that never used
+    # the casino don't.
+    def known(self, guild_id: int) -> bool:
+        guild_id = int(guild_id)
+        if guild_id in self._economies:
+            return True
+        return ledger_exists(self.path_for(guild_id))
+
+    # The guild's economy, loading it first if it isn't in memory
+    async def get(self, guild_id: int) -> Economy:
+        guild_id = int(guild_id)
+        economy = self._economies.get(guild_id)
+        if economy is None:
+            loading = self._loading.get(guild_id)
+            if loading is None:
+                loading = asyncio.ensure_future(self._load(guild_id))
+                self._loading[guild_id] = loading
+                loading.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+            # One caller being cancelled mustn't cancel the load for the others
+            with metrics.phase("storage"):
+                economy = await asyncio.shield(loading)
+
+        economy.last_used = time.monotonic()
+        return economy
+
+    async def _load(self, guild_id: int) -> Economy:
+        # Shared by every caller waiting on it, each times its own wait
+        metrics.detach()
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        economy = Economy(guild_id, store.Ledger(self.path_for(guild_id), self.income))
+        ledger = economy.ledger
+        await loop.run_in_executor(None, ledger.load)
+
+        # Pay the income missed while the guild wasn't loaded. Done before
+        # a restore, as database balances already include their income.
+        if ledger.epoch < self.epoch:
+            ledger.accrue_income(self.epoch - ledger.epoch)
+
+        # Local files are lost on a redeploy, the database still has the guild
+        if len(ledger) == 0 and db.DB_URI:
+            users = await db.loadGuildUsersAsync(guild_id)
+            if users:
+                await loop.run_in_executor(None, ledger.restore, users)
+
+        self._economies[guild_id] = economy
+        logger.debug(
+            "Loaded economy of guild %d, %d accounts in %.3fs",
+            guild_id,
+            len(ledger),
+            time.perf_counter() - start,
+        )
+        return economy
+
+    # Pay one epoch of passive income. Only loaded guilds are touched, the
+    # others catch up when they are next loaded.
+    def accrue_income(self) -> None:
+        self.epoch += 1
+        write_epoch(self.epoch_path, self.epoch)
+        for economy in self._economies.values():
+            if economy.ledger.epoch < self.epoch:
+                economy.ledger.accrue_income(self.epoch - economy.ledger.epoch)
+
+    async def compact(self) -> None:
+        for economy in self:
+            if economy.ledger.needs_compaction():
+                await economy.ledger.compact()
+
+    # Save every guild's changes to the database. Returns how many accounts
+    # were written and how long the event loop was blocked collecting them,
+    # the database round trips themselves run off the loop. A guild that
+    # fails is retried on the next backup without holding up the others.
+    async def backup(self) -> t.Tuple[int, float]:
+        saved = 0
+        blocked = 0.0
+        failed = None
+        for economy in self:
+            start = time.perf_counter()
+            rows, income = economy.ledger.take_dirty()
+            economy_blocked = time.perf_counter() - start
+            blocked += economy_blocked
+            if not rows and not income:
+                continue
+            try:
+                await db.saveUsersAsync(economy.guild_id, rows, income)
+            except Exception as e:
+                economy.ledger.mark_dirty(
+                    (discordID for discordID, _, _ in rows), income
+                )
+                failed = e
+                continue
+            saved += len(rows)
+            logger.debug(
+                "Backed up %d accounts of guild %d in %.3fs,"
+                " event loop blocked for %.2fms",
+                len(rows),
+                economy.guild_id,
+                time.perf_counter() - start,
+                economy_blocked * 1000,
+            )
+
+        if failed is not None:
+            raise failed
+        return saved, blocked
+
+    # Drop guilds that have been idle for longer than idle_timeout, once their
+    # changes are in the database
+    def evict_idle(self) -> int:
+        deadline = time.monotonic() - self.idle_timeout
+        evicted = 0
+        for economy in self:
+            ledger = economy.ledger
+            if (
+                economy.last_used > deadline
+                or ledger.busy
+                or (db.DB_URI and ledger.needs_backup())
+            ):
+                continue
+
+            del self._economies[economy.guild_id]
+            ledger.close()
+            evicted += 1
+        return evicted
+
+
+economies = Economies(
+    directory=os.getenv("ECONOMY_DIR", "economies"),
+    idle_timeout=float(os.getenv("ECONOMY_IDLE_TIMEOUT", 900)),
+    legacy_guild_id=db.LEGACY_GUILD_ID,
+)
@@ -0,0 +1,112 @@
+import typing as t
+
+import hikari
+import lightbulb
+
+import rotibot.metrics as metrics
+
+# The admin check needs the invoking member's roles
+INTENTS = hikari.Intents.GUILDS | hikari.Intents.GUILD_MEMBERS
+CACHE_COMPONENTS = (
+    hikari.api.CacheComponents.GUILDS
+    | hikari.api.CacheComponents.MEMBERS
+    | hikari.api.CacheComponents.ROLES
+)
+
+admin_plugin = lightbulb.Plugin("Admin", "Admin commands for RotiBot")
+admin_plugin.add_checks(
+    lightbulb.guild_only,
+    lightbulb.checks.has_role_permissions(hikari.Permissions.ADMINISTRATOR),
+)
+
+
+@admin_plugin.command
+@lightbulb.command("admin", "Commands for server admins")
+@lightbulb.implements(lightbulb.SlashCommandGroup, lightbulb.PrefixCommandGroup)
+async def admin_group(ctx: lightbulb.Context) -> None:
+    pass
+
+
+"""
+Stats command: !admin stats
+Summarises the metrics registry, the same numbers the metrics endpoint serves.
+"""
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "slower"
+    if seconds < 0.01:
+        return f"{seconds * 1000:.1f}ms"
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    return f"{seconds:.1f}s"
+
+
+def command_table(registry: metrics.Registry) -> str:
+    lines = [
+        f"{'command':<16} {'runs':>5} {'p50':>6} {'p99':>6}"
+        f" {'storage':>8} {'rest':>6} {'http':>6} {'deferred':>8}"
+    ]
+    commands = sorted({command for command, _ in registry.commands})
+    for command in commands:
+        handler = registry.commands[(command, "handler")]
+        # Average time per run spent in each phase
+        means = [
+            registry.commands[(command, phase)].total / handler.count
+            for phase in ("storage", "rest", "http")
+        ]
+        lines.append(
+            f"{command:<16} {handler.count:>5}"
+            f" {format_seconds(handler.quantile(0.5)):>6}"
+            f" {format_seconds(handler.quantile(0.99)):>6}"
+            f" {format_seconds(means[0]):>8}"
+            f" {format_seconds(means[1]):>6}"
+            f" {format_seconds(means[2]):>6}"
+            f" {registry.deferrals.get(command, 0):>8}"
+        )
+    return "\n".join(lines)
+
+
+def outcome_lines(counts: t.Dict[t.Tuple[str, str], int]) -> str:
+    by_name: t.Dict[str, t.List[str]] = dict()
+    for (name, outcome), count in sorted(counts.items()):
+        by_name.setdefault(name, []).append(f"{outcome} {count}")
+    return "\n".join(f"`{name}`: {', '.join(items)}" for name, items in by_name.items())
+
+
+@admin_group.child
+@lightbulb.command("stats", "Show command latencies and outcomes")
+@lightbulb.implements(lightbulb.PrefixSubCommand, lightbulb.SlashSubCommand)
+async def stats(ctx: lightbulb.Context) -> None:
+    registry = metrics.registry
+    if not registry.commands and not registry.tasks:
+        await ctx.respond("No commands or tasks have run yet.")
+        return
+
+    embed = hikari.Embed(title="RotiBot Stats", colour=0x3B9DFF)
+    if registry.commands:
+        embed.add_field(
+            "Commands", f"```\n{command_table(registry)}\n```", inline=False
+        )
+    if registry.outcomes:
+        embed.add_field("Outcomes", outcome_lines(registry.outcomes), inline=False)
+    if registry.tasks:
+        embed.add_field(
+            "Tasks",
+            "\n".join(
+                f"`{task}`: {histogram.count} runs,"
+                f" {format_seconds(histogram.total / histogram.count)} average"
+                for task, histogram in sorted(registry.tasks.items())
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            "Task outcomes", outcome_lines(registry.task_outcomes), inline=False
+        )
+
+    await ctx.respond(embed)
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    bot.add_plugin(admin_plugin)
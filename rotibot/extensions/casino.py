@@ -1,13 +1,51 @@
+import inspect
+import logging
 import random
+import time
 import typing as t
 
 import hikari
 import lightbulb
-import rotibot.database as db
+import rotibot.cluster as cluster
+import rotibot.economy as econ
+import rotibot.metrics as metrics
+import rotibot.startup as startup
 import rotibot.storage as store
 from lightbulb.ext import tasks
 
+# Members are looked up from the cache, and admin checks need their roles
+INTENTS = hikari.Intents.GUILDS | hikari.Intents.GUILD_MEMBERS
+CACHE_COMPONENTS = (
+    hikari.api.CacheComponents.GUILDS
+    | hikari.api.CacheComponents.MEMBERS
+    | hikari.api.CacheComponents.ROLES
+)
+
 casino_plugin = lightbulb.Plugin("Casino", "Casino plugin for RotiBot")
+logger = logging.getLogger("rotibot.casino")
+
+
+# The economies open while the gateway connects, commands wait for them. If
+# they failed to open the commands are refused.
+@lightbulb.Check
+async def ledger_loaded(ctx: lightbulb.Context) -> bool:
+    if not await startup.ledger_loaded.wait():
+        raise lightbulb.CheckFailure(
+            "the casino is unavailable, its ledger failed to load."
+        )
+    return True
+
+
+# A worker's economies live in the launcher and answer with coroutines, so
+# ledger and leaderboard results are passed through this either way
+async def resolve(value: t.Any) -> t.Any:
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+# Every guild has its own economy
+casino_plugin.add_checks(lightbulb.guild_only, ledger_loaded)
 
 """
 Defining casino command group
@@ -40,11 +78,13 @@ async def balance(ctx: lightbulb.Context) -> None:
         await ctx.respond("That user is not in the server")
         return
 
-    # Check if target ID is in database, if not, make a new user and print default balance value
-    users = await create_new_user_account(target)
+    ledger = (await econ.economies.get(ctx.guild_id)).ledger
+
+    # Check if target ID is in ledger, if not, make a new user and print default balance value
+    await create_new_user_account(ledger, target)
 
-    # Retrieve balance from users dict
-    target_balance = users[target_id]["balance"]
+    # Retrieve balance from ledger
+    target_balance = await resolve(ledger.get_balance(target_id))
     await ctx.respond(
         f"{target.mention}, you currently have {formatBalance(target_balance)} points."
     )
@@ -70,9 +110,10 @@ async def roll(ctx: lightbulb.Context) -> None:
     user = ctx.get_guild().get_member(ctx.user)
     user_id = int(user.id)
 
-    users = await create_new_user_account(user)
+    ledger = (await econ.economies.get(ctx.guild_id)).ledger
+    await create_new_user_account(ledger, user)
 
-    user_bal = users[user_id]["balance"]
+    user_bal = await resolve(ledger.get_balance(user_id))
 
     if bet == "all":
         if user_bal > 1000000:
@@ -98,23 +139,25 @@ async def roll(ctx: lightbulb.Context) -> None:
     roll = random.randrange(101)
 
     if roll == 100:
-        users[user_id]["balance"] += bet_num * 3
+        await ledger.apply_delta(user_id, bet_num * 3)
         await ctx.respond(
             f"{user.mention}, you rolled {str(roll)} and have earned {formatBalance(bet_num * 3)} points. Roll is now on cooldown for 3 minutes."
         )
     elif roll < 51:
-        users[user_id]["balance"] -= bet_num
+        if await ledger.apply_delta(user_id, -bet_num) is None:
+            await ctx.respond(
+                f"{user.mention}, you do not have enough points to bet that amount."
+            )
+            return
         await ctx.respond(
             f"{user.mention}, you rolled {str(roll)} and have lost {formatBalance(bet_num)} points. Roll is now on cooldown for 3 minutes."
         )
     else:
-        users[user_id]["balance"] += int(bet_num * 1.5)
+        await ledger.apply_delta(user_id, int(bet_num * 1.5))
         await ctx.respond(
             f"{user.mention}, you rolled {str(roll)} and have earned {formatBalance(int(bet_num * 1.5))} points. Roll is now on cooldown for 3 minutes."
         )
 
-    store.write_csv(users)
-
 
 """
 Give command: !give @user @gift_amount
@@ -153,19 +196,16 @@ async def give(ctx: lightbulb.Context) -> None:
         await ctx.respond(f"{user.mention}, you cannot give points to yourself.")
         return
 
-    users = await create_new_user_account(user)
-    users = await create_new_user_account(target)
+    ledger = (await econ.economies.get(ctx.guild_id)).ledger
+    await create_new_user_account(ledger, user)
+    await create_new_user_account(ledger, target)
 
-    gifter_balance = users[user_id]["balance"]
-    if gift_amount > gifter_balance:
+    if not await ledger.transfer(user_id, target_id, gift_amount):
         await ctx.respond(f"{user.mention}, you do not have enough points to gift.")
     else:
-        users[user_id]["balance"] -= gift_amount
-        users[target_id]["balance"] += gift_amount
         await ctx.respond(
             f"{target.mention}, {user.mention} has given you {formatBalance(gift_amount)} points."
         )
-        store.write_csv(users)
 
 
 """
@@ -189,30 +229,14 @@ async def top(ctx: lightbulb.Context) -> None:
 
     user = ctx.get_guild().get_member(ctx.author)
 
-    users = await create_new_user_account(user)
+    economy = await econ.economies.get(ctx.guild_id)
+    await create_new_user_account(economy.ledger, user)
 
-    # Sort users dictionary in reverse order by point balance
-    sorted_users = sorted(
-        users.items(), key=lambda item: item[1]["balance"], reverse=True
-    )
-
-    # Get top num_users users from sorted list
+    # Get top num_users users from leaderboard index
     top_users = []
 
-    if len(users) > num_users:
-        for i in range(num_users):
-            user_points = (
-                sorted_users[i][1]["username"],
-                formatBalance(sorted_users[i][1]["balance"]),
-            )
-            top_users.append(user_points)
-    else:
-        for i in range(len(users)):
-            user_points = (
-                sorted_users[i][1]["username"],
-                formatBalance(sorted_users[i][1]["balance"]),
-            )
-            top_users.append(user_points)
+    for _, username, balance in await resolve(economy.leaderboard.top(num_users)):
+        top_users.append((username, formatBalance(balance)))
 
     # Prepare embed to send as message
     embed_desc = f"Top {len(top_users)} Users"
@@ -228,6 +252,39 @@ async def top(ctx: lightbulb.Context) -> None:
     await ctx.respond(embed=embed)
 
 
+"""
+Rank command: !rank @user
+"""
+
+
+@casino_group.child
+@lightbulb.option(
+    "target", "The member's rank to be displayed.", hikari.User, required=False
+)
+@lightbulb.command("rank", "Display user's position on the points leaderboard")
+@lightbulb.implements(lightbulb.PrefixSubCommand, lightbulb.SlashSubCommand)
+async def rank(ctx: lightbulb.Context) -> None:
+    target = ctx.get_guild().get_member(ctx.options.target or ctx.user)
+
+    if not target:
+        await ctx.respond("That user is not in the server")
+        return
+
+    target_id = int(target.id)
+    economy = await econ.economies.get(ctx.guild_id)
+    await create_new_user_account(economy.ledger, target)
+
+    leaderboard = economy.leaderboard
+    position = await resolve(leaderboard.rank(target_id))
+    ranked = await resolve(leaderboard.size())
+    target_balance = await resolve(economy.ledger.get_balance(target_id))
+    await ctx.respond(
+        f"{target.mention}, you are ranked #{formatBalance(position)} "
+        f"out of {formatBalance(ranked)} with "
+        f"{formatBalance(target_balance)} points."
+    )
+
+
 """
 ADMIN Donate command: !donate @user @amount
 """
@@ -253,27 +310,26 @@ async def donate(ctx: lightbulb.Context) -> None:
         await ctx.respond("That user is not in the server.")
         return
 
+    ledger = (await econ.economies.get(ctx.guild_id)).ledger
+
     # Makes an account for the mentioned user if user doesn't have an account
-    users = await create_new_user_account(target)
+    await create_new_user_account(ledger, target)
 
-    users[target_id]["balance"] += donation_amount
+    await ledger.apply_delta(target_id, donation_amount)
     await ctx.respond(
         f"{target.mention}, {formatBalance(donation_amount)} point(s) have been added to your balance."
     )
-    store.write_csv(users)
 
 
 """
-Function to check whether a user is in CSV file and create new account if not
+Function to check whether a user is in the ledger and create new account if not
 """
 
 
-async def create_new_user_account(user: hikari.Member) -> t.Dict[int, t.Dict]:
-    users = store.read_csv()
-    if int(user.id) not in users.keys():
-        await make_account(user, users)
-        users = store.read_csv()
-    return users
+async def create_new_user_account(ledger: store.Ledger, user: hikari.Member) -> None:
+    # create_account leaves existing accounts alone, checking first would
+    # cost a worker a second round trip
+    await make_account(ledger, user)
 
 
 """
@@ -281,12 +337,77 @@ Function to create a new entry for a new user
 """
 
 
-async def make_account(user: hikari.Member, users: t.Dict[int, t.Dict]) -> None:
-    # Create new dictionary entry for the new user
-    users[int(user.id)] = {"username": user.display_name, "balance": 10000}
+async def make_account(ledger: store.Ledger, user: hikari.Member) -> None:
+    # Create new ledger entry for the new user, the ledger persists it
+    await resolve(ledger.create_account(int(user.id), user.display_name))
+
+
+"""
+Onboarding and username refreshes. The member chunks hikari requests when a
+guild becomes available give accounts to all of its members in one batch per
+chunk. Name changes are queued as they arrive and written every 30 seconds
+with the names from the member cache, so a member renaming several times is
+written once and commands never write names themselves. Guilds that haven't
+used the casino are left alone until they do.
+"""
+
+# guild ID -> members whose display name changed since the last refresh
+renamed_members: t.Dict[int, t.Set[int]] = dict()
+
+
+def member_rows(members: t.Iterable[hikari.Member]) -> t.List[t.Tuple[int, str]]:
+    return [
+        (int(member.id), member.display_name) for member in members if not member.is_bot
+    ]
+
+
+@casino_plugin.listener(hikari.MemberChunkEvent)
+async def on_member_chunk(event: hikari.MemberChunkEvent) -> None:
+    if not await startup.ledger_loaded.wait():
+        return
+    if not await resolve(econ.economies.known(event.guild_id)):
+        return
+
+    ledger = (await econ.economies.get(event.guild_id)).ledger
+    created, renamed = await resolve(
+        ledger.sync_members(member_rows(event.members.values()))
+    )
+    logger.debug(
+        "Chunk %d/%d of guild %d: %d accounts created, %d renamed",
+        event.chunk_index + 1,
+        event.chunk_count,
+        event.guild_id,
+        created,
+        renamed,
+    )
+
+
+@casino_plugin.listener(hikari.MemberUpdateEvent)
+async def on_member_update(event: hikari.MemberUpdateEvent) -> None:
+    old_member = event.old_member
+    if old_member is None or old_member.display_name != event.member.display_name:
+        renamed_members.setdefault(int(event.guild_id), set()).add(int(event.user_id))
+
+
+@tasks.task(s=30, auto_start=True)
+@metrics.timed_task
+async def refresh_usernames() -> None:
+    if not await startup.ledger_loaded.wait():
+        return
+    pending = dict(renamed_members)
+    renamed_members.clear()
+
+    cache = casino_plugin.bot.cache
+    for guild_id, user_ids in pending.items():
+        if not await resolve(econ.economies.known(guild_id)):
+            continue
+        members = (cache.get_member(guild_id, user_id) for user_id in user_ids)
+        rows = member_rows(member for member in members if member is not None)
 
-    # Write updated dictionary to CSV file
-    store.write_csv(users)
+        ledger = (await econ.economies.get(guild_id)).ledger
+        _, renamed = await resolve(ledger.sync_members(rows, create=False))
+        if renamed:
+            logger.debug("Renamed %d accounts in guild %d", renamed, guild_id)
 
 
 """
@@ -295,26 +416,68 @@ Passive income for people with accounts in server. 250 points every 5 minutes.
 
 
 @tasks.task(m=5, auto_start=True)
+@metrics.timed_task
 async def passive_income() -> None:
-    users = store.read_csv()
+    if not cluster.owns_ledger():
+        return
+    if not await startup.ledger_loaded.wait():
+        return
+    econ.economies.accrue_income()
+
+
+"""
+Fold each guild's ledger journal into a new snapshot once it has grown large
+enough.
+"""
+
+
+@tasks.task(m=1, auto_start=True)
+@metrics.timed_task
+async def compact_ledger() -> None:
+    if not cluster.owns_ledger():
+        return
+    if not await startup.ledger_loaded.wait():
+        return
+    await econ.economies.compact()
+
+
+"""
+Unload the economies of guilds that haven't used the casino for a while.
+"""
 
-    for user in users.values():
-        user["balance"] += 250
 
-    store.write_csv(users)
+@tasks.task(m=1, auto_start=True)
+@metrics.timed_task
+async def evict_economies() -> None:
+    if not cluster.owns_ledger():
+        return
+    evicted = econ.economies.evict_idle()
+    if evicted:
+        logger.debug("Evicted %d idle economies", evicted)
 
 
 """
-Save CSV data to PostgreSQL database every 10 minutes.
+Save ledger changes to PostgreSQL database every 10 minutes.
 """
 
 
 @tasks.task(m=10, auto_start=True)
+@metrics.timed_task
 async def backup_data() -> None:
-    users = store.read_csv()
-
-    if len(users) > 0:
-        db.saveAllUsers(users)
+    if not cluster.owns_ledger():
+        return
+    if not await startup.ledger_loaded.wait():
+        return
+    start = time.perf_counter()
+    saved, blocked = await econ.economies.backup()
+
+    logger.info(
+        "Backed up %d accounts of %d guilds in %.3fs, event loop blocked for %.2fms",
+        saved,
+        len(econ.economies),
+        time.perf_counter() - start,
+        blocked * 1000,
+    )
 
 
 """
@@ -1,10 +1,20 @@
 import asyncio
+import functools
 import random
+import typing as t
 
 import hikari
 import lightbulb
+from lightbulb.ext import tasks
 from lightbulb.ext.tungsten import tungsten
 
+import rotibot.deferral as deferral
+import rotibot.metrics as metrics
+import rotibot.network as network
+import rotibot.sessions as sessions
+from rotibot.cache import PrefetchPool
+from rotibot.games import EMPTY, MAX_SIZE, O, X, Board, BoardAI, TicTacToe
+
 ANIMALS = {
     "Dog": "🐶",
     "Cat": "🐱",
@@ -17,9 +27,75 @@ ANIMALS = {
     "Kangaroo": "🦘",
 }
 
+# Players are looked up from the member cache, the bot user for the opponent
+INTENTS = hikari.Intents.GUILD_MEMBERS
+CACHE_COMPONENTS = (
+    hikari.api.CacheComponents.GUILDS
+    | hikari.api.CacheComponents.MEMBERS
+    | hikari.api.CacheComponents.ME
+)
+
 fun_plugin = lightbulb.Plugin("Fun")
 
 
+"""
+Meme and animal payloads are prefetched into pools so the commands can respond
+without waiting on the external APIs.
+"""
+
+
+async def fetch_meme() -> t.Optional[t.Dict]:
+    res = await network.get_json(
+        fun_plugin.bot.d.aio_session, "meme", "https://meme-api.herokuapp.com/gimme"
+    )
+
+    if res is None or res["nsfw"] == True:
+        return None
+    return res
+
+
+async def fetch_animal(animal: str) -> t.Optional[t.Dict]:
+    return await network.get_json(
+        fun_plugin.bot.d.aio_session,
+        "animal",
+        f"https://some-random-api.ml/animal/{animal}",
+    )
+
+
+meme_pool = PrefetchPool(fetch_meme, size=5)
+animal_pools = {
+    name.lower().replace(" ", "_"): PrefetchPool(
+        functools.partial(fetch_animal, name.lower().replace(" ", "_")), size=2
+    )
+    for name in ANIMALS
+}
+
+
+@fun_plugin.listener(hikari.StartedEvent)
+async def on_started(event: hikari.StartedEvent) -> None:
+    meme_pool.refill()
+    for pool in animal_pools.values():
+        pool.refill()
+
+
+@fun_plugin.listener(hikari.InteractionCreateEvent)
+async def on_interaction(event: hikari.InteractionCreateEvent) -> None:
+    await sessions.registry.dispatch(event)
+
+
+@tasks.task(s=5, auto_start=True)
+@metrics.timed_task
+async def evict_idle_sessions() -> None:
+    await sessions.registry.evict_idle()
+
+
+@fun_plugin.listener(hikari.StoppingEvent)
+async def on_stopping(event: hikari.StoppingEvent) -> None:
+    meme_pool.close()
+    for pool in animal_pools.values():
+        pool.close()
+
+
 @fun_plugin.command
 @lightbulb.command("fun", "All the entertainment commands you'll ever need")
 @lightbulb.implements(lightbulb.SlashCommandGroup, lightbulb.PrefixCommandGroup)
@@ -35,26 +111,24 @@ Meme command
 @fun_group.child
 @lightbulb.command("meme", "Get a meme")
 @lightbulb.implements(lightbulb.SlashSubCommand, lightbulb.PrefixSubCommand)
+@deferral.defer_after()
 async def meme_subcommand(ctx: lightbulb.Context) -> None:
-    async with ctx.bot.d.aio_session.get(
-        "https://meme-api.herokuapp.com/gimme"
-    ) as response:
-        res = await response.json()
+    res = await meme_pool.get()
 
-        if response.ok and res["nsfw"] != True:
-            link = res["postLink"]
-            title = res["title"]
-            img_url = res["url"]
+    if res is not None:
+        link = res["postLink"]
+        title = res["title"]
+        img_url = res["url"]
 
-            embed = hikari.Embed(colour=0x3B9DFF)
-            embed.set_author(name=title, url=link)
-            embed.set_image(img_url)
+        embed = hikari.Embed(colour=0x3B9DFF)
+        embed.set_author(name=title, url=link)
+        embed.set_image(img_url)
 
-            await ctx.respond(embed)
-        else:
-            await ctx.respond(
-                "Could not fetch a meme :c", flags=hikari.MessageFlag.EPHEMERAL
-            )
+        await ctx.respond(embed)
+    else:
+        await ctx.respond(
+            "Could not fetch a meme :c", flags=hikari.MessageFlag.EPHEMERAL
+        )
 
 
 """
@@ -65,6 +139,7 @@ Animal picture + fact command
 @fun_group.child
 @lightbulb.command("animal", "Get a fact + picture of an animal")
 @lightbulb.implements(lightbulb.SlashSubCommand, lightbulb.PrefixSubCommand)
+@deferral.defer_after()
 async def animal_subcommand(ctx: lightbulb.Context) -> None:
     select_menu = (
         ctx.bot.rest.build_action_row()
@@ -84,33 +159,44 @@ async def animal_subcommand(ctx: lightbulb.Context) -> None:
     )
     msg = await resp.message()
 
-    try:
-        event = await ctx.bot.wait_for(
-            hikari.InteractionCreateEvent,
-            timeout=60,
-            predicate=lambda e: isinstance(e.interaction, hikari.ComponentInteraction)
-            and e.interaction.user.id == ctx.author.id
-            and e.interaction.message.id == msg.id
-            and e.interaction.component_type == hikari.ComponentType.SELECT_MENU,
+    sessions.registry.add(msg.id, AnimalMenu(ctx.author.id, msg))
+
+
+class AnimalMenu(sessions.Session):
+    def __init__(self, author_id: hikari.Snowflake, message: hikari.Message):
+        super().__init__()
+        self.author_id = author_id
+        self.message = message
+
+    async def handle(self, event: hikari.InteractionCreateEvent) -> None:
+        interaction = event.interaction
+        if (
+            interaction.user.id != self.author_id
+            or interaction.component_type != hikari.ComponentType.SELECT_MENU
+        ):
+            return
+
+        self.closed = True
+        await interaction.create_initial_response(
+            hikari.ResponseType.DEFERRED_MESSAGE_UPDATE
         )
-    except asyncio.TimeoutError:
-        await msg.edit("The menu timed out", components=[])
-    else:
-        animal = event.interaction.values[0]
-        async with ctx.bot.d.aio_session.get(
-            f"https://some-random-api.ml/animal/{animal}"
-        ) as res:
-            if res.ok:
-                res = await res.json()
-                embed = hikari.Embed(description=res["fact"], colour=0x3B9DFF)
-                embed.set_image(res["image"])
-
-                animal = animal.replace("_", " ")
-                await msg.edit(
-                    f"Here's a {animal} for you!", embed=embed, components=[]
-                )
-            else:
-                await msg.edit(f"API returned a {res.status} status", components=[])
+
+        animal = interaction.values[0]
+        res = await animal_pools[animal].get()
+
+        animal = animal.replace("_", " ")
+        if res is not None:
+            embed = hikari.Embed(description=res["fact"], colour=0x3B9DFF)
+            embed.set_image(res["image"])
+
+            await self.message.edit(
+                f"Here's a {animal} for you!", embed=embed, components=[]
+            )
+        else:
+            await self.message.edit(f"Could not fetch a {animal} :c", components=[])
+
+    async def expire(self) -> None:
+        await self.message.edit("The menu timed out", components=[])
 
 
 """
@@ -118,108 +204,76 @@ Tic-Tac-Toe command
 """
 
 
-class TicTacToeButtons(tungsten.Components):
-    def __init__(self, *args, **kwargs):
+class TicTacToeButtons(tungsten.Components, sessions.Session):
+    def __init__(self, *args, game: t.Optional[Board] = None, **kwargs):
         super().__init__(*args, **kwargs)
+        sessions.Session.__init__(self)
+        self.game = game or TicTacToe()
+        self.ai: t.Optional[BoardAI] = None
         self.button_group = self.create_button_group()
-        self.turn = 0
 
     def set_players(self, player1: hikari.Member, player2: hikari.Member):
         self.player1 = player1
         self.player2 = player2
 
-    def check_winner(self):
-        button_rows = self.button_group.button_rows
-        if (
-            int(button_rows[0][0].state)
-            == int(button_rows[0][1].state)
-            == int(button_rows[0][2].state)
-            != 0
-        ):
-            return True
-        elif (
-            int(button_rows[1][0].state)
-            == int(button_rows[1][1].state)
-            == int(button_rows[1][2].state)
-            != 0
-        ):
-            return True
-        elif (
-            int(button_rows[2][0].state)
-            == int(button_rows[2][1].state)
-            == int(button_rows[2][2].state)
-            != 0
-        ):
-            return True
-        elif (
-            int(button_rows[0][0].state)
-            == int(button_rows[1][0].state)
-            == int(button_rows[2][0].state)
-            != 0
-        ):
-            return True
-        elif (
-            int(button_rows[0][1].state)
-            == int(button_rows[1][1].state)
-            == int(button_rows[2][1].state)
-            != 0
-        ):
-            return True
-        elif (
-            int(button_rows[0][2].state)
-            == int(button_rows[1][2].state)
-            == int(button_rows[2][2].state)
-            != 0
-        ):
-            return True
-        elif (
-            int(button_rows[0][0].state)
-            == int(button_rows[1][1].state)
-            == int(button_rows[2][2].state)
-            != 0
-        ):
-            return True
-        elif (
-            int(button_rows[0][2].state)
-            == int(button_rows[1][1].state)
-            == int(button_rows[2][0].state)
-            != 0
-        ):
-            return True
+        # Picking the bot as a player makes it play against you
+        bot_id = self.ctx.bot.get_me().id
+        if bot_id in (player1.id, player2.id):
+            self.ai = BoardAI()
+
+    def player_for(self, mark: int) -> hikari.Member:
+        return self.player1 if mark == X else self.player2
+
+    def is_bot_turn(self) -> bool:
+        return (
+            self.ai is not None
+            and not self.game.is_over
+            and self.player_for(self.game.player).id == self.ctx.bot.get_me().id
+        )
+
+    def status(self) -> str:
+        if self.game.winner != EMPTY:
+            return f"{self.player_for(self.game.winner).mention} has won the game!"
+        elif self.game.is_over:
+            return "It's a Tie!"
         else:
-            return False
+            return f"{self.player_for(self.game.player).mention}, it is your turn!"
 
     def create_button_group(self):
         button_states = {
-            0: tungsten.ButtonState(
+            EMPTY: tungsten.ButtonState(
                 label="", style=hikari.ButtonStyle.SECONDARY, emoji="➖"
             ),
-            1: tungsten.ButtonState(
+            X: tungsten.ButtonState(
                 label="", style=hikari.ButtonStyle.PRIMARY, emoji="❌"
             ),
-            2: tungsten.ButtonState(
+            O: tungsten.ButtonState(
                 label="", style=hikari.ButtonStyle.SUCCESS, emoji="⭕"
             ),
         }
+        width = self.game.width
         button_rows = [
             [
-                tungsten.Button(state=0, button_states=button_states),
-                tungsten.Button(state=0, button_states=button_states),
-                tungsten.Button(state=0, button_states=button_states),
-            ],
-            [
-                tungsten.Button(state=0, button_states=button_states),
-                tungsten.Button(state=0, button_states=button_states),
-                tungsten.Button(state=0, button_states=button_states),
-            ],
-            [
-                tungsten.Button(state=0, button_states=button_states),
-                tungsten.Button(state=0, button_states=button_states),
-                tungsten.Button(state=0, button_states=button_states),
-            ],
+                tungsten.Button(
+                    state=self.game.cell(y * width + x), button_states=button_states
+                )
+                for x in range(width)
+            ]
+            for y in range(self.game.height)
         ]
         return tungsten.ButtonGroup(button_rows)
 
+    def play(self, index: int) -> None:
+        self.game.play(index)
+        x, y = index % self.game.width, index // self.game.width
+        self.button_group.edit_button(x, y, state=self.game.cell(index))
+
+    # The search is CPU bound, so it runs off the event loop
+    async def play_bot_move(self) -> None:
+        loop = asyncio.get_running_loop()
+        index = await loop.run_in_executor(None, self.ai.choose, self.game)
+        self.play(index)
+
     async def button_callback(
         self,
         button: tungsten.Button,
@@ -227,47 +281,83 @@ class TicTacToeButtons(tungsten.Components):
         y: int,
         interaction: hikari.ComponentInteraction,
     ) -> None:
+        index = y * self.game.width + x
+        if interaction.user.id != self.player_for(
+            self.game.player
+        ).id or not self.game.is_legal(index):
+            await interaction.execute(
+                "You can't make that move.", flags=hikari.MessageFlag.EPHEMERAL
+            )
+            return
 
-        if interaction.user.id == self.player1.id:
-            currentPlayer = self.player1
-            state_cycle = {0: 1, 1: 1, 2: 2}
-        else:
-            currentPlayer = self.player2
-            state_cycle = {0: 2, 1: 1, 2: 2}
-
-        self.button_group.edit_button(x, y, state=state_cycle[button.state])
-
-        winnerPresent = self.check_winner()
-        self.turn += 1
+        self.play(index)
+        if self.is_bot_turn():
+            await self.play_bot_move()
 
-        if winnerPresent:
+        if self.game.is_over:
             self.disable_components()
-            await self.edit_msg(
-                f"{interaction.user.mention} has won the game!", components=self.build()
-            )
-        elif not winnerPresent and self.turn == 9:
-            self.disable_components()
-            await self.edit_msg(f"It's a Tie!", components=self.build())
-        elif not winnerPresent and self.turn != 9:
+        await self.edit_msg(self.status(), components=self.build())
+
+    # The board's buttons are sent with "x,y" custom IDs
+    async def handle(self, event: hikari.InteractionCreateEvent) -> None:
+        interaction = event.interaction
+        # Acknowledge the click, the board message is edited afterwards
+        await interaction.create_initial_response(
+            hikari.ResponseType.DEFERRED_MESSAGE_UPDATE
+        )
+        x, y = (int(i) for i in interaction.custom_id.split(","))
+        button = self.button_group.button_rows[y][x]
+        await self.button_callback(button, x, y, interaction)
 
-            if currentPlayer.id == self.player1.id:
-                await self.edit_msg(
-                    f"{self.player2.mention}, it is your turn!", components=self.build()
-                )
-            else:
-                await self.edit_msg(
-                    f"{self.player1.mention}, it is your turn!", components=self.build()
-                )
+    # Called when the game is over, the session ends with it
+    def deactivate_components(self) -> None:
+        super().deactivate_components()
+        self.closed = True
+
+    async def expire(self) -> None:
+        await self.timeout_callback()
 
 
 @fun_group.child
 @lightbulb.option("player1", "Player 1", hikari.Member, required=True)
 @lightbulb.option("player2", "Player 2", hikari.Member, required=True)
-@lightbulb.command("ttt", "Play a game of tic tac toe")
+@lightbulb.option(
+    "columns",
+    "Number of columns on the board",
+    int,
+    required=False,
+    min_value=3,
+    max_value=MAX_SIZE,
+    default=3,
+)
+@lightbulb.option(
+    "rows",
+    "Number of rows on the board",
+    int,
+    required=False,
+    min_value=3,
+    max_value=MAX_SIZE,
+    default=3,
+)
+@lightbulb.option(
+    "win_length",
+    "Number of marks in a row needed to win",
+    int,
+    required=False,
+    min_value=3,
+    max_value=MAX_SIZE,
+    default=3,
+)
+@lightbulb.command(
+    "ttt", "Play a game of tic tac toe, pick the bot as a player to play against it"
+)
 @lightbulb.implements(lightbulb.SlashSubCommand, lightbulb.PrefixSubCommand)
 async def tictactoe_subcommand(ctx: lightbulb.Context) -> None:
     player1 = ctx.get_guild().get_member(ctx.options.player1)
     player2 = ctx.get_guild().get_member(ctx.options.player2)
+    columns = ctx.options.columns
+    rows = ctx.options.rows
+    win_length = ctx.options.win_length
 
     if not player1:
         await ctx.respond("Player 1 is not in the server.")
@@ -277,13 +367,21 @@ async def tictactoe_subcommand(ctx: lightbulb.Context) -> None:
         return
     if player1.id == player2.id:
         await ctx.respond(f"{ctx.user.mention}, player 1 cannot be equal to player 2.")
+        return
+    if win_length > max(columns, rows):
+        await ctx.respond(
+            f"{ctx.user.mention}, nobody can get {win_length} in a row on a {columns}x{rows} board."
+        )
+        return
 
-    buttons = TicTacToeButtons(ctx)
+    buttons = TicTacToeButtons(ctx, game=Board(columns, rows, win_length))
     buttons.set_players(player1, player2)
-    resp = await ctx.respond(
-        f"{player1.mention}, it is your turn!", components=buttons.build()
-    )
-    await buttons.run(resp)
+    if buttons.is_bot_turn():
+        await buttons.play_bot_move()
+
+    resp = await ctx.respond(buttons.status(), components=buttons.build())
+    buttons.message = await resp.message()
+    sessions.registry.add(buttons.message.id, buttons)
 
 
 """
@@ -1,6 +1,9 @@
 import hikari
 import lightbulb
 
+INTENTS = hikari.Intents.NONE
+CACHE_COMPONENTS = hikari.api.CacheComponents.NONE
+
 music_plugin = lightbulb.Plugin("Music", "Music plugin of RotiBot")
 
 
@@ -1,39 +1,132 @@
+import collections
+import copy
+import os
+import typing as t
 from datetime import datetime
 
 import hikari
 import lightbulb
 
+import rotibot.deferral as deferral
+import rotibot.roles as roles
+
+# Members and their roles are read from the cache, role and member updates
+# invalidate rendered embeds
+INTENTS = hikari.Intents.GUILDS | hikari.Intents.GUILD_MEMBERS
+CACHE_COMPONENTS = (
+    hikari.api.CacheComponents.GUILDS
+    | hikari.api.CacheComponents.MEMBERS
+    | hikari.api.CacheComponents.ROLES
+)
+
 userinfo_plugin = lightbulb.Plugin("UserInfo")
 
 
-@userinfo_plugin.command
-@lightbulb.option(
-    "target", "The member to get information about.", hikari.User, required=False
-)
-@lightbulb.command("userinfo", "Get info on a server member.")
-@lightbulb.implements(lightbulb.PrefixCommand, lightbulb.SlashCommand)
-async def userinfo(ctx: lightbulb.Context) -> None:
-    target = ctx.get_guild().get_member(ctx.options.target or ctx.user)
+"""
+LRU cache of rendered userinfo embeds, keyed by (guild ID, member ID). Entries
+hold everything but the footer and timestamp, which depend on who asked and
+when. An entry is dropped when its member is updated or one of its roles is
+updated or deleted.
+"""
 
-    if not target:
-        await ctx.respond("That user is not in the server.")
-        return
 
+class EmbedCache:
+    def __init__(self, max_size: int = 1000) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._embeds: t.OrderedDict[t.Tuple[int, int], hikari.Embed] = (
+            collections.OrderedDict()
+        )
+        # role ID -> keys of the cached embeds that list the role
+        self._role_keys: t.Dict[int, t.Set[t.Tuple[int, int]]] = dict()
+        self._key_roles: t.Dict[t.Tuple[int, int], t.List[int]] = dict()
+
+    def __len__(self) -> int:
+        return len(self._embeds)
+
+    def get(self, guild_id: int, member_id: int) -> t.Optional[hikari.Embed]:
+        key = (int(guild_id), int(member_id))
+        embed = self._embeds.get(key)
+        if embed is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._embeds.move_to_end(key)
+        return embed
+
+    def put(
+        self,
+        guild_id: int,
+        member_id: int,
+        embed: hikari.Embed,
+        role_ids: t.Iterable[int],
+    ) -> None:
+        key = (int(guild_id), int(member_id))
+        self._discard(key)
+        self._embeds[key] = embed
+        self._key_roles[key] = [int(role_id) for role_id in role_ids]
+        for role_id in self._key_roles[key]:
+            self._role_keys.setdefault(role_id, set()).add(key)
+
+        while len(self._embeds) > self.max_size:
+            self._discard(next(iter(self._embeds)))
+
+    def invalidate_member(self, guild_id: int, member_id: int) -> None:
+        self._discard((int(guild_id), int(member_id)))
+
+    def invalidate_role(self, role_id: int) -> None:
+        for key in list(self._role_keys.get(int(role_id), ())):
+            self._discard(key)
+
+    def _discard(self, key: t.Tuple[int, int]) -> None:
+        if self._embeds.pop(key, None) is None:
+            return
+
+        for role_id in self._key_roles.pop(key):
+            keys = self._role_keys[role_id]
+            keys.discard(key)
+            if not keys:
+                del self._role_keys[role_id]
+
+
+embed_cache = EmbedCache(max_size=int(os.getenv("USERINFO_CACHE_SIZE", 1000)))
+
+
+@userinfo_plugin.listener(hikari.MemberUpdateEvent)
+async def on_member_update(event: hikari.MemberUpdateEvent) -> None:
+    embed_cache.invalidate_member(event.guild_id, event.user_id)
+
+
+@userinfo_plugin.listener(hikari.MemberDeleteEvent)
+async def on_member_delete(event: hikari.MemberDeleteEvent) -> None:
+    embed_cache.invalidate_member(event.guild_id, event.user_id)
+
+
+@userinfo_plugin.listener(hikari.RoleUpdateEvent)
+async def on_role_update(event: hikari.RoleUpdateEvent) -> None:
+    roles.resolver.invalidate(event.guild_id)
+    embed_cache.invalidate_role(event.role_id)
+
+
+@userinfo_plugin.listener(hikari.RoleDeleteEvent)
+async def on_role_delete(event: hikari.RoleDeleteEvent) -> None:
+    roles.resolver.invalidate(event.guild_id)
+    embed_cache.invalidate_role(event.role_id)
+
+
+async def render_member(target: hikari.Member) -> hikari.Embed:
     created_at = int(target.created_at.timestamp())
     joined_at = int(target.joined_at.timestamp())
 
-    roles = (await target.fetch_roles())[1:]
+    member_roles = await roles.resolver.member_roles(target)
 
     embed = (
         hikari.Embed(
             title=f"User Info - {target.display_name}",
             description=f"ID: `{target.id}`",
             colour=0x3B9DFF,
-            timestamp=datetime.now().astimezone(),
-        )
-        .set_footer(
-            text=f"Requested by {ctx.member.display_name}",
-            icon=ctx.member.avatar_url or ctx.member.default_avatar_url,
         )
         .set_thumbnail(target.avatar_url or target.default_avatar_url)
         .add_field(
@@ -53,13 +146,41 @@ async def userinfo(ctx: lightbulb.Context) -> None:
         )
         .add_field(
             "Roles",
-            ", ".join(r.mention for r in roles),
+            ", ".join(r.mention for r in member_roles),
             inline=False,
         )
     )
+    embed_cache.put(target.guild_id, target.id, embed, (r.id for r in member_roles))
+    return embed
+
+
+@userinfo_plugin.command
+@lightbulb.option(
+    "target", "The member to get information about.", hikari.User, required=False
+)
+@lightbulb.command("userinfo", "Get info on a server member.")
+@lightbulb.implements(lightbulb.PrefixCommand, lightbulb.SlashCommand)
+@deferral.defer_after()
+async def userinfo(ctx: lightbulb.Context) -> None:
+    target = ctx.get_guild().get_member(ctx.options.target or ctx.user)
+
+    if not target:
+        await ctx.respond("That user is not in the server.")
+        return
+
+    embed = embed_cache.get(target.guild_id, target.id) or await render_member(target)
+
+    # Cached embeds are shared, so the footer and timestamp go on a copy
+    embed = copy.copy(embed).set_footer(
+        text=f"Requested by {ctx.member.display_name}",
+        icon=ctx.member.avatar_url or ctx.member.default_avatar_url,
+    )
+    embed.timestamp = datetime.now().astimezone()
 
     await ctx.respond(embed)
 
 
 def load(bot: lightbulb.BotApp) -> None:
     bot.add_plugin(userinfo_plugin)
+    bot.d.role_resolver = roles.resolver
+    bot.d.userinfo_embeds = embed_cache
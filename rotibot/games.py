@@ -0,0 +1,281 @@
+import functools
+import time
+import typing as t
+
+"""
+Connect-K board engine. Each player's marks are a bitboard, bit y * width + x
+being the cell in row y and column x. All winning lines of a board shape are
+precomputed as masks, so a move only has to be checked against the lines
+that pass through its cell instead of rescanning the board.
+"""
+
+EMPTY = 0
+X = 1
+O = 2
+
+# Discord allows at most 5 rows of 5 buttons per message
+MAX_SIZE = 5
+
+
+@functools.lru_cache(maxsize=None)
+def win_masks(
+    width: int, height: int, k: int
+) -> t.Tuple[t.Tuple[int, ...], t.Tuple[t.Tuple[int, ...], ...]]:
+    masks = []
+    for y in range(height):
+        for x in range(width):
+            for dx, dy in ((1, 0), (0, 1), (1, 1), (1, -1)):
+                end_x, end_y = x + dx * (k - 1), y + dy * (k - 1)
+                if not (0 <= end_x < width and 0 <= end_y < height):
+                    continue
+
+                mask = 0
+                for step in range(k):
+                    mask |= 1 << ((y + dy * step) * width + x + dx * step)
+                masks.append(mask)
+
+    # Winning lines through each cell
+    cell_masks = tuple(
+        tuple(mask for mask in masks if mask & (1 << cell))
+        for cell in range(width * height)
+    )
+    return tuple(masks), cell_masks
+
+
+class Board:
+    __slots__ = (
+        "width",
+        "height",
+        "k",
+        "boards",
+        "turn",
+        "winner",
+        "full_board",
+        "masks",
+        "cell_masks",
+    )
+
+    def __init__(self, width: int = 3, height: int = 3, k: int = 3) -> None:
+        if not (1 <= width <= MAX_SIZE and 1 <= height <= MAX_SIZE):
+            raise ValueError(f"Board can be at most {MAX_SIZE}x{MAX_SIZE}")
+        if not (1 <= k <= max(width, height)):
+            raise ValueError(f"Can't get {k} in a row on a {width}x{height} board")
+
+        self.width = width
+        self.height = height
+        self.k = k
+        # boards[0] holds X's marks, boards[1] holds O's
+        self.boards = [0, 0]
+        self.turn = 0
+        self.winner = EMPTY
+        self.full_board = (1 << (width * height)) - 1
+        self.masks, self.cell_masks = win_masks(width, height, k)
+
+    # Mark of the player whose turn it is
+    @property
+    def player(self) -> int:
+        return X if self.turn % 2 == 0 else O
+
+    @property
+    def is_over(self) -> bool:
+        return (
+            self.winner != EMPTY or (self.boards[0] | self.boards[1]) == self.full_board
+        )
+
+    def cell(self, index: int) -> int:
+        bit = 1 << index
+        if self.boards[0] & bit:
+            return X
+        if self.boards[1] & bit:
+            return O
+        return EMPTY
+
+    def is_legal(self, index: int) -> bool:
+        return (
+            not self.is_over
+            and 0 <= index < self.width * self.height
+            and not (self.boards[0] | self.boards[1]) & (1 << index)
+        )
+
+    def legal_moves(self) -> t.List[int]:
+        if self.is_over:
+            return []
+        taken = self.boards[0] | self.boards[1]
+        return [
+            index
+            for index in range(self.width * self.height)
+            if not taken & (1 << index)
+        ]
+
+    # Place the current player's mark, returns True if the move won the game
+    def play(self, index: int) -> bool:
+        if not self.is_legal(index):
+            raise ValueError(f"Illegal move on cell {index}")
+
+        player = self.turn % 2
+        board = self.boards[player] | (1 << index)
+        self.boards[player] = board
+        self.turn += 1
+
+        for mask in self.cell_masks[index]:
+            if board & mask == mask:
+                self.winner = X if player == 0 else O
+                return True
+        return False
+
+    # Take back the last move, which was made on index
+    def undo(self, index: int) -> None:
+        self.turn -= 1
+        self.boards[self.turn % 2] &= ~(1 << index)
+        self.winner = EMPTY
+
+    def cells(self) -> t.List[int]:
+        return [self.cell(index) for index in range(self.width * self.height)]
+
+
+class TicTacToe(Board):
+    __slots__ = ()
+
+    def __init__(self) -> None:
+        super().__init__(3, 3, 3)
+
+
+"""
+Computer opponent. Runs an iterative deepening negamax search with alpha-beta
+pruning and a transposition table, and returns the best move of the deepest
+search that finished within the time budget.
+"""
+
+WIN_SCORE = 1000000
+
+_EXACT = 0
+_LOWER = 1
+_UPPER = 2
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class BoardAI:
+    def __init__(self, budget: float = 0.5, table_size: int = 200000) -> None:
+        self.budget = budget
+        self.table_size = table_size
+        self._table: t.Dict[t.Tuple[int, int], t.Tuple[int, int, int, int]] = dict()
+        self._deadline = 0.0
+
+    def choose(self, board: Board) -> int:
+        moves = board.legal_moves()
+        if not moves:
+            raise ValueError("No legal moves left")
+
+        # Prefer central cells, they are part of the most winning lines
+        moves.sort(key=lambda index: -len(board.cell_masks[index]))
+        best_move = moves[0]
+
+        self._deadline = time.perf_counter() + self.budget
+        if len(self._table) > self.table_size:
+            self._table.clear()
+
+        try:
+            for depth in range(1, len(moves) + 1):
+                score, move = self._search_root(board, moves, depth)
+                best_move = move
+                if abs(score) >= WIN_SCORE - board.width * board.height:
+                    break
+                # Search the previous best move first next time
+                moves.remove(move)
+                moves.insert(0, move)
+        except _OutOfTime:
+            pass
+
+        return best_move
+
+    def _search_root(
+        self, board: Board, moves: t.List[int], depth: int
+    ) -> t.Tuple[int, int]:
+        alpha, beta = -WIN_SCORE - 1, WIN_SCORE + 1
+        best_score, best_move = -WIN_SCORE - 1, moves[0]
+
+        for move in moves:
+            board.play(move)
+            try:
+                score = -self._search(board, depth - 1, -beta, -alpha, 1)
+            finally:
+                board.undo(move)
+
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+
+        return best_score, best_move
+
+    def _search(self, board: Board, depth: int, alpha: int, beta: int, ply: int) -> int:
+        if time.perf_counter() > self._deadline:
+            raise _OutOfTime
+
+        # The player who just moved won, which is a loss for the player to move
+        if board.winner != EMPTY:
+            return -(WIN_SCORE - ply)
+        if (board.boards[0] | board.boards[1]) == board.full_board:
+            return 0
+        if depth == 0:
+            return self._evaluate(board)
+
+        key = (board.boards[0], board.boards[1])
+        entry = self._table.get(key)
+        table_move = None
+        if entry is not None:
+            entry_depth, entry_score, entry_flag, table_move = entry
+            if entry_depth >= depth:
+                if entry_flag == _EXACT:
+                    return entry_score
+                if entry_flag == _LOWER:
+                    alpha = max(alpha, entry_score)
+                elif entry_flag == _UPPER:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score
+
+        moves = board.legal_moves()
+        if table_move is not None:
+            moves.remove(table_move)
+            moves.insert(0, table_move)
+
+        original_alpha = alpha
+        best_score, best_move = -WIN_SCORE - 1, moves[0]
+        for move in moves:
+            board.play(move)
+            try:
+                score = -self._search(board, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                board.undo(move)
+
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = _UPPER
+        elif best_score >= beta:
+            flag = _LOWER
+        else:
+            flag = _EXACT
+        self._table[key] = (depth, best_score, flag, best_move)
+
+        return best_score
+
+    # Score open lines, from the point of view of the player to move
+    def _evaluate(self, board: Board) -> int:
+        mine = board.boards[board.turn % 2]
+        theirs = board.boards[1 - board.turn % 2]
+
+        score = 0
+        for mask in board.masks:
+            if mask & theirs == 0:
+                score += 4 ** bin(mask & mine).count("1")
+            if mask & mine == 0:
+                score -= 4 ** bin(mask & theirs).count("1")
+        return score
@@ -0,0 +1,135 @@
+import asyncio
+import collections
+import importlib
+import logging
+import os
+import time
+import tracemalloc
+import typing as t
+from pathlib import Path
+from types import ModuleType
+
+import hikari
+
+logger = logging.getLogger("rotibot.gateway")
+
+"""
+Gateway intent and cache profile. Every extension declares the INTENTS it
+needs events for and the CACHE_COMPONENTS it reads from, and the bot is
+started with the union of those instead of everything hikari offers.
+"""
+
+# Prefix commands need guild messages and their content
+BASE_INTENTS = (
+    hikari.Intents.GUILDS
+    | hikari.Intents.GUILD_MESSAGES
+    | hikari.Intents.MESSAGE_CONTENT
+)
+# lightbulb resolves guilds and the bot user from the cache
+BASE_CACHE_COMPONENTS = (
+    hikari.api.CacheComponents.GUILDS | hikari.api.CacheComponents.ME
+)
+
+# Set to "all" to run with every intent and the default cache, for comparison
+PROFILE = os.getenv("GATEWAY_PROFILE", "derived")
+
+
+# Import every extension module in path, the same way lightbulb loads them
+def extension_modules(path: str) -> t.List[ModuleType]:
+    modules = []
+    for ext_path in sorted(Path(path).glob("[!_]*.py")):
+        name = str(ext_path.with_suffix("")).replace(os.sep, ".")
+        modules.append(importlib.import_module(name))
+    return modules
+
+
+def profile(
+    modules: t.Iterable[ModuleType],
+) -> t.Tuple[hikari.Intents, hikari.api.CacheComponents]:
+    if PROFILE == "all":
+        return hikari.Intents.ALL, hikari.api.CacheComponents.ALL
+
+    intents = BASE_INTENTS
+    components = BASE_CACHE_COMPONENTS
+    for module in modules:
+        intents |= getattr(module, "INTENTS", hikari.Intents.NONE)
+        components |= getattr(
+            module, "CACHE_COMPONENTS", hikari.api.CacheComponents.NONE
+        )
+    return intents, components
+
+
+"""
+Measurement mode, enabled by setting GATEWAY_STATS to a report interval in
+seconds. Counts gateway events by type and periodically logs the event rate,
+the number of cached entities and the memory held by the process.
+"""
+
+STATS_INTERVAL = float(os.getenv("GATEWAY_STATS", 0))
+
+
+class GatewayMonitor:
+    def __init__(self, bot: hikari.GatewayBot, interval: float = 60) -> None:
+        self.bot = bot
+        self.interval = interval
+        self.events: t.Counter[str] = collections.Counter()
+        self._task: t.Optional[asyncio.Task[None]] = None
+
+    def attach(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.bot.subscribe(hikari.Event, self.on_event)
+        self.bot.subscribe(hikari.StartedEvent, self.on_started)
+        self.bot.subscribe(hikari.StoppingEvent, self.on_stopping)
+
+    async def on_event(self, event: hikari.Event) -> None:
+        self.events[type(event).__name__] += 1
+
+    async def on_started(self, event: hikari.StartedEvent) -> None:
+        self._task = asyncio.create_task(self._report_loop())
+
+    async def on_stopping(self, event: hikari.StoppingEvent) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def cache_sizes(self) -> t.Dict[str, int]:
+        cache = self.bot.cache
+        return {
+            "guilds": len(cache.get_guilds_view()),
+            "channels": len(cache.get_guild_channels_view()),
+            "roles": len(cache.get_roles_view()),
+            "members": sum(map(len, cache.get_members_view().values())),
+            "presences": sum(map(len, cache.get_presences_view().values())),
+            "voice_states": sum(map(len, cache.get_voice_states_view().values())),
+            "messages": len(cache.get_messages_view()),
+            "users": len(cache.get_users_view()),
+        }
+
+    def report(self, elapsed: float) -> None:
+        total = sum(self.events.values())
+        busiest = ", ".join(
+            f"{name} {count / elapsed:.2f}/s"
+            for name, count in self.events.most_common(5)
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        logger.info(
+            "Gateway (%s profile): %.2f events/s [%s]",
+            PROFILE,
+            total / elapsed,
+            busiest,
+        )
+        logger.info(
+            "Cache: %s, memory %.1fMiB (peak %.1fMiB)",
+            ", ".join(f"{name} {size:,}" for name, size in self.cache_sizes().items()),
+            current / 2**20,
+            peak / 2**20,
+        )
+
+    async def _report_loop(self) -> None:
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.report(now - last)
+            self.events.clear()
+            last = now
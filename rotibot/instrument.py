@@ -0,0 +1,201 @@
+import logging
+import os
+import typing as t
+
+import hikari
+import lightbulb
+from aiohttp import web
+
+import rotibot.metrics as metrics
+import rotibot.network as network
+
+logger = logging.getLogger("rotibot.instrument")
+
+# host:port of the metrics endpoint, empty to disable it. Workers of a
+# cluster serve on the ports after it, one each.
+METRICS_ADDRESS = os.getenv("METRICS_ADDRESS", "127.0.0.1:9464")
+
+"""
+Contexts whose responses are timed as REST calls
+"""
+
+
+class _TimedResponses:
+    __slots__ = ()
+
+    async def respond(self, *args: t.Any, **kwargs: t.Any) -> lightbulb.ResponseProxy:
+        with metrics.phase("rest"):
+            return await super().respond(*args, **kwargs)
+
+    async def edit_last_response(
+        self, *args: t.Any, **kwargs: t.Any
+    ) -> t.Optional[hikari.Message]:
+        with metrics.phase("rest"):
+            return await super().edit_last_response(*args, **kwargs)
+
+    async def delete_last_response(self) -> None:
+        with metrics.phase("rest"):
+            await super().delete_last_response()
+
+
+class TimedPrefixContext(_TimedResponses, lightbulb.PrefixContext):
+    __slots__ = ()
+
+
+class TimedSlashContext(_TimedResponses, lightbulb.SlashContext):
+    __slots__ = ()
+
+
+"""
+Bot that measures every command it invokes, prefix and slash alike, from
+before its checks and cooldowns run until it and its error handling are done.
+"""
+
+
+class InstrumentedBotApp(lightbulb.BotApp):
+    async def get_prefix_context(
+        self,
+        event: hikari.MessageCreateEvent,
+        cls: t.Type[lightbulb.PrefixContext] = TimedPrefixContext,
+    ) -> t.Optional[lightbulb.PrefixContext]:
+        return await super().get_prefix_context(event, cls)
+
+    async def get_slash_context(
+        self,
+        event: hikari.InteractionCreateEvent,
+        command: lightbulb.SlashCommand,
+        cls: t.Type[lightbulb.SlashContext] = TimedSlashContext,
+    ) -> lightbulb.SlashContext:
+        return await super().get_slash_context(event, command, cls)
+
+    async def process_prefix_commands(self, context: lightbulb.PrefixContext) -> None:
+        if context.command is None:
+            return await super().process_prefix_commands(context)
+
+        with metrics.measure() as phases:
+            try:
+                await super().process_prefix_commands(context)
+            finally:
+                record(context, phases)
+
+    async def invoke_application_command(
+        self, context: lightbulb.ApplicationContext
+    ) -> None:
+        with metrics.measure() as phases:
+            try:
+                await super().invoke_application_command(context)
+            finally:
+                record(context, phases)
+
+
+# Subcommands are recorded under their own name, context.invoked is set once
+# the group has found them
+def command_name(context: lightbulb.Context) -> str:
+    return (context.invoked or context.command).qualname
+
+
+def record(context: lightbulb.Context, phases: t.Dict[str, float]) -> None:
+    metrics.registry.record_command(command_name(context), phases)
+
+
+"""
+Outcome counts, fed from lightbulb's completion and error events
+"""
+
+
+# Invocation errors are raised from the handler's exception, so they are
+# told apart before unwrapping
+def outcome_of(exception: BaseException) -> str:
+    if isinstance(exception, lightbulb.CommandInvocationError):
+        return "error"
+    exception = exception.__cause__ or exception
+    if isinstance(exception, lightbulb.CommandIsOnCooldown):
+        return "cooldown"
+    if isinstance(exception, lightbulb.MissingRequiredPermission):
+        return "permission"
+    if isinstance(exception, lightbulb.CheckFailure):
+        return "check"
+    return "other"
+
+
+async def on_command_completion(event: lightbulb.events.CommandCompletionEvent) -> None:
+    metrics.registry.count_outcome(command_name(event.context), "ok")
+
+
+async def on_command_error(event: lightbulb.CommandErrorEvent) -> None:
+    if event.context.command is not None:
+        metrics.registry.count_outcome(
+            command_name(event.context), outcome_of(event.exception)
+        )
+
+
+"""
+Prometheus endpoint serving the registry and the external API counters at
+/metrics
+"""
+
+
+def render() -> str:
+    lines: t.List[str] = []
+    endpoints = sorted(network.stats.items())
+    for name in ("requests", "errors", "retries"):
+        metrics.render_counters(
+            lines,
+            f"rotibot_http_{name}_total",
+            f"External HTTP {name} by endpoint",
+            {
+                f'endpoint="{endpoint}"': getattr(endpoint_stats, name)
+                for endpoint, endpoint_stats in endpoints
+            },
+        )
+    return metrics.registry.render() + "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self._runner: t.Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+# Count the bot's command outcomes and serve the metrics while it runs.
+# port_offset moves the endpoint along for workers sharing a host.
+def attach(
+    bot: lightbulb.BotApp, address: str = METRICS_ADDRESS, port_offset: int = 0
+) -> None:
+    bot.subscribe(lightbulb.events.CommandCompletionEvent, on_command_completion)
+    bot.subscribe(lightbulb.CommandErrorEvent, on_command_error)
+    bot.d.metrics = metrics.registry
+    if not address:
+        return
+
+    host, _, port = address.rpartition(":")
+    server = MetricsServer(host, int(port) + port_offset)
+
+    async def on_starting(event: hikari.StartingEvent) -> None:
+        try:
+            await server.start()
+        except OSError:
+            logger.exception("Couldn't serve metrics on %s:%d", host, server.port)
+
+    async def on_stopping(event: hikari.StoppingEvent) -> None:
+        await server.stop()
+
+    bot.subscribe(hikari.StartingEvent, on_starting)
+    bot.subscribe(hikari.StoppingEvent, on_stopping)
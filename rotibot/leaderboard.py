@@ -0,0 +1,60 @@
+import typing as t
+
+from sortedcontainers import SortedList
+
+import rotibot.storage as store
+
+"""
+Leaderboard index kept in sync with the ledger. Accounts are sorted by
+(-score, discordID) so the richest come first and ties have a stable order.
+Scores don't move when passive income is paid, so only accounts whose balance
+changed need to be reindexed.
+"""
+
+
+class Leaderboard:
+    def __init__(self, ledger: store.Ledger) -> None:
+        self.ledger = ledger
+        self._keys: t.Dict[int, t.Tuple[int, int]] = dict()
+        self._index = SortedList()
+        ledger.add_listener(self.update)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    # len() for callers that may have a worker's remote leaderboard
+    def size(self) -> int:
+        return len(self._index)
+
+    # Reindex one account, or everything when user_id is None
+    def update(self, user_id: t.Optional[int]) -> None:
+        if user_id is None:
+            self._keys = {
+                discordID: (-self.ledger.get_score(discordID), discordID)
+                for discordID, _, _ in self.ledger.items()
+            }
+            self._index = SortedList(self._keys.values())
+            return
+
+        old_key = self._keys.get(user_id)
+        if old_key is not None:
+            self._index.remove(old_key)
+
+        key = (-self.ledger.get_score(user_id), user_id)
+        self._keys[user_id] = key
+        self._index.add(key)
+
+    # Returns (discordID, username, balance) of the num_users richest accounts
+    def top(self, num_users: int) -> t.List[t.Tuple[int, str, int]]:
+        return [
+            (
+                discordID,
+                self.ledger.get_username(discordID),
+                self.ledger.get_balance(discordID),
+            )
+            for _, discordID in self._index.islice(0, num_users)
+        ]
+
+    # Returns 1-based leaderboard position of an account
+    def rank(self, user_id: int) -> int:
+        return self._index.index(self._keys[user_id]) + 1
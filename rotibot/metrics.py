@@ -0,0 +1,225 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import time
+import typing as t
+
+"""
+Command and task metrics. Every command invocation is timed as a whole (the
+handler phase) and split into the time it spent waiting on storage, on
+Discord's REST API and on external HTTP APIs. Outcomes and deferred
+interactions are counted per command, and task runs are timed per task. rotibot.instrument feeds the
+registry from the bot and serves it, this module has no dependencies so the
+storage layer can report into it.
+"""
+
+# Upper bounds in seconds, from a journal write to a slow external API
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ("handler", "storage", "rest", "http")
+
+
+class Histogram:
+    def __init__(self, buckets: t.Sequence[float] = BUCKETS) -> None:
+        self.buckets = buckets
+        # One count per bucket upper bound, plus one for everything slower
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    # Upper bound of the bucket holding the given quantile, inf if that is
+    # past the last bucket
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    def __init__(self) -> None:
+        # (command, phase) -> latencies
+        self.commands: t.Dict[t.Tuple[str, str], Histogram] = dict()
+        # (command, outcome) -> count
+        self.outcomes: t.Dict[t.Tuple[str, str], int] = dict()
+        # command -> interactions deferred for taking too long to respond
+        self.deferrals: t.Dict[str, int] = dict()
+        self.tasks: t.Dict[str, Histogram] = dict()
+        # (task, outcome) -> count
+        self.task_outcomes: t.Dict[t.Tuple[str, str], int] = dict()
+
+    def record_command(self, command: str, phases: t.Dict[str, float]) -> None:
+        for phase, seconds in phases.items():
+            key = (command, phase)
+            histogram = self.commands.get(key)
+            if histogram is None:
+                histogram = self.commands[key] = Histogram()
+            histogram.record(seconds)
+
+    def count_outcome(self, command: str, outcome: str) -> None:
+        key = (command, outcome)
+        self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+    def count_deferral(self, command: str) -> None:
+        self.deferrals[command] = self.deferrals.get(command, 0) + 1
+
+    def record_task(self, task: str, seconds: float, outcome: str) -> None:
+        self.tasks.setdefault(task, Histogram()).record(seconds)
+        key = (task, outcome)
+        self.task_outcomes[key] = self.task_outcomes.get(key, 0) + 1
+
+    # The registry in the Prometheus text format
+    def render(self) -> str:
+        lines: t.List[str] = []
+        render_histograms(
+            lines,
+            "rotibot_command_seconds",
+            "Command latency by phase",
+            {
+                f'command="{command}",phase="{phase}"': histogram
+                for (command, phase), histogram in sorted(self.commands.items())
+            },
+        )
+        render_counters(
+            lines,
+            "rotibot_command_outcomes_total",
+            "Command invocations by outcome",
+            {
+                f'command="{command}",outcome="{outcome}"': count
+                for (command, outcome), count in sorted(self.outcomes.items())
+            },
+        )
+        render_counters(
+            lines,
+            "rotibot_command_deferrals_total",
+            "Command interactions deferred for responding slowly",
+            {
+                f'command="{command}"': count
+                for command, count in sorted(self.deferrals.items())
+            },
+        )
+        render_histograms(
+            lines,
+            "rotibot_task_seconds",
+            "Task run duration",
+            {f'task="{task}"': h for task, h in sorted(self.tasks.items())},
+        )
+        render_counters(
+            lines,
+            "rotibot_task_runs_total",
+            "Task runs by outcome",
+            {
+                f'task="{task}",outcome="{outcome}"': count
+                for (task, outcome), count in sorted(self.task_outcomes.items())
+            },
+        )
+        return "\n".join(lines) + "\n"
+
+
+def render_histograms(
+    lines: t.List[str], name: str, help: str, histograms: t.Dict[str, Histogram]
+) -> None:
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in histograms.items():
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+def render_counters(
+    lines: t.List[str], name: str, help: str, counters: t.Dict[str, int]
+) -> None:
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} counter")
+    for labels, count in counters.items():
+        lines.append(f"{name}{{{labels}}} {count}")
+
+
+registry = Registry()
+
+
+"""
+Phase timing. An invocation's phase totals live in a context variable, so
+storage, REST and HTTP calls made anywhere while a command runs add their
+time to it without being handed anything. Outside of a command phase() only
+costs a lookup.
+"""
+
+_phases: contextvars.ContextVar[t.Optional[t.Dict[str, float]]] = (
+    contextvars.ContextVar("rotibot_phases", default=None)
+)
+
+
+@contextlib.contextmanager
+def phase(name: str) -> t.Iterator[None]:
+    phases = _phases.get()
+    if phases is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases[name] + time.perf_counter() - start
+
+
+# Stop timing into the command that started the current task. For background
+# work a command doesn't wait on, the task inherited the command's context.
+def detach() -> None:
+    _phases.set(None)
+
+
+# Collect the phases of the code run inside, the handler phase is the whole
+# of it. The caller records the totals once it knows the command's name.
+@contextlib.contextmanager
+def measure() -> t.Iterator[t.Dict[str, float]]:
+    phases = {name: 0.0 for name in PHASES}
+    token = _phases.set(phases)
+    start = time.perf_counter()
+    try:
+        yield phases
+    finally:
+        phases["handler"] = time.perf_counter() - start
+        _phases.reset(token)
+
+
+"""
+Decorator for tasks.task jobs, placed under @tasks.task. Failures are counted
+and re-raised for the task's own error handling.
+"""
+
+
+def timed_task(
+    callback: t.Callable[..., t.Awaitable[None]],
+) -> t.Callable[..., t.Awaitable[None]]:
+    @functools.wraps(callback)
+    async def wrapper(*args: t.Any) -> None:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            await callback(*args)
+            outcome = "ok"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            registry.record_task(
+                callback.__name__, time.perf_counter() - start, outcome
+            )
+
+    return wrapper
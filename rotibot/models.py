@@ -0,0 +1,100 @@
+import typing as t
+
+from sqlalchemy import BigInteger, Column, String, create_engine, inspect, text
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from rotibot.database import DB_URI, LEGACY_GUILD_ID
+
+"""
+PostgreSQL Database setup
+"""
+engine = create_engine(DB_URI, pool_pre_ping=True)
+Session = sessionmaker(engine)
+base = declarative_base()
+
+
+class User(base):
+    __tablename__ = "User"
+    guildID = Column(BigInteger, primary_key=True)
+    discordID = Column(BigInteger, primary_key=True)
+    username = Column(String)
+    balance = Column(BigInteger)
+
+    def __repr__(self):
+        return "<User(guildID={}, discordID={}, username='{}', balance={})>".format(
+            self.guildID, self.discordID, self.username, self.balance
+        )
+
+
+"""
+Creates the table, or upgrades one from before balances were kept per guild.
+Existing rows are moved to LEGACY_GUILD_ID and guildID joins the primary key,
+which is refused when GUILD_ID isn't set rather than filing them under guild 0.
+Snowflakes and balances need 64 bits, tables created with 32 bit discordID
+and balance columns are widened.
+"""
+
+
+def upgrade_schema() -> None:
+    inspector = inspect(engine)
+    if not inspector.has_table(User.__tablename__):
+        base.metadata.create_all(engine)
+        return
+
+    columns = {
+        column["name"]: column["type"]
+        for column in inspector.get_columns(User.__tablename__)
+    }
+    if "guildID" not in columns:
+        add_guild_id(inspector)
+    widen_columns(columns)
+
+
+def add_guild_id(inspector: t.Any) -> None:
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError(
+            'The "User" table has no guildID column, only PostgreSQL tables are upgraded'
+        )
+    if not LEGACY_GUILD_ID:
+        raise RuntimeError(
+            'The "User" table has balances from before economies were split per'
+            " guild, set GUILD_ID to the guild they belong to"
+        )
+
+    primary_key = inspector.get_pk_constraint(User.__tablename__)["name"]
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                'ALTER TABLE "User" ADD COLUMN "guildID" BIGINT NOT NULL '
+                f"DEFAULT {int(LEGACY_GUILD_ID)}"
+            )
+        )
+        connection.execute(text(f'ALTER TABLE "User" DROP CONSTRAINT "{primary_key}"'))
+        connection.execute(
+            text('ALTER TABLE "User" ADD PRIMARY KEY ("guildID", "discordID")')
+        )
+        connection.execute(
+            text('ALTER TABLE "User" ALTER COLUMN "guildID" DROP DEFAULT')
+        )
+
+
+def widen_columns(columns: t.Dict[str, t.Any]) -> None:
+    # SQLite's INTEGER is already 64 bit
+    if engine.dialect.name != "postgresql":
+        return
+    narrow = [
+        name
+        for name in ("discordID", "balance")
+        if not isinstance(columns[name], BigInteger)
+    ]
+    if not narrow:
+        return
+
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                'ALTER TABLE "User" '
+                + ", ".join(f'ALTER COLUMN "{name}" TYPE BIGINT' for name in narrow)
+            )
+        )
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import random
+import time
+import typing as t
+
+import aiohttp
+
+import rotibot.metrics as metrics
+
+logger = logging.getLogger("rotibot.network")
+
+"""
+HTTP client settings, read from the environment so they can be tuned per
+deployment without code changes.
+"""
+
+
+class HTTPConfig:
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 10,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        total_timeout: float = 5,
+        connect_timeout: float = 2,
+        retries: int = 2,
+        backoff: float = 0.25,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.total_timeout = total_timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    @classmethod
+    def from_env(cls) -> "HTTPConfig":
+        return cls(
+            limit=int(os.getenv("HTTP_LIMIT", 100)),
+            limit_per_host=int(os.getenv("HTTP_LIMIT_PER_HOST", 10)),
+            keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30)),
+            dns_cache_ttl=int(os.getenv("HTTP_DNS_CACHE_TTL", 300)),
+            total_timeout=float(os.getenv("HTTP_TOTAL_TIMEOUT", 5)),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", 2)),
+            retries=int(os.getenv("HTTP_RETRIES", 2)),
+            backoff=float(os.getenv("HTTP_BACKOFF", 0.25)),
+        )
+
+
+"""
+Per-endpoint request counters
+"""
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+    def record(self, latency: float, error: bool) -> None:
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if error:
+            self.errors += 1
+
+
+config = HTTPConfig.from_env()
+stats: t.Dict[str, EndpointStats] = dict()
+
+
+# Create the shared aiohttp session with pooled, DNS-cached connections
+def build_session(config: HTTPConfig = config) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=config.limit,
+        limit_per_host=config.limit_per_host,
+        keepalive_timeout=config.keepalive_timeout,
+        ttl_dns_cache=config.dns_cache_ttl,
+        use_dns_cache=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config.total_timeout, connect=config.connect_timeout
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+"""
+GET a JSON document, retrying timeouts, connection errors and 5xx responses
+with jittered exponential backoff. Returns None for any other error status,
+and for a successful response that isn't JSON, asking again won't fix it.
+endpoint names the counters the request is recorded under.
+"""
+
+
+async def get_json(
+    session: aiohttp.ClientSession,
+    endpoint: str,
+    url: str,
+    config: HTTPConfig = config,
+) -> t.Optional[t.Any]:
+    endpoint_stats = stats.setdefault(endpoint, EndpointStats())
+
+    # Retries and backoff included, it is all time spent waiting on the API
+    with metrics.phase("http"):
+        for attempt in range(config.retries + 1):
+            if attempt:
+                endpoint_stats.retries += 1
+                await asyncio.sleep(random.uniform(0, config.backoff * 2**attempt))
+
+            start = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    if response.status < 500:
+                        res, error = None, not response.ok
+                        if response.ok:
+                            try:
+                                res = await response.json()
+                            # A ClientError, it mustn't reach the retry handler
+                            except (aiohttp.ContentTypeError, ValueError):
+                                error = True
+                                logger.warning("%s didn't return JSON", endpoint)
+                        endpoint_stats.record(time.perf_counter() - start, error=error)
+                        return res
+
+                    endpoint_stats.record(time.perf_counter() - start, error=True)
+                    logger.warning("%s returned a %d status", endpoint, response.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                endpoint_stats.record(time.perf_counter() - start, error=True)
+                if attempt == config.retries:
+                    raise
+
+        return None
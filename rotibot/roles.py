@@ -0,0 +1,72 @@
+import logging
+import os
+import time
+import typing as t
+
+import hikari
+
+import rotibot.metrics as metrics
+
+logger = logging.getLogger("rotibot.roles")
+
+"""
+Resolves a member's roles from the gateway cache, only falling back to a REST
+fetch of the guild's roles when one of them is missing from it. Each guild's
+roles are memoised for a few seconds so repeated lookups in a busy guild
+don't have to go through the cache (or REST) again.
+"""
+
+
+class RoleResolver:
+    def __init__(self, ttl: float = 30) -> None:
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # guild ID -> (expiry, role ID -> role)
+        self._memo: t.Dict[int, t.Tuple[float, t.Dict[int, hikari.Role]]] = dict()
+
+    # The member's roles, highest first, without the @everyone role
+    async def member_roles(self, member: hikari.Member) -> t.List[hikari.Role]:
+        guild_id = int(member.guild_id)
+        role_ids = [role_id for role_id in member.role_ids if role_id != guild_id]
+
+        guild_roles = self._guild_roles(member.app, guild_id)
+        if all(role_id in guild_roles for role_id in role_ids):
+            self.hits += 1
+        else:
+            self.misses += 1
+            guild_roles = await self._fetch_guild_roles(member.app, guild_id)
+
+        roles = [guild_roles[role_id] for role_id in role_ids if role_id in guild_roles]
+        roles.sort(key=lambda role: role.position, reverse=True)
+        return roles
+
+    def invalidate(self, guild_id: int) -> None:
+        self._memo.pop(int(guild_id), None)
+
+    def _guild_roles(
+        self, app: hikari.RESTAware, guild_id: int
+    ) -> t.Dict[int, hikari.Role]:
+        now = time.monotonic()
+        entry = self._memo.get(guild_id)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        roles: t.Dict[int, hikari.Role] = dict()
+        if isinstance(app, hikari.CacheAware):
+            roles.update(app.cache.get_roles_view_for_guild(guild_id))
+        self._memo[guild_id] = (now + self.ttl, roles)
+        return roles
+
+    async def _fetch_guild_roles(
+        self, app: hikari.RESTAware, guild_id: int
+    ) -> t.Dict[int, hikari.Role]:
+        logger.debug("Roles of guild %d missing from cache, fetching", guild_id)
+        with metrics.phase("rest"):
+            fetched = await app.rest.fetch_roles(guild_id)
+        roles = {int(role.id): role for role in fetched}
+        self._memo[guild_id] = (time.monotonic() + self.ttl, roles)
+        return roles
+
+
+resolver = RoleResolver(ttl=float(os.getenv("ROLE_MEMO_TTL", 30)))
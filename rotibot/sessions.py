@@ -0,0 +1,109 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+import typing as t
+
+import hikari
+
+logger = logging.getLogger("rotibot.sessions")
+
+"""
+Interactive message sessions (games, menus). Instead of every session waiting
+on its own wait_for predicate, which checks every interaction against every
+active session, one listener looks the session up by message ID.
+"""
+
+
+class Session:
+    def __init__(self) -> None:
+        self.closed = False
+        self.lock = asyncio.Lock()
+
+    # Handle a component interaction on the session's message. Set closed
+    # when the session is finished.
+    async def handle(self, event: hikari.InteractionCreateEvent) -> None:
+        pass
+
+    # Called when the session is evicted for being idle or over the cap
+    async def expire(self) -> None:
+        pass
+
+
+class SessionRegistry:
+    def __init__(self, max_sessions: int = 100, idle_timeout: float = 60) -> None:
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        # message ID -> (session, last activity), least recently used first
+        self._sessions: t.OrderedDict[int, t.Tuple[Session, float]] = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._sessions
+
+    # Register a session, evicting the least recently used one when full
+    def add(self, message_id: int, session: Session) -> None:
+        self._sessions[int(message_id)] = (session, time.monotonic())
+        self._sessions.move_to_end(int(message_id))
+
+        while len(self._sessions) > self.max_sessions:
+            _, (evicted, _) = self._sessions.popitem(last=False)
+            asyncio.create_task(self._expire(evicted))
+
+    def remove(self, message_id: int) -> None:
+        self._sessions.pop(int(message_id), None)
+
+    # Route a component interaction to its session, returns False if the
+    # message has no active session
+    async def dispatch(self, event: hikari.InteractionCreateEvent) -> bool:
+        if not isinstance(event.interaction, hikari.ComponentInteraction):
+            return False
+
+        message_id = int(event.interaction.message.id)
+        entry = self._sessions.get(message_id)
+        if entry is None:
+            return False
+
+        session = entry[0]
+        self._sessions[message_id] = (session, time.monotonic())
+        self._sessions.move_to_end(message_id)
+
+        async with session.lock:
+            if not session.closed:
+                await session.handle(event)
+        if session.closed:
+            self.remove(message_id)
+        return True
+
+    # Expire every session that has been idle for longer than idle_timeout.
+    # Sessions are kept in order of last activity, so this stops at the first
+    # one that is still active.
+    async def evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        while self._sessions:
+            message_id, (session, last_active) = next(iter(self._sessions.items()))
+            if last_active > deadline:
+                break
+
+            del self._sessions[message_id]
+            await self._expire(session)
+
+    async def _expire(self, session: Session) -> None:
+        try:
+            async with session.lock:
+                if not session.closed:
+                    session.closed = True
+                    await session.expire()
+        except Exception:
+            logger.exception("Expiring session failed")
+
+
+registry = SessionRegistry(
+    max_sessions=int(os.getenv("MAX_SESSIONS", 100)),
+    idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", 60)),
+)
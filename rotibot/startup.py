@@ -0,0 +1,92 @@
+import asyncio
+import contextlib
+import logging
+import time
+import typing as t
+
+logger = logging.getLogger("rotibot.startup")
+
+"""
+Startup phase timings. Phases may overlap (the ledger loads while the gateway
+connects), so each is recorded with its start and end relative to when the
+process started importing, and the report lists them in the order they began.
+"""
+
+
+class StartupTimer:
+    def __init__(self) -> None:
+        self.origin = time.perf_counter()
+        self.phases: t.List[t.Tuple[str, float, float]] = []
+        self._marks: t.Dict[str, float] = dict()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> t.Iterator[None]:
+        self.mark(name)
+        try:
+            yield
+        finally:
+            self.record(name, since=name)
+
+    # Remember the current time, for a phase that ends in another callback
+    def mark(self, name: str) -> None:
+        self._marks[name] = time.perf_counter()
+
+    # Record a phase that began at the mark since (or at process start) and
+    # ended now
+    def record(self, name: str, since: t.Optional[str] = None) -> None:
+        start = self._marks[since] if since else self.origin
+        self.phases.append(
+            (name, start - self.origin, time.perf_counter() - self.origin)
+        )
+
+    def report(self) -> str:
+        lines = ["Startup phases:"]
+        for name, start, end in sorted(self.phases, key=lambda phase: phase[1]):
+            lines.append(
+                f"  {name:<24} {(end - start) * 1000:>9.1f}ms"
+                f"  ({start:.3f}s -> {end:.3f}s)"
+            )
+        total = max((end for _, _, end in self.phases), default=0.0)
+        lines.append(f"  {'ready after':<24} {total * 1000:>9.1f}ms")
+        return "\n".join(lines)
+
+
+timer = StartupTimer()
+
+
+"""
+Set once the ledger has been loaded. Commands and tasks that use the ledger
+wait on it, so the gateway can connect while the ledger is still loading. If
+loading fails the milestone is marked failed instead, and the waiters are
+told so rather than waiting forever.
+"""
+
+
+class Milestone:
+    def __init__(self) -> None:
+        self.reached = False
+        self.failed: t.Optional[BaseException] = None
+        # Created on first use so it belongs to the running event loop
+        self._event: t.Optional[asyncio.Event] = None
+
+    def _get_event(self) -> asyncio.Event:
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+    def set(self) -> None:
+        self.reached = True
+        self._get_event().set()
+
+    def fail(self, exception: BaseException) -> None:
+        self.failed = exception
+        self._get_event().set()
+
+    # Whether the milestone was reached, False once it has failed
+    async def wait(self) -> bool:
+        if not self.reached and self.failed is None:
+            await self._get_event().wait()
+        return self.reached
+
+
+ledger_loaded = Milestone()
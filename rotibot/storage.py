@@ -1,11 +1,37 @@
+import asyncio
+import concurrent.futures
+import contextlib
 import csv
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
 import typing as t
+from array import array
+
+import rotibot.metrics as metrics
+
+logger = logging.getLogger("rotibot.storage")
+
+DEFAULT_BALANCE = 10000
+
+# Journal records are written to disk as a group once this many are pending,
+# or JOURNAL_FLUSH_INTERVAL seconds after the first of them, whichever comes
+# first
+JOURNAL_GROUP_SIZE = int(os.getenv("JOURNAL_GROUP_SIZE", 256))
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_MS", 200)) / 1000
+# Minimum number of journal records before compaction is worth running
+COMPACTION_THRESHOLD = 1000
+# Points every account earns per passive income epoch
+PASSIVE_INCOME = 250
 
 
 # Reads users.csv and returns a Dictionary
-def read_csv() -> t.Dict[int, t.Dict]:
+def read_csv(path: str = "users.csv") -> t.Dict[int, t.Dict]:
     users = dict()
-    with open("users.csv", "r") as file:
+    with open(path, "r") as file:
         csv_dict = csv.DictReader(file)
 
         for row in csv_dict:
@@ -18,8 +44,8 @@ def read_csv() -> t.Dict[int, t.Dict]:
 
 
 # Write from Dictionary into users.csv
-def write_csv(users: t.Dict[int, t.Dict]) -> None:
-    with open("users.csv", "w+") as file:
+def write_csv(users: t.Dict[int, t.Dict], path: str = "users.csv") -> None:
+    with open(path, "w+") as file:
         field_names = ["discordID", "username", "balance"]
         writer = csv.DictWriter(file, fieldnames=field_names)
 
@@ -30,3 +56,740 @@ def write_csv(users: t.Dict[int, t.Dict]) -> None:
             user_dict["username"] = users[discordID]["username"]
             user_dict["balance"] = users[discordID]["balance"]
             writer.writerow(user_dict)
+
+
+"""
+Compact account storage. Instead of a dict per account, accounts are rows in
+parallel int64 arrays of discordIDs, balances and settled epochs, with a
+list of interned usernames and a discordID -> row index.
+"""
+
+
+class AccountStore:
+    __slots__ = ("ids", "balances", "epochs", "usernames", "_rows")
+
+    def __init__(self) -> None:
+        self.ids = array("q")
+        self.balances = array("q")
+        self.epochs = array("q")
+        self.usernames: t.List[str] = []
+        self._rows: t.Dict[int, int] = dict()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._rows
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> t.Iterator[int]:
+        return iter(self.ids)
+
+    # Returns the row of an account, raises KeyError if there is none
+    def row(self, user_id: int) -> int:
+        return self._rows[user_id]
+
+    # Build a store from whole columns, every account settled at epoch
+    @classmethod
+    def from_columns(
+        cls,
+        ids: array,
+        balances: array,
+        epoch: int,
+        usernames: t.List[str],
+    ) -> "AccountStore":
+        accounts = cls()
+        accounts.ids = ids
+        accounts.balances = balances
+        accounts.epochs = array("q", [epoch]) * len(ids)
+        accounts.usernames = list(map(sys.intern, usernames))
+        accounts._rows = dict(zip(ids, range(len(ids))))
+        return accounts
+
+    # Add an account, or overwrite it if it already exists. Returns its row.
+    def put(self, user_id: int, username: str, balance: int, epoch: int) -> int:
+        username = sys.intern(username)
+        row = self._rows.get(user_id)
+        if row is None:
+            row = self._rows[user_id] = len(self.ids)
+            self.ids.append(user_id)
+            self.balances.append(balance)
+            self.epochs.append(epoch)
+            self.usernames.append(username)
+        else:
+            self.balances[row] = balance
+            self.epochs[row] = epoch
+            self.usernames[row] = username
+        return row
+
+
+"""
+Binary snapshot file, fixed-width so it can be memory-mapped and searched
+without parsing it:
+    header   magic, last journal sequence number folded into the snapshot,
+             passive income epoch its balances are settled at, account count
+    records  one (discordID, balance, username offset) int64 triple per
+             account, sorted by discordID
+    strings  the usernames, each ending in a newline, in record order
+Written to a temporary file and renamed into place so a crash can never leave
+a truncated snapshot behind.
+"""
+
+SNAPSHOT_MAGIC = b"RBLEDGER"
+SNAPSHOT_HEADER = struct.Struct("<8sqqq")
+SNAPSHOT_RECORD = struct.Struct("<qqq")
+
+
+class SnapshotFile:
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.seq, self.epoch, self.count = SNAPSHOT_HEADER.unpack_from(self._map)
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a binary snapshot")
+        self._strings = SNAPSHOT_HEADER.size + self.count * SNAPSHOT_RECORD.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self) -> "SnapshotFile":
+        return self
+
+    def __exit__(self, *exc_info: t.Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+
+    # Returns (username, balance) of one account by binary search, or None if
+    # it isn't in the snapshot
+    def find(self, user_id: int) -> t.Optional[t.Tuple[str, int]]:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            discordID, balance, offset = self._record(middle)
+            if discordID < user_id:
+                low = middle + 1
+            elif discordID > user_id:
+                high = middle
+            else:
+                return self._username(offset), balance
+        return None
+
+    # Returns (discordID, username, balance) for every account
+    def rows(self) -> t.Iterator[t.Tuple[int, str, int]]:
+        for index in range(self.count):
+            discordID, balance, offset = self._record(index)
+            yield discordID, self._username(offset), balance
+
+    # Reads every account into an AccountStore, copying the columns out of
+    # the records in bulk instead of unpacking them one by one
+    def accounts(self) -> AccountStore:
+        records = array("q")
+        records.frombytes(self._map[SNAPSHOT_HEADER.size : self._strings])
+        if sys.byteorder != "little":
+            records.byteswap()
+        usernames = self._map[self._strings :].decode("utf-8").split("\n")
+        usernames.pop()
+        return AccountStore.from_columns(
+            records[0::3], records[1::3], self.epoch, usernames
+        )
+
+    def _record(self, index: int) -> t.Tuple[int, int, int]:
+        return SNAPSHOT_RECORD.unpack_from(
+            self._map, SNAPSHOT_HEADER.size + index * SNAPSHOT_RECORD.size
+        )
+
+    def _username(self, offset: int) -> str:
+        start = self._strings + offset
+        return self._map[start : self._map.find(b"\n", start)].decode("utf-8")
+
+
+def read_snapshot(path: str) -> t.Tuple[int, int, AccountStore]:
+    with SnapshotFile(path) as snapshot:
+        return snapshot.seq, snapshot.epoch, snapshot.accounts()
+
+
+def write_snapshot(
+    path: str, seq: int, epoch: int, rows: t.Iterable[t.Tuple[int, str, int]]
+) -> None:
+    rows = sorted(rows)
+    records = array("q")
+    strings = []
+    offset = 0
+    for discordID, username, balance in rows:
+        # A newline would end the username early
+        username = " ".join(username.split()).encode("utf-8") + b"\n"
+        records.extend((discordID, balance, offset))
+        strings.append(username)
+        offset += len(username)
+    if sys.byteorder != "little":
+        records.byteswap()
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, seq, epoch, len(rows)))
+        file.write(records.tobytes())
+        file.write(b"".join(strings))
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(tmp_path, path)
+
+
+"""
+CSV import and export, for moving a ledger to or from the users.csv format
+"""
+
+
+def export_csv(snapshot_path: str, csv_path: str = "users.csv") -> None:
+    with SnapshotFile(snapshot_path) as snapshot:
+        write_csv(
+            {
+                discordID: {"username": username, "balance": balance}
+                for discordID, username, balance in snapshot.rows()
+            },
+            csv_path,
+        )
+
+
+def import_csv(csv_path: str, snapshot_path: str, seq: int = 0, epoch: int = 0) -> None:
+    write_snapshot(
+        snapshot_path,
+        seq,
+        epoch,
+        (
+            (discordID, user["username"], user["balance"])
+            for discordID, user in read_csv(csv_path).items()
+        ),
+    )
+
+
+"""
+Append-only journal of ledger changes. Every record is one tab separated line
+starting with its sequence number and an operation:
+    a  discordID balance username    account created
+    d  discordID delta balance       balance changed by delta
+    e  epoch                         passive income epoch reached
+    u  discordID username            username changed
+Records are buffered in memory and written with a single fsync per group, so
+a burst of commands costs one disk write per group_size records or
+flush_interval seconds, whichever comes first, however many commands there
+are. A crash can lose the records of the group being buffered.
+
+The disk work of every journal runs on one writer thread, so writes, fsyncs
+and truncations never block the event loop, and a single timer flushes the
+groups of all of them however many ledgers are loaded.
+"""
+
+
+class JournalWriter:
+    def __init__(self, flush_interval: float = JOURNAL_FLUSH_INTERVAL) -> None:
+        self.flush_interval = flush_interval
+        # Jobs run one at a time, in the order they were submitted
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="rotibot-journal"
+        )
+        # Journals with records waiting for the timer
+        self._pending: t.Set["Journal"] = set()
+        self._timer: t.Optional[asyncio.TimerHandle] = None
+        self._timer_loop: t.Optional[asyncio.AbstractEventLoop] = None
+
+    def submit(
+        self, function: t.Callable[..., t.Any], *args: t.Any
+    ) -> concurrent.futures.Future:
+        return self._executor.submit(function, *args)
+
+    # Sync the journal along with the others once flush_interval has passed
+    def schedule(self, journal: "Journal") -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on an event loop (a script or an executor thread), nothing
+            # would flush the group later
+            journal.sync()
+            return
+        self._pending.add(journal)
+        # A timer left on a loop that has since stopped would never fire
+        if self._timer is None or self._timer_loop is not loop:
+            self._timer = loop.call_later(self.flush_interval, self.flush)
+            self._timer_loop = loop
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, set()
+        for journal in pending:
+            journal.sync()
+
+    # Block until every job submitted so far is done. Not for the event
+    # loop, other than in scripts and tests.
+    def wait(self) -> None:
+        self.submit(lambda: None).result()
+
+
+writer = JournalWriter()
+
+
+def log_write_failure(future: concurrent.futures.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Writing the journal failed", exc_info=future.exception())
+
+
+class Journal:
+    def __init__(
+        self,
+        path: str,
+        group_size: int = JOURNAL_GROUP_SIZE,
+        writer: JournalWriter = writer,
+    ) -> None:
+        self.path = path
+        self.group_size = group_size
+        self.writer = writer
+        # Only touched by the writer thread while the journal is open
+        self._file: t.Optional[t.BinaryIO] = None
+        self._open = False
+        # Records not handed to the writer thread yet. Appends come from the
+        # event loop, but a ledger loading or restoring on an executor thread
+        # syncs from there.
+        self._buffer: t.List[str] = []
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        self._file = open(self.path, "ab")
+        self._open = True
+
+    # Records still buffered are written before the file is closed
+    def close(self) -> None:
+        if self._open:
+            self.sync()
+            self.writer.submit(self._close)
+            self._open = False
+
+    def append(self, *fields: t.Any) -> None:
+        line = "\t".join(str(field) for field in fields) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            pending = len(self._buffer)
+
+        if pending >= self.group_size:
+            self.sync()
+        elif pending == 1:
+            self.writer.schedule(self)
+
+    # Write several records at once and fsync them together
+    def append_many(self, records: t.Iterable[t.Sequence[t.Any]]) -> None:
+        lines = ["\t".join(str(field) for field in fields) + "\n" for fields in records]
+        if not lines:
+            return
+        with self._lock:
+            self._buffer.extend(lines)
+        self.sync()
+
+    # Hand every record appended since the last sync to the writer thread
+    def sync(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if lines:
+            future = self.writer.submit(self._write, "".join(lines).encode("utf-8"))
+            future.add_done_callback(log_write_failure)
+
+    # Resolves to the size of the journal once every record appended so far
+    # is on disk
+    def written(self) -> concurrent.futures.Future:
+        self.sync()
+        return self.writer.submit(os.path.getsize, self.path)
+
+    # Drop everything before offset, keeping records appended after it, or
+    # every record appended so far if offset is None. The returned future
+    # resolves once the shorter journal is in place.
+    def truncate_before(
+        self, offset: t.Optional[int] = None
+    ) -> concurrent.futures.Future:
+        self.sync()
+        return self.writer.submit(self._truncate, offset)
+
+    # Yields every complete record. A torn final line from a crash is cut off
+    # so that new records are not appended onto it.
+    def replay(self) -> t.Iterator[t.List[str]]:
+        # Records of the same ledger evicted moments ago may still be queued
+        self.writer.wait()
+        if not os.path.exists(self.path):
+            return
+
+        valid_size = 0
+        with open(self.path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                valid_size += len(line)
+                yield line[:-1].decode("utf-8").split("\t")
+
+        if valid_size < os.path.getsize(self.path):
+            os.truncate(self.path, valid_size)
+
+    # Writer thread jobs
+
+    def _write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _truncate(self, offset: t.Optional[int]) -> None:
+        self._file.close()
+
+        tail = b""
+        if offset is not None:
+            with open(self.path, "rb") as file:
+                file.seek(offset)
+                tail = file.read()
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(tail)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+
+    def _close(self) -> None:
+        self._file.close()
+        self._file = None
+
+
+"""
+In-memory balance ledger. Loaded once at startup and kept resident so that
+commands never have to parse users.csv. Changes are appended to the journal
+and periodically compacted into the snapshot.
+
+Passive income is accrued lazily: a tick only advances the global epoch, and
+each account remembers the epoch its stored balance was settled at. The
+income owed since then is added when the balance is read and folded into the
+stored balance when it is written.
+"""
+
+
+class Ledger:
+    def __init__(self, path: str = "users", income: int = PASSIVE_INCOME) -> None:
+        self.path = path
+        self.income = income
+        self.snapshot_path = path + ".snapshot"
+        self.csv_path = path + ".csv"
+        self.journal = Journal(path + ".journal")
+        self._accounts = AccountStore()
+        self._epoch = 0
+        self._seq = 0
+        self._journal_records = 0
+        self._compacting = False
+        # Accounts changed since the last database backup, plus the income
+        # every account has accrued since then
+        self._dirty: t.Set[int] = set()
+        self._unsynced_income = 0
+        # Called with the discordID of a changed account, or None when the
+        # whole ledger was replaced
+        self._listeners: t.List[t.Callable[[t.Optional[int]], None]] = []
+        # Per-account locks with the number of tasks holding or waiting on them
+        self._locks: t.Dict[int, t.List] = dict()
+
+    def __contains__(self, user_id: int) -> bool:
+        return int(user_id) in self._accounts
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    # Load snapshot (or legacy users.csv) and replay the journal on top of it
+    def load(self) -> None:
+        self.journal.close()
+
+        snapshot_seq = 0
+        self._epoch = 0
+        if os.path.exists(self.snapshot_path):
+            snapshot_seq, self._epoch, self._accounts = read_snapshot(
+                self.snapshot_path
+            )
+        else:
+            self._accounts = AccountStore()
+            if os.path.exists(self.csv_path):
+                for discordID, user in read_csv(self.csv_path).items():
+                    self._accounts.put(discordID, user["username"], user["balance"], 0)
+        self._seq = snapshot_seq
+
+        self._journal_records = 0
+        for record in self.journal.replay():
+            seq = int(record[0])
+            if seq <= snapshot_seq:
+                continue
+            self._apply(record[1], record[2:])
+            self._seq = seq
+            self._journal_records += 1
+
+        # The dirty set is not persisted, so everything is resent after a restart
+        self._dirty = set(self._accounts)
+        self._unsynced_income = 0
+        self.journal.open()
+        self._notify(None)
+
+    # Replace the ledger contents, used to seed an empty ledger from the database
+    def restore(self, users: t.Dict[int, t.Dict]) -> None:
+        self._accounts = AccountStore()
+        for discordID, user in users.items():
+            self._accounts.put(
+                int(discordID), user["username"], user["balance"], self._epoch
+            )
+        self._seq += 1
+        write_snapshot(self.snapshot_path, self._seq, self._epoch, self.items())
+        self.journal.truncate_before().result()
+        self._journal_records = 0
+        self._dirty = set()
+        self._unsynced_income = 0
+        self._notify(None)
+
+    def close(self) -> None:
+        self.journal.close()
+
+    def get_balance(self, user_id: int) -> int:
+        accounts = self._accounts
+        row = accounts.row(int(user_id))
+        return (
+            accounts.balances[row] + (self._epoch - accounts.epochs[row]) * self.income
+        )
+
+    def get_username(self, user_id: int) -> str:
+        return self._accounts.usernames[self._accounts.row(int(user_id))]
+
+    # Balance minus all income accrued since epoch 0. Orders accounts the same
+    # way as their balances but doesn't change when income is paid out.
+    def get_score(self, user_id: int) -> int:
+        accounts = self._accounts
+        row = accounts.row(int(user_id))
+        return accounts.balances[row] - accounts.epochs[row] * self.income
+
+    def add_listener(self, callback: t.Callable[[t.Optional[int]], None]) -> None:
+        self._listeners.append(callback)
+
+    # Returns (discordID, username, balance) for every account
+    def items(self) -> t.Iterator[t.Tuple[int, str, int]]:
+        accounts, epoch, income = self._accounts, self._epoch, self.income
+        for row, user_id in enumerate(accounts.ids):
+            balance = accounts.balances[row] + (epoch - accounts.epochs[row]) * income
+            yield user_id, accounts.usernames[row], balance
+
+    # Create an account if user_id doesn't have one, returns True if created
+    def create_account(
+        self, user_id: int, username: str, balance: int = DEFAULT_BALANCE
+    ) -> bool:
+        user_id = int(user_id)
+        if user_id in self._accounts:
+            return False
+
+        # Tabs and newlines would split the journal record
+        username = " ".join(username.split())
+        self._accounts.put(user_id, username, balance, self._epoch)
+        self._dirty.add(user_id)
+        self._record("a", user_id, balance, username)
+        self._notify(user_id)
+        return True
+
+    # Bring many accounts in line with their guild members in one journal
+    # write: members are (discordID, username) pairs, accounts are created
+    # for members without one (unless create is False) and renamed where the
+    # username changed. Returns how many accounts were created and renamed.
+    def sync_members(
+        self, members: t.Iterable[t.Tuple[int, str]], create: bool = True
+    ) -> t.Tuple[int, int]:
+        accounts = self._accounts
+        records = []
+        created = []
+        renamed = 0
+        for user_id, username in members:
+            user_id = int(user_id)
+            username = " ".join(username.split())
+            if user_id in accounts:
+                row = accounts.row(user_id)
+                if accounts.usernames[row] == username:
+                    continue
+                accounts.usernames[row] = sys.intern(username)
+                records.append(("u", user_id, username))
+                renamed += 1
+            elif create:
+                accounts.put(user_id, username, DEFAULT_BALANCE, self._epoch)
+                records.append(("a", user_id, DEFAULT_BALANCE, username))
+                created.append(user_id)
+            else:
+                continue
+            self._dirty.add(user_id)
+
+        self._record_many(records)
+        # Renames don't move anyone on the leaderboard
+        for user_id in created:
+            self._notify(user_id)
+        return len(created), renamed
+
+    # Add delta (may be negative) to a user's balance and return the new balance
+    def add_balance(self, user_id: int, delta: int) -> int:
+        user_id = int(user_id)
+        accounts = self._accounts
+        row = accounts.row(user_id)
+        balance = (
+            accounts.balances[row]
+            + (self._epoch - accounts.epochs[row]) * self.income
+            + delta
+        )
+        accounts.balances[row] = balance
+        accounts.epochs[row] = self._epoch
+        self._dirty.add(user_id)
+        self._record("d", user_id, delta, balance)
+        self._notify(user_id)
+        return balance
+
+    # Hold the locks of the given accounts. Locks are always taken in
+    # discordID order so two transfers between the same accounts can't
+    # deadlock, and accounts not involved are never waited on.
+    @contextlib.asynccontextmanager
+    async def lock(self, *user_ids: int) -> t.AsyncIterator[None]:
+        held = []
+        waiting = None
+        try:
+            for user_id in sorted(set(int(user_id) for user_id in user_ids)):
+                entry = self._locks.get(user_id)
+                if entry is None:
+                    entry = self._locks[user_id] = [asyncio.Lock(), 0]
+                entry[1] += 1
+                waiting = user_id
+                await entry[0].acquire()
+                held.append(user_id)
+                waiting = None
+            yield
+        finally:
+            if waiting is not None:
+                self._release_lock(waiting, acquired=False)
+            for user_id in reversed(held):
+                self._release_lock(user_id, acquired=True)
+
+    def _release_lock(self, user_id: int, acquired: bool) -> None:
+        entry = self._locks[user_id]
+        if acquired:
+            entry[0].release()
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[user_id]
+
+    # Add delta to a user's balance unless it would go below zero. Returns the
+    # new balance, or None if the user can't afford it.
+    async def apply_delta(self, user_id: int, delta: int) -> t.Optional[int]:
+        with metrics.phase("storage"):
+            async with self.lock(user_id):
+                if self.get_balance(user_id) + delta < 0:
+                    return None
+                return self.add_balance(user_id, delta)
+
+    # Move amount from src to dst. Returns False if src can't afford it.
+    async def transfer(self, src: int, dst: int, amount: int) -> bool:
+        with metrics.phase("storage"):
+            async with self.lock(src, dst):
+                if self.get_balance(src) < amount:
+                    return False
+                self.add_balance(src, -amount)
+                self.add_balance(dst, amount)
+                return True
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    # Pay passive income to every account, epochs times over. Only the epoch
+    # moves, so this costs the same no matter how many accounts there are.
+    def accrue_income(self, epochs: int = 1) -> None:
+        self._epoch += epochs
+        self._unsynced_income += self.income * epochs
+        self._record("e", self._epoch)
+
+    # Returns (discordID, username, balance) for every account changed since
+    # the last call, and the income every other account has accrued meanwhile.
+    # Clears the change tracking.
+    def take_dirty(self) -> t.Tuple[t.List[t.Tuple[int, str, int]], int]:
+        rows = [
+            (user_id, self.get_username(user_id), self.get_balance(user_id))
+            for user_id in self._dirty
+        ]
+        income = self._unsynced_income
+        self._dirty = set()
+        self._unsynced_income = 0
+        return rows, income
+
+    # Mark accounts and income as unsynced again, used when a backup failed
+    def mark_dirty(self, user_ids: t.Iterable[int], income: int = 0) -> None:
+        self._dirty.update(user_ids)
+        self._unsynced_income += income
+
+    def needs_backup(self) -> bool:
+        return bool(self._dirty) or self._unsynced_income != 0
+
+    # True while account locks are held or a compaction is running
+    @property
+    def busy(self) -> bool:
+        return bool(self._locks) or self._compacting
+
+    def needs_compaction(self) -> bool:
+        return self._journal_records >= max(COMPACTION_THRESHOLD, len(self._accounts))
+
+    # Fold the journal into a new snapshot. The snapshot is written and the
+    # journal truncated off the event loop, changes made meanwhile stay in
+    # the journal.
+    async def compact(self) -> None:
+        if self._compacting:
+            return
+        self._compacting = True
+
+        try:
+            seq = self._seq
+            epoch = self._epoch
+            records = self._journal_records
+            rows = list(self.items())
+            # Where the records folded into the snapshot end
+            offset = await asyncio.wrap_future(self.journal.written())
+
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, write_snapshot, self.snapshot_path, seq, epoch, rows
+            )
+
+            await asyncio.wrap_future(self.journal.truncate_before(offset))
+            self._journal_records -= records
+        finally:
+            self._compacting = False
+
+    def _notify(self, user_id: t.Optional[int]) -> None:
+        for callback in self._listeners:
+            callback(user_id)
+
+    def _record(self, op: str, *fields: t.Any) -> None:
+        self._seq += 1
+        self.journal.append(self._seq, op, *fields)
+        self._journal_records += 1
+
+    def _record_many(self, records: t.List[t.Tuple[t.Any, ...]]) -> None:
+        first = self._seq + 1
+        self._seq += len(records)
+        self.journal.append_many(
+            (seq, *record) for seq, record in enumerate(records, first)
+        )
+        self._journal_records += len(records)
+
+    def _apply(self, op: str, fields: t.List[str]) -> None:
+        if op == "a":
+            discordID, balance, username = fields
+            self._accounts.put(int(discordID), username, int(balance), self._epoch)
+        elif op == "d":
+            discordID, _, balance = fields
+            row = self._accounts.row(int(discordID))
+            self._accounts.balances[row] = int(balance)
+            self._accounts.epochs[row] = self._epoch
+        elif op == "e":
+            self._epoch = int(fields[0])
+        elif op == "u":
+            discordID, username = fields
+            row = self._accounts.row(int(discordID))
+            self._accounts.usernames[row] = sys.intern(username)
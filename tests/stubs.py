@@ -0,0 +1,41 @@
+import typing as t
+
+from aiohttp import web
+
+"""
+Local HTTP server standing in for the external APIs. Answers every GET with
+the next of the given (status, body) responses, repeating the last one, and
+counts the requests it got.
+"""
+
+
+class StubAPI:
+    def __init__(self, *responses: t.Tuple[int, t.Any]) -> None:
+        self.responses = list(responses)
+        self.requests = 0
+        self.url = ""
+        self._runner: t.Optional[web.AppRunner] = None
+
+    async def __aenter__(self) -> "StubAPI":
+        app = web.Application()
+        app.router.add_get("/{path:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    async def __aexit__(self, *exc_info: t.Any) -> None:
+        await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if len(self.responses) > 1:
+            status, body = self.responses.pop(0)
+        else:
+            status, body = self.responses[0]
+        if isinstance(body, str):
+            return web.Response(status=status, text=body)
+        return web.json_response(body, status=status)
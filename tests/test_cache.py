@@ -0,0 +1,117 @@
+import asyncio
+import itertools
+
+import aiohttp
+
+import rotibot.network as network
+from rotibot.cache import PrefetchPool
+from tests.stubs import StubAPI
+
+CONFIG = network.HTTPConfig(retries=0, backoff=0)
+
+
+def numbered() -> StubAPI:
+    return StubAPI(*((200, {"n": n}) for n in range(100)))
+
+
+def pool_for(api: StubAPI, session: aiohttp.ClientSession, **kwargs) -> PrefetchPool:
+    async def fetch():
+        return await network.get_json(session, "stub", api.url + "/meme", CONFIG)
+
+    return PrefetchPool(fetch, **kwargs)
+
+
+# Let the background refill finish
+async def settle(pool: PrefetchPool) -> None:
+    if pool._refill_task is not None:
+        await pool._refill_task
+
+
+def test_refill_fills_the_pool_up_to_its_size():
+    async def run():
+        async with numbered() as api, network.build_session(CONFIG) as session:
+            pool = pool_for(api, session, size=3)
+            pool.refill()
+            await settle(pool)
+            assert len(pool) == 3
+            assert api.requests == 3
+
+    asyncio.run(run())
+
+
+def test_get_serves_prefetched_payloads_in_order():
+    async def run():
+        async with numbered() as api, network.build_session(CONFIG) as session:
+            pool = pool_for(api, session, size=2)
+            pool.refill()
+            await settle(pool)
+
+            requests = api.requests
+            assert await pool.get() == {"n": 0}
+            # Served from memory, the request made since is the refill
+            await settle(pool)
+            assert api.requests == requests + 1
+            assert await pool.get() == {"n": 1}
+            await settle(pool)
+            assert len(pool) == 2
+
+    asyncio.run(run())
+
+
+def test_empty_pool_fetches_directly():
+    async def run():
+        async with numbered() as api, network.build_session(CONFIG) as session:
+            pool = pool_for(api, session, size=1)
+            assert await pool.get() == {"n": 0}
+            pool.close()
+
+    asyncio.run(run())
+
+
+def test_expired_payloads_are_dropped():
+    async def run():
+        async with numbered() as api, network.build_session(CONFIG) as session:
+            pool = pool_for(api, session, size=2, ttl=0.05)
+            pool.refill()
+            await settle(pool)
+            await asyncio.sleep(0.1)
+
+            # Both prefetched payloads went stale, this one is fetched now
+            assert await pool.get() == {"n": 2}
+            pool.close()
+
+    asyncio.run(run())
+
+
+def test_failing_api_stops_the_refill():
+    async def run():
+        async with StubAPI((404, {})) as api, network.build_session(CONFIG) as session:
+            pool = pool_for(api, session, size=5)
+            pool.refill()
+            await settle(pool)
+            assert len(pool) == 0
+            # One miss ends the refill instead of retrying up to the size
+            assert api.requests == 1
+
+    asyncio.run(run())
+
+
+def test_refill_errors_are_retried_on_the_next_get():
+    counter = itertools.count()
+
+    async def fetch():
+        if next(counter) == 0:
+            raise aiohttp.ClientError("down")
+        return "payload"
+
+    async def run():
+        pool = PrefetchPool(fetch, size=2)
+        pool.refill()
+        await settle(pool)
+        assert len(pool) == 0
+
+        assert await pool.get() == "payload"
+        await settle(pool)
+        assert len(pool) == 2
+
+    asyncio.run(run())
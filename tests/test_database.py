@@ -0,0 +1,111 @@
+import asyncio
+import importlib
+import sys
+
+import pytest
+
+import rotibot.database as db
+import rotibot.economy as econ
+import rotibot.storage as store
+
+GUILD_ID = 800000000000000000
+OTHER_GUILD_ID = 800000000000000001
+ALICE = 100000000000000001
+BOB = 100000000000000002
+
+
+# rotibot.models builds its engine from DB_URI when first imported, so it is
+# imported afresh against a SQLite file for every test
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_URI", f"sqlite:///{tmp_path / 'rotibot.db'}")
+    sys.modules.pop("rotibot.models", None)
+    models = importlib.import_module("rotibot.models")
+    db.upgradeSchema()
+    yield models
+    models.engine.dispose()
+    sys.modules.pop("rotibot.models", None)
+
+
+def test_save_and_load_round_trip(database):
+    db.saveUsers(GUILD_ID, [(ALICE, "alice", 10000), (BOB, "bob", 2**40)])
+
+    assert db.loadGuildUsers(GUILD_ID) == {
+        ALICE: {"username": "alice", "balance": 10000},
+        BOB: {"username": "bob", "balance": 2**40},
+    }
+
+
+def test_save_upserts_changed_rows_only(database):
+    db.saveUsers(GUILD_ID, [(ALICE, "alice", 10000), (BOB, "bob", 500)])
+    db.saveUsers(GUILD_ID, [(BOB, "bobby", 750)])
+
+    assert db.loadGuildUsers(GUILD_ID) == {
+        ALICE: {"username": "alice", "balance": 10000},
+        BOB: {"username": "bobby", "balance": 750},
+    }
+
+
+def test_income_is_applied_to_the_whole_guild(database):
+    db.saveUsers(GUILD_ID, [(ALICE, "alice", 100), (BOB, "bob", 200)])
+    db.saveUsers(OTHER_GUILD_ID, [(ALICE, "alice", 100)])
+
+    # Income first, then the changed rows, which already include it
+    db.saveUsers(GUILD_ID, [(BOB, "bob", 1000)], income=250)
+
+    assert db.loadGuildUsers(GUILD_ID) == {
+        ALICE: {"username": "alice", "balance": 350},
+        BOB: {"username": "bob", "balance": 1000},
+    }
+    assert db.loadGuildUsers(OTHER_GUILD_ID) == {
+        ALICE: {"username": "alice", "balance": 100}
+    }
+
+
+def test_nothing_to_save_skips_the_database(database, monkeypatch):
+    monkeypatch.setattr(database, "Session", None)
+    db.saveUsers(GUILD_ID, [], income=0)
+
+
+def test_ledger_backup_round_trip(database, tmp_path):
+    ledger = store.Ledger(str(tmp_path / "ledger"))
+    ledger.load()
+    ledger.create_account(ALICE, "alice")
+    ledger.create_account(BOB, "bob")
+    ledger.add_balance(ALICE, -400)
+    db.saveUsers(GUILD_ID, *ledger.take_dirty())
+
+    # Only what changed since is sent on the next backup
+    ledger.add_balance(BOB, 123)
+    ledger.accrue_income()
+    rows, income = ledger.take_dirty()
+    assert rows == [(BOB, "bob", 10000 + 123 + store.PASSIVE_INCOME)]
+    db.saveUsers(GUILD_ID, rows, income)
+    ledger.close()
+
+    restored = store.Ledger(str(tmp_path / "restored"))
+    restored.load()
+    restored.restore(db.loadGuildUsers(GUILD_ID))
+    assert sorted(restored.items()) == sorted(ledger.items())
+    restored.close()
+
+
+def test_economies_backup_sends_dirty_rows_once(database, tmp_path):
+    async def run():
+        economies = econ.Economies(directory=str(tmp_path / "economies"))
+        economies.open()
+        ledger = (await economies.get(GUILD_ID)).ledger
+        ledger.create_account(ALICE, "alice")
+
+        first = await economies.backup()
+        second = await economies.backup()
+        economies.close()
+        return first, second
+
+    (first, blocked), (second, _) = asyncio.run(run())
+    assert (first, second) == (1, 0)
+    # Collecting the changed rows is the part done on the event loop
+    assert blocked > 0
+    assert db.loadGuildUsers(GUILD_ID) == {
+        ALICE: {"username": "alice", "balance": store.DEFAULT_BALANCE}
+    }
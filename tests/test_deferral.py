@@ -0,0 +1,146 @@
+import asyncio
+import types
+
+import pytest
+
+hikari = pytest.importorskip("hikari")
+lightbulb = pytest.importorskip("lightbulb")
+
+import rotibot.deferral as deferral
+import rotibot.metrics as metrics
+
+"""
+Slash contexts are real lightbulb contexts over a real interaction, only the
+REST client underneath is fake and records what would have been sent.
+"""
+
+
+class FakeREST:
+    def __init__(self) -> None:
+        self.calls = []
+
+    async def create_interaction_response(
+        self, interaction, token, response_type, content=hikari.UNDEFINED, **kwargs
+    ):
+        self.calls.append(("initial", response_type, content))
+
+    async def execute_webhook(self, webhook, token, content=hikari.UNDEFINED, **kwargs):
+        self.calls.append(("followup", content))
+        return types.SimpleNamespace(id=len(self.calls))
+
+
+def slash_context(name: str) -> lightbulb.SlashContext:
+    rest = FakeREST()
+    app = types.SimpleNamespace(rest=rest)
+    interaction = hikari.CommandInteraction(
+        app=app,
+        id=hikari.Snowflake(1),
+        application_id=hikari.Snowflake(2),
+        type=hikari.InteractionType.APPLICATION_COMMAND,
+        token="token",
+        version=1,
+        channel_id=hikari.Snowflake(3),
+        guild_id=hikari.Snowflake(4),
+        guild_locale="en-US",
+        member=None,
+        user=None,
+        locale="en-US",
+        command_id=hikari.Snowflake(5),
+        command_name=name,
+        command_type=hikari.CommandType.SLASH,
+        app_permissions=None,
+        options=None,
+        resolved=None,
+    )
+    event = hikari.InteractionCreateEvent(shard=None, interaction=interaction)
+    command_like = lightbulb.command(name, "Test command")(
+        lightbulb.implements(lightbulb.SlashCommand)(lambda ctx: None)
+    )
+    return lightbulb.SlashContext(app, event, lightbulb.SlashCommand(app, command_like))
+
+
+def run(callback, ctx, budget: float = 0.05) -> None:
+    asyncio.run(deferral.defer_after(budget)(callback)(ctx))
+
+
+def test_fast_command_is_not_deferred():
+    async def fast(ctx):
+        await ctx.respond("done")
+
+    ctx = slash_context("fast")
+    run(fast, ctx)
+
+    assert ctx.app.rest.calls == [
+        ("initial", hikari.ResponseType.MESSAGE_CREATE, "done")
+    ]
+    assert "fast" not in metrics.registry.deferrals
+
+
+def test_slow_command_is_deferred_and_answers_with_a_followup():
+    async def slow(ctx):
+        await asyncio.sleep(0.2)
+        await ctx.respond("done")
+
+    ctx = slash_context("slow")
+    run(slow, ctx)
+
+    assert ctx.app.rest.calls == [
+        ("initial", hikari.ResponseType.DEFERRED_MESSAGE_CREATE, hikari.UNDEFINED),
+        ("followup", "done"),
+    ]
+    assert metrics.registry.deferrals["slow"] == 1
+    assert not ctx.deferred
+
+
+def test_command_that_already_responded_is_not_deferred():
+    async def responds_then_works(ctx):
+        await ctx.respond("working")
+        await asyncio.sleep(0.2)
+        await ctx.respond("done")
+
+    ctx = slash_context("responds_then_works")
+    run(responds_then_works, ctx)
+
+    assert ctx.app.rest.calls == [
+        ("initial", hikari.ResponseType.MESSAGE_CREATE, "working"),
+        ("followup", "done"),
+    ]
+    assert "responds_then_works" not in metrics.registry.deferrals
+
+
+def test_failed_command_stops_the_timer():
+    async def fails(ctx):
+        raise RuntimeError("boom")
+
+    async def main(ctx):
+        with pytest.raises(RuntimeError):
+            await deferral.defer_after(0.05)(fails)(ctx)
+        # Past the budget, nothing is sent for the failed command
+        await asyncio.sleep(0.1)
+
+    ctx = slash_context("fails")
+    asyncio.run(main(ctx))
+
+    assert ctx.app.rest.calls == []
+    assert "fails" not in metrics.registry.deferrals
+
+
+def test_prefix_commands_are_never_deferred():
+    responses = []
+
+    async def respond(content):
+        responses.append(content)
+
+    async def slow(ctx):
+        await asyncio.sleep(0.1)
+        await ctx.respond("done")
+
+    ctx = types.SimpleNamespace(
+        invoked=None,
+        command=types.SimpleNamespace(qualname="prefix_slow"),
+        respond=respond,
+    )
+    run(slow, ctx)
+
+    assert responses == ["done"]
+    assert "prefix_slow" not in metrics.registry.deferrals
@@ -0,0 +1,172 @@
+import pytest
+
+from rotibot.games import EMPTY, O, X, Board, BoardAI, TicTacToe, win_masks
+
+
+def play_all(board: Board, moves) -> Board:
+    for index in moves:
+        board.play(index)
+    return board
+
+
+"""
+Winning lines
+"""
+
+
+def test_win_masks_of_tictactoe():
+    masks, cell_masks = win_masks(3, 3, 3)
+
+    assert len(masks) == 8
+    # The centre is on both diagonals, a row and a column
+    lines_through = [len(cell_masks[index]) for index in range(9)]
+    assert lines_through == [3, 2, 3, 2, 4, 2, 3, 2, 3]
+
+
+@pytest.mark.parametrize(
+    "line, other",
+    [
+        ((0, 1, 2), (3, 4)),  # row
+        ((1, 4, 7), (0, 2)),  # column
+        ((0, 4, 8), (1, 2)),  # diagonal
+        ((2, 4, 6), (0, 1)),  # anti-diagonal
+    ],
+)
+def test_tictactoe_wins(line, other):
+    board = TicTacToe()
+    for index, reply in zip(line, other):
+        assert not board.play(index)
+        assert not board.play(reply)
+
+    assert board.play(line[-1])
+    assert board.winner == X
+    assert board.is_over
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        (0, 1, 2, 3),  # row
+        (4, 9, 14, 19),  # column
+        (0, 6, 12, 18),  # diagonal
+        (4, 8, 12, 16),  # anti-diagonal
+    ],
+)
+def test_connect_four_on_a_five_by_four_board(line):
+    board = Board(5, 4, 4)
+    free = [index for index in range(20) if index not in line]
+    for index in line[:-1]:
+        assert not board.play(index)
+        board.play(free.pop())
+
+    assert board.winner == EMPTY
+    assert board.play(line[-1])
+    assert board.winner == X
+
+
+def test_three_in_a_row_doesnt_win_connect_four():
+    board = play_all(Board(5, 4, 4), (0, 5, 1, 6, 2))
+    assert board.winner == EMPTY
+    assert not board.is_over
+
+
+def test_tie_on_a_full_board():
+    # X O X
+    # X O O
+    # O X X
+    board = play_all(TicTacToe(), (0, 1, 2, 4, 3, 5, 7, 6, 8))
+
+    assert board.winner == EMPTY
+    assert board.is_over
+    assert board.cells() == [X, O, X, X, O, O, O, X, X]
+
+
+def test_board_size_is_checked():
+    with pytest.raises(ValueError):
+        Board(6, 3, 3)
+    with pytest.raises(ValueError):
+        Board(3, 3, 4)
+
+
+"""
+Moves
+"""
+
+
+def test_no_legal_moves_once_the_game_is_won():
+    board = play_all(TicTacToe(), (0, 3, 1, 4, 2))
+
+    assert board.winner == X
+    assert board.legal_moves() == []
+    assert not board.is_legal(8)
+    with pytest.raises(ValueError):
+        board.play(8)
+
+
+def test_no_legal_moves_on_a_full_board():
+    board = play_all(TicTacToe(), (0, 1, 2, 4, 3, 5, 7, 6, 8))
+
+    assert board.legal_moves() == []
+    assert not any(board.is_legal(index) for index in range(9))
+
+
+def test_taken_and_outside_cells_are_illegal():
+    board = play_all(TicTacToe(), (4,))
+
+    assert not board.is_legal(4)
+    assert not board.is_legal(-1)
+    assert not board.is_legal(9)
+    assert board.legal_moves() == [0, 1, 2, 3, 5, 6, 7, 8]
+    assert board.player == O
+
+
+def test_undo_restores_the_bitboards():
+    board = Board(5, 4, 4)
+    moves = (0, 5, 1, 6, 2, 7, 3)
+    states = []
+    for index in moves:
+        states.append((list(board.boards), board.turn, board.winner))
+        board.play(index)
+    assert board.winner == X
+
+    for index in reversed(moves):
+        board.undo(index)
+        assert (list(board.boards), board.turn, board.winner) == states.pop()
+    assert board.boards == [0, 0]
+    assert board.cells() == [EMPTY] * 20
+
+
+"""
+Computer opponent
+"""
+
+
+def test_ai_takes_an_immediate_win():
+    # O threatens 5, but X wins first on 2
+    board = play_all(TicTacToe(), (0, 3, 1, 4))
+    assert BoardAI(budget=0.2).choose(board) == 2
+
+
+def test_ai_blocks_an_immediate_loss():
+    board = play_all(TicTacToe(), (0, 4, 1))
+    assert BoardAI(budget=0.2).choose(board) == 2
+
+
+def test_ai_blocks_on_a_larger_board():
+    # X has three of four on the bottom row with one end open
+    board = play_all(Board(5, 4, 4), (15, 0, 16, 4, 17))
+    assert BoardAI(budget=0.2).choose(board) == 18
+
+
+def test_ai_leaves_the_board_as_it_found_it():
+    board = play_all(TicTacToe(), (0, 4, 1))
+    boards, turn = list(board.boards), board.turn
+    BoardAI(budget=0.2).choose(board)
+
+    assert (board.boards, board.turn, board.winner) == (boards, turn, EMPTY)
+
+
+def test_ai_needs_a_legal_move():
+    board = play_all(TicTacToe(), (0, 3, 1, 4, 2))
+    with pytest.raises(ValueError):
+        BoardAI().choose(board)
@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+import rotibot.metrics as metrics
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = metrics.Histogram((0.01, 0.1, 1.0))
+    for value in (0.005, 0.005, 0.05, 0.5, 5.0):
+        histogram.record(value)
+
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    assert histogram.total == pytest.approx(5.56)
+    assert histogram.quantile(0.4) == 0.01
+    assert histogram.quantile(0.6) == 0.1
+    assert histogram.quantile(1.0) == float("inf")
+
+
+def test_phases_add_up_inside_measure():
+    with metrics.measure() as phases:
+        with metrics.phase("storage"):
+            pass
+        with metrics.phase("storage"):
+            pass
+        with metrics.phase("rest"):
+            pass
+
+    assert set(phases) == set(metrics.PHASES)
+    assert phases["storage"] > 0
+    assert phases["rest"] > 0
+    assert phases["http"] == 0
+    assert phases["handler"] >= phases["storage"] + phases["rest"]
+
+
+def test_phase_outside_measure_records_nothing():
+    with metrics.phase("storage"):
+        pass
+    assert metrics._phases.get() is None
+
+
+def test_detached_tasks_stop_timing_into_the_command():
+    async def background():
+        metrics.detach()
+        with metrics.phase("storage"):
+            await asyncio.sleep(0.01)
+
+    async def command():
+        with metrics.measure() as phases:
+            await asyncio.create_task(background())
+        return phases
+
+    phases = asyncio.run(command())
+    assert phases["storage"] == 0
+    assert phases["handler"] >= 0.01
+
+
+def test_timed_task_records_outcomes(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, "registry", registry)
+
+    @metrics.timed_task
+    async def job(fail: bool) -> None:
+        if fail:
+            raise RuntimeError("failed")
+
+    async def run():
+        await job(False)
+        with pytest.raises(RuntimeError):
+            await job(True)
+        task = asyncio.create_task(job(False))
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert job.__name__ == "job"
+    # A task cancelled before it started never ran
+    assert registry.tasks["job"].count == 2
+    assert registry.task_outcomes == {("job", "ok"): 1, ("job", "error"): 1}
+
+
+def test_render_is_prometheus_text():
+    registry = metrics.Registry()
+    registry.record_command(
+        "casino balance", {"handler": 0.003, "storage": 0.001, "rest": 0, "http": 0}
+    )
+    registry.count_outcome("casino balance", "ok")
+    registry.count_deferral("casino balance")
+    registry.record_task("backup_data", 0.2, "ok")
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE rotibot_command_seconds histogram" in lines
+    assert (
+        'rotibot_command_seconds_bucket{command="casino balance",phase="handler",'
+        'le="0.005"} 1'
+    ) in lines
+    assert (
+        'rotibot_command_seconds_bucket{command="casino balance",phase="handler",'
+        'le="0.001"} 0'
+    ) in lines
+    assert (
+        'rotibot_command_seconds_count{command="casino balance",phase="storage"} 1'
+    ) in lines
+    assert (
+        'rotibot_command_outcomes_total{command="casino balance",outcome="ok"} 1'
+    ) in lines
+    assert 'rotibot_command_deferrals_total{command="casino balance"} 1' in lines
+    assert 'rotibot_task_runs_total{task="backup_data",outcome="ok"} 1' in lines
+
+
+def test_admin_stats_show_deferrals():
+    pytest.importorskip("hikari")
+    pytest.importorskip("lightbulb")
+    from rotibot.extensions.admin import command_table
+
+    registry = metrics.Registry()
+    for command in ("meme", "roll"):
+        registry.record_command(
+            command, {"handler": 2.5, "storage": 0, "rest": 0.1, "http": 2.3}
+        )
+    registry.count_deferral("meme")
+
+    header, meme, roll = command_table(registry).splitlines()
+    assert header.split()[-1] == "deferred"
+    assert meme.split()[-1] == "1"
+    assert roll.split()[-1] == "0"
+
+
+def test_error_outcomes():
+    lightbulb = pytest.importorskip("lightbulb")
+    from rotibot.instrument import outcome_of
+
+    # Raised the way lightbulb raises it, from the handler's exception
+    try:
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError as e:
+            raise lightbulb.CommandInvocationError("failed", original=e) from e
+    except lightbulb.CommandInvocationError as e:
+        invocation_error = e
+
+    assert outcome_of(invocation_error) == "error"
+    assert outcome_of(lightbulb.CommandIsOnCooldown("wait", retry_after=3)) == (
+        "cooldown"
+    )
+    assert outcome_of(lightbulb.CheckFailure("no")) == "check"
+    assert outcome_of(RuntimeError("other")) == "other"
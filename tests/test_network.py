@@ -0,0 +1,71 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+import rotibot.network as network
+from tests.stubs import StubAPI
+
+CONFIG = network.HTTPConfig(retries=2, backoff=0)
+
+
+def get(api: StubAPI, endpoint: str):
+    async def run():
+        async with network.build_session(CONFIG) as session:
+            return await network.get_json(session, endpoint, api.url, CONFIG)
+
+    return run()
+
+
+def test_server_errors_are_retried():
+    async def run():
+        async with StubAPI((503, "busy"), (502, "busy"), (200, {"ok": 1})) as api:
+            assert await get(api, "retried") == {"ok": 1}
+            assert api.requests == 3
+
+    asyncio.run(run())
+    stats = network.stats["retried"]
+    assert (stats.requests, stats.errors, stats.retries) == (3, 2, 2)
+
+
+def test_retries_give_up_with_none():
+    async def run():
+        async with StubAPI((500, "down")) as api:
+            assert await get(api, "down") is None
+            assert api.requests == CONFIG.retries + 1
+
+    asyncio.run(run())
+
+
+def test_client_errors_are_not_retried():
+    async def run():
+        async with StubAPI((404, {"error": "no"})) as api:
+            assert await get(api, "missing") is None
+            assert api.requests == 1
+
+    asyncio.run(run())
+    assert network.stats["missing"].errors == 1
+
+
+def test_connection_errors_raise_after_the_retries():
+    async def run():
+        async with StubAPI((200, {})) as api:
+            url = api.url
+        # Nothing listens there any more
+        async with network.build_session(CONFIG) as session:
+            with pytest.raises(aiohttp.ClientError):
+                await network.get_json(session, "refused", url, CONFIG)
+
+    asyncio.run(run())
+    assert network.stats["refused"].requests == CONFIG.retries + 1
+
+
+def test_responses_that_arent_json_are_not_retried():
+    async def run():
+        async with StubAPI((200, "<html>maintenance</html>")) as api:
+            assert await get(api, "html") is None
+            assert api.requests == 1
+
+    asyncio.run(run())
+    stats = network.stats["html"]
+    assert (stats.requests, stats.errors, stats.retries) == (1, 1, 0)
@@ -0,0 +1,175 @@
+import asyncio
+import types
+
+import pytest
+
+import rotibot.economy as econ
+import rotibot.startup as startup
+import rotibot.storage as store
+
+GUILD_ID = 700000000000000000
+ALICE = 100000000000000001
+BOB = 100000000000000002
+CAROL = 100000000000000003
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = store.Ledger(str(tmp_path / "ledger"))
+    ledger.load()
+    yield ledger
+    ledger.close()
+
+
+def reloaded(ledger: store.Ledger) -> store.Ledger:
+    ledger.close()
+    copy = store.Ledger(ledger.path)
+    copy.load()
+    return copy
+
+
+def test_sync_creates_and_renames_in_one_write(ledger, monkeypatch):
+    ledger.create_account(ALICE, "alice")
+    writes = []
+    append_many = ledger.journal.append_many
+
+    def record_many(records):
+        writes.append(list(records))
+        append_many(writes[-1])
+
+    monkeypatch.setattr(ledger.journal, "append", lambda *fields: writes.append([]))
+    monkeypatch.setattr(ledger.journal, "append_many", record_many)
+
+    created, renamed = ledger.sync_members(
+        [(ALICE, "Alice"), (BOB, "bob"), (CAROL, "carol")]
+    )
+
+    assert (created, renamed) == (2, 1)
+    assert len(writes) == 1
+    assert [record[1] for record in writes[0]] == ["u", "a", "a"]
+    assert ledger.get_username(ALICE) == "Alice"
+    assert ledger.get_balance(BOB) == store.DEFAULT_BALANCE
+
+
+def test_unchanged_members_are_not_written(ledger):
+    ledger.sync_members([(ALICE, "alice")])
+    ledger.take_dirty()
+
+    assert ledger.sync_members([(ALICE, "alice")]) == (0, 0)
+    assert not ledger.needs_backup()
+
+
+def test_refresh_without_create_only_renames(ledger):
+    ledger.create_account(ALICE, "alice")
+
+    assert ledger.sync_members([(ALICE, "ally"), (BOB, "bob")], create=False) == (
+        0,
+        1,
+    )
+    assert BOB not in ledger
+    assert ledger.get_username(ALICE) == "ally"
+
+
+def test_whitespace_in_names_is_normalised(ledger):
+    ledger.sync_members([(ALICE, "al\tice\n")])
+    assert ledger.get_username(ALICE) == "al ice"
+
+
+def test_synced_members_survive_a_restart(ledger):
+    ledger.create_account(ALICE, "alice")
+    ledger.sync_members([(ALICE, "Alice"), (BOB, "bob")])
+
+    copy = reloaded(ledger)
+    assert sorted(copy.items()) == [
+        (ALICE, "Alice", store.DEFAULT_BALANCE),
+        (BOB, "bob", store.DEFAULT_BALANCE),
+    ]
+    copy.close()
+
+
+def test_renames_dont_notify_listeners(ledger):
+    ledger.create_account(ALICE, "alice")
+    notified = []
+    ledger.add_listener(notified.append)
+
+    ledger.sync_members([(ALICE, "Alice"), (BOB, "bob")])
+    assert notified == [BOB]
+
+
+"""
+Member chunks reaching the casino
+"""
+
+
+@pytest.fixture
+def economies(tmp_path, monkeypatch):
+    economies = econ.Economies(directory=str(tmp_path / "economies"))
+    economies.open()
+    monkeypatch.setattr(econ, "economies", economies)
+    milestone = startup.Milestone()
+    monkeypatch.setattr(startup, "ledger_loaded", milestone)
+    milestone.set()
+    yield economies
+    economies.close()
+
+
+def fake_member(user_id: int, name: str, is_bot: bool = False):
+    return types.SimpleNamespace(id=user_id, display_name=name, is_bot=is_bot)
+
+
+def chunk(guild_id: int, *members):
+    return types.SimpleNamespace(
+        guild_id=guild_id,
+        members={member.id: member for member in members},
+        chunk_index=0,
+        chunk_count=1,
+    )
+
+
+def test_chunks_onboard_members_of_known_guilds(economies):
+    pytest.importorskip("lightbulb")
+    from rotibot.extensions import casino
+
+    async def run():
+        ledger = (await economies.get(GUILD_ID)).ledger
+        ledger.create_account(ALICE, "alice")
+        await casino.on_member_chunk(
+            chunk(
+                GUILD_ID,
+                fake_member(ALICE, "Alice"),
+                fake_member(BOB, "bob"),
+                fake_member(CAROL, "robot", is_bot=True),
+            )
+        )
+        return ledger
+
+    ledger = asyncio.run(run())
+    assert sorted(ledger.items()) == [
+        (ALICE, "Alice", store.DEFAULT_BALANCE),
+        (BOB, "bob", store.DEFAULT_BALANCE),
+    ]
+
+
+def test_chunks_of_unknown_guilds_are_ignored(economies):
+    pytest.importorskip("lightbulb")
+    from rotibot.extensions import casino
+
+    asyncio.run(casino.on_member_chunk(chunk(GUILD_ID, fake_member(ALICE, "alice"))))
+    assert len(economies) == 0
+    assert not economies.known(GUILD_ID)
+
+
+def test_chunks_are_dropped_when_the_ledger_failed(economies, monkeypatch):
+    pytest.importorskip("lightbulb")
+    from rotibot.extensions import casino
+
+    failed = startup.Milestone()
+    failed.fail(RuntimeError("no ledger"))
+    monkeypatch.setattr(startup, "ledger_loaded", failed)
+
+    async def run():
+        ledger = (await economies.get(GUILD_ID)).ledger
+        await casino.on_member_chunk(chunk(GUILD_ID, fake_member(ALICE, "alice")))
+        return ledger
+
+    assert len(asyncio.run(run())) == 0
@@ -0,0 +1,100 @@
+import asyncio
+import types
+
+import pytest
+
+hikari = pytest.importorskip("hikari")
+
+from rotibot.roles import RoleResolver
+
+GUILD_ID = 700000000000000000
+LOW = 600000000000000001
+HIGH = 600000000000000002
+UNCACHED = 600000000000000003
+
+
+def role(role_id: int, position: int) -> types.SimpleNamespace:
+    return types.SimpleNamespace(id=role_id, position=position)
+
+
+class FakeCache:
+    def __init__(self, guild_roles) -> None:
+        self.guild_roles = {r.id: r for r in guild_roles}
+
+    def get_roles_view_for_guild(self, guild_id):
+        return self.guild_roles
+
+
+class FakeREST:
+    def __init__(self, guild_roles) -> None:
+        self.guild_roles = guild_roles
+        self.fetches = 0
+
+    async def fetch_roles(self, guild_id):
+        self.fetches += 1
+        return self.guild_roles
+
+
+def member(app, role_ids) -> types.SimpleNamespace:
+    return types.SimpleNamespace(guild_id=GUILD_ID, role_ids=role_ids, app=app)
+
+
+def app_with(cached, fetched) -> types.SimpleNamespace:
+    return types.SimpleNamespace(cache=FakeCache(cached), rest=FakeREST(fetched))
+
+
+def test_cached_roles_come_sorted_without_everyone():
+    app = app_with([role(LOW, 1), role(HIGH, 5), role(GUILD_ID, 0)], [])
+    resolver = RoleResolver()
+
+    roles = asyncio.run(resolver.member_roles(member(app, [GUILD_ID, LOW, HIGH])))
+
+    assert [r.id for r in roles] == [HIGH, LOW]
+    assert app.rest.fetches == 0
+    assert (resolver.hits, resolver.misses) == (1, 0)
+
+
+def test_missing_role_falls_back_to_rest():
+    everything = [role(LOW, 1), role(UNCACHED, 3)]
+    app = app_with([role(LOW, 1)], everything)
+    resolver = RoleResolver()
+
+    async def run():
+        first = await resolver.member_roles(member(app, [LOW, UNCACHED]))
+        # The fetched roles are memoised, the next lookup doesn't fetch
+        second = await resolver.member_roles(member(app, [UNCACHED]))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert [r.id for r in first] == [UNCACHED, LOW]
+    assert [r.id for r in second] == [UNCACHED]
+    assert app.rest.fetches == 1
+    assert (resolver.hits, resolver.misses) == (1, 1)
+
+
+def test_invalidate_rereads_the_cache():
+    app = app_with([role(LOW, 1)], [role(LOW, 1), role(HIGH, 2)])
+    resolver = RoleResolver()
+
+    async def run():
+        await resolver.member_roles(member(app, [LOW]))
+        # A role created since isn't in the memo, until it is invalidated
+        app.cache.guild_roles[HIGH] = role(HIGH, 2)
+        resolver.invalidate(GUILD_ID)
+        return await resolver.member_roles(member(app, [HIGH]))
+
+    assert [r.id for r in asyncio.run(run())] == [HIGH]
+    assert app.rest.fetches == 0
+    assert (resolver.hits, resolver.misses) == (2, 0)
+
+
+def test_memo_expires():
+    app = app_with([], [role(LOW, 1)])
+    resolver = RoleResolver(ttl=0)
+
+    async def run():
+        await resolver.member_roles(member(app, [LOW]))
+        await resolver.member_roles(member(app, [LOW]))
+
+    asyncio.run(run())
+    assert app.rest.fetches == 2
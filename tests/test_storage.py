@@ -0,0 +1,266 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+import rotibot.storage as store
+
+ALICE = 100000000000000001
+BOB = 100000000000000002
+
+
+def open_ledger(path) -> store.Ledger:
+    ledger = store.Ledger(str(path))
+    ledger.load()
+    return ledger
+
+
+"""
+Journal writes
+"""
+
+
+def test_fsyncs_run_off_the_event_loop(tmp_path, monkeypatch):
+    threads = []
+    fsync = os.fsync
+
+    def record_fsync(fd: int) -> None:
+        threads.append(threading.current_thread())
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", record_fsync)
+
+    async def run() -> None:
+        ledger = open_ledger(tmp_path / "ledger")
+        ledger.create_account(ALICE, "alice")
+        for _ in range(5):
+            ledger.add_balance(ALICE, 10)
+        ledger.accrue_income()
+        await ledger.compact()
+        ledger.close()
+
+    asyncio.run(run())
+    store.writer.wait()
+    assert threads
+    assert threading.main_thread() not in threads
+
+
+def test_one_timer_flushes_every_journal(tmp_path, monkeypatch):
+    writer = store.writer
+    monkeypatch.setattr(writer, "flush_interval", 0.01)
+
+    async def run() -> None:
+        ledgers = [open_ledger(tmp_path / f"guild{i}") for i in range(10)]
+        calls = []
+        loop = asyncio.get_running_loop()
+        call_later = loop.call_later
+        monkeypatch.setattr(
+            loop, "call_later", lambda *args: calls.append(args) or call_later(*args)
+        )
+
+        for ledger in ledgers:
+            ledger.create_account(ALICE, "alice")
+        assert len(calls) == 1
+
+        await asyncio.sleep(0.05)
+        await asyncio.wrap_future(writer.submit(lambda: None))
+        for ledger in ledgers:
+            assert os.path.getsize(ledger.journal.path) > 0
+            ledger.close()
+
+    asyncio.run(run())
+    writer.wait()
+
+
+"""
+Journal replay and compaction
+"""
+
+
+def test_reload_from_snapshot_and_journal(tmp_path):
+    async def run() -> None:
+        ledger = open_ledger(tmp_path / "ledger")
+        ledger.create_account(ALICE, "alice")
+        ledger.create_account(BOB, "bob")
+        ledger.add_balance(ALICE, -400)
+        ledger.accrue_income()
+        await ledger.compact()
+
+        # Only in the journal
+        ledger.add_balance(BOB, 123)
+        ledger.accrue_income(2)
+        ledger.sync_members([(ALICE, "alice2"), (3, "carol")])
+        ledger.close()
+
+    asyncio.run(run())
+    store.writer.wait()
+
+    income = store.PASSIVE_INCOME
+    ledger = open_ledger(tmp_path / "ledger")
+    assert ledger.epoch == 3
+    assert sorted(ledger.items()) == [
+        (3, "carol", store.DEFAULT_BALANCE),
+        (ALICE, "alice2", store.DEFAULT_BALANCE - 400 + 3 * income),
+        (BOB, "bob", store.DEFAULT_BALANCE + 123 + 3 * income),
+    ]
+    ledger.close()
+
+
+def test_torn_journal_line_is_cut_off(tmp_path):
+    ledger = open_ledger(tmp_path / "ledger")
+    ledger.create_account(ALICE, "alice")
+    ledger.add_balance(ALICE, 50)
+    ledger.close()
+    store.writer.wait()
+
+    journal_path = ledger.journal.path
+    valid_size = os.path.getsize(journal_path)
+    # A crash in the middle of writing the next record
+    with open(journal_path, "ab") as file:
+        file.write(b"3\td\t100000000000000001\t-5")
+
+    ledger = open_ledger(tmp_path / "ledger")
+    assert ledger.get_balance(ALICE) == store.DEFAULT_BALANCE + 50
+    assert os.path.getsize(journal_path) == valid_size
+
+    # New records start on a line of their own
+    ledger.add_balance(ALICE, 7)
+    ledger.close()
+    store.writer.wait()
+    ledger = open_ledger(tmp_path / "ledger")
+    assert ledger.get_balance(ALICE) == store.DEFAULT_BALANCE + 57
+    ledger.close()
+
+
+def test_changes_during_compaction_stay_in_the_journal(tmp_path, monkeypatch):
+    write_snapshot = store.write_snapshot
+    written = threading.Event()
+    resume = threading.Event()
+
+    # Holds the snapshot write on the executor until the test has made its
+    # changes
+    def slow_write_snapshot(*args) -> None:
+        write_snapshot(*args)
+        written.set()
+        resume.wait(5)
+
+    monkeypatch.setattr(store, "write_snapshot", slow_write_snapshot)
+
+    async def run() -> None:
+        ledger = open_ledger(tmp_path / "ledger")
+        ledger.create_account(ALICE, "alice")
+        ledger.create_account(BOB, "bob")
+
+        compaction = asyncio.create_task(ledger.compact())
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, written.wait, 5)
+        assert ledger.busy
+        ledger.add_balance(ALICE, -100)
+        ledger.create_account(3, "carol")
+        resume.set()
+        await compaction
+
+        assert not ledger.busy
+        assert ledger._journal_records == 2
+        ledger.close()
+
+    asyncio.run(run())
+    store.writer.wait()
+
+    # The snapshot has the accounts from before, the journal only the rest
+    with store.SnapshotFile(str(tmp_path / "ledger.snapshot")) as snapshot:
+        assert sorted(discordID for discordID, _, _ in snapshot.rows()) == [
+            ALICE,
+            BOB,
+        ]
+    journal = store.Journal(str(tmp_path / "ledger.journal"))
+    assert [record[1] for record in journal.replay()] == ["d", "a"]
+
+    ledger = open_ledger(tmp_path / "ledger")
+    assert sorted(ledger.items()) == [
+        (3, "carol", store.DEFAULT_BALANCE),
+        (ALICE, "alice", store.DEFAULT_BALANCE - 100),
+        (BOB, "bob", store.DEFAULT_BALANCE),
+    ]
+    ledger.close()
+
+
+"""
+Binary snapshots
+"""
+
+ROWS = [
+    (BOB, "bob", 250),
+    (ALICE, "alice", 10000),
+    (5, "émilie", 2**40),
+    (ALICE + 10, "two\twords\nhere", 0),
+]
+
+
+def test_snapshot_lookups(tmp_path):
+    path = str(tmp_path / "ledger.snapshot")
+    store.write_snapshot(path, 12, 3, ROWS)
+
+    with store.SnapshotFile(path) as snapshot:
+        assert (len(snapshot), snapshot.seq, snapshot.epoch) == (4, 12, 3)
+        assert snapshot.find(ALICE) == ("alice", 10000)
+        assert snapshot.find(BOB) == ("bob", 250)
+        assert snapshot.find(5) == ("émilie", 2**40)
+        # Whitespace that would break the format is folded into spaces
+        assert snapshot.find(ALICE + 10) == ("two words here", 0)
+        for missing in (1, ALICE + 5, ALICE + 11):
+            assert snapshot.find(missing) is None
+        assert [discordID for discordID, _, _ in snapshot.rows()] == sorted(
+            discordID for discordID, _, _ in ROWS
+        )
+
+
+def test_snapshot_accounts(tmp_path):
+    path = str(tmp_path / "ledger.snapshot")
+    store.write_snapshot(path, 12, 3, ROWS)
+
+    with store.SnapshotFile(path) as snapshot:
+        accounts = snapshot.accounts()
+
+    assert len(accounts) == 4
+    row = accounts.row(5)
+    assert (accounts.usernames[row], accounts.balances[row]) == ("émilie", 2**40)
+    assert list(accounts.epochs) == [3] * 4
+    assert BOB in accounts and 1 not in accounts
+
+
+def test_empty_snapshot(tmp_path):
+    path = str(tmp_path / "ledger.snapshot")
+    store.write_snapshot(path, 0, 0, [])
+
+    with store.SnapshotFile(path) as snapshot:
+        assert snapshot.find(ALICE) is None
+        assert len(snapshot.accounts()) == 0
+
+
+def test_other_files_are_not_snapshots(tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text("discordID,username,balance\n" + "1,alice,5\n" * 10)
+
+    with pytest.raises(ValueError):
+        store.SnapshotFile(str(path))
+
+
+def test_csv_export_import_round_trip(tmp_path):
+    snapshot_path = str(tmp_path / "ledger.snapshot")
+    csv_path = str(tmp_path / "users.csv")
+    store.write_snapshot(snapshot_path, 12, 3, ROWS[:3])
+
+    store.export_csv(snapshot_path, csv_path)
+    assert store.read_csv(csv_path) == {
+        discordID: {"username": username, "balance": balance}
+        for discordID, username, balance in ROWS[:3]
+    }
+
+    imported_path = str(tmp_path / "imported.snapshot")
+    store.import_csv(csv_path, imported_path, seq=12, epoch=3)
+    with store.SnapshotFile(snapshot_path) as original:
+        with store.SnapshotFile(imported_path) as imported:
+            assert list(imported.rows()) == list(original.rows())
+            assert (imported.seq, imported.epoch) == (12, 3)
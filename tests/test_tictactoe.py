@@ -0,0 +1,97 @@
+import asyncio
+import types
+
+import pytest
+
+hikari = pytest.importorskip("hikari")
+pytest.importorskip("lightbulb")
+
+from hikari.impl import special_endpoints
+
+from rotibot.extensions.fun import TicTacToeButtons
+from rotibot.games import EMPTY
+
+BOT = 100000000000000000
+ALICE = 100000000000000001
+BOB = 100000000000000002
+
+
+class FakeMessage:
+    def __init__(self) -> None:
+        self.edits = []
+
+    async def edit(self, *args, **kwargs) -> "FakeMessage":
+        self.edits.append((args, kwargs))
+        return self
+
+
+class FakeInteraction:
+    def __init__(self, user_id: int, x: int, y: int) -> None:
+        self.user = types.SimpleNamespace(id=user_id)
+        # The custom IDs tungsten gives the board's buttons
+        self.custom_id = f"{x},{y}"
+        self.responses = []
+        self.followups = []
+
+    async def create_initial_response(self, response_type, *args, **kwargs) -> None:
+        self.responses.append(response_type)
+
+    async def execute(self, *args, **kwargs) -> None:
+        self.followups.append(args)
+
+
+def build_game() -> TicTacToeButtons:
+    rest = types.SimpleNamespace(build_action_row=special_endpoints.ActionRowBuilder)
+    ctx = types.SimpleNamespace(
+        app=types.SimpleNamespace(rest=rest),
+        bot=types.SimpleNamespace(get_me=lambda: types.SimpleNamespace(id=BOT)),
+    )
+    buttons = TicTacToeButtons(ctx)
+    buttons.set_players(
+        types.SimpleNamespace(id=ALICE, mention="alice"),
+        types.SimpleNamespace(id=BOB, mention="bob"),
+    )
+    buttons.message = FakeMessage()
+    return buttons
+
+
+async def click(buttons: TicTacToeButtons, user_id: int, x: int, y: int):
+    interaction = FakeInteraction(user_id, x, y)
+    await buttons.handle(types.SimpleNamespace(interaction=interaction))
+    return interaction
+
+
+def test_click_is_acknowledged_and_played():
+    buttons = build_game()
+    interaction = asyncio.run(click(buttons, ALICE, 2, 1))
+
+    assert interaction.responses == [hikari.ResponseType.DEFERRED_MESSAGE_UPDATE]
+    assert buttons.game.cell(1 * 3 + 2) != EMPTY
+    assert len(buttons.message.edits) == 1
+    assert not buttons.closed
+
+
+def test_move_out_of_turn_is_refused():
+    buttons = build_game()
+    interaction = asyncio.run(click(buttons, BOB, 0, 0))
+
+    assert interaction.followups == [("You can't make that move.",)]
+    assert not buttons.message.edits
+
+
+def test_session_closes_when_the_game_is_won():
+    async def play() -> None:
+        for user_id, x, y in (
+            (ALICE, 0, 0),
+            (BOB, 0, 1),
+            (ALICE, 1, 0),
+            (BOB, 1, 1),
+        ):
+            await click(buttons, user_id, x, y)
+            assert not buttons.closed
+        await click(buttons, ALICE, 2, 0)
+
+    buttons = build_game()
+    asyncio.run(play())
+    assert buttons.closed
+    assert "alice has won" in buttons.message.edits[-1][0][0]
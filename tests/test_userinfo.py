@@ -0,0 +1,213 @@
+import asyncio
+import datetime
+import types
+
+import pytest
+
+hikari = pytest.importorskip("hikari")
+pytest.importorskip("lightbulb")
+
+import rotibot.roles as roles
+from rotibot.extensions import userinfo
+from rotibot.extensions.userinfo import EmbedCache
+
+GUILD_ID = 700000000000000000
+ALICE = 100000000000000001
+BOB = 100000000000000002
+MODS = 600000000000000001
+ADMINS = 600000000000000002
+
+
+def embed(title: str) -> hikari.Embed:
+    return hikari.Embed(title=title)
+
+
+def test_get_returns_what_was_put():
+    cache = EmbedCache()
+    alice = embed("alice")
+    cache.put(GUILD_ID, ALICE, alice, [MODS])
+
+    assert cache.get(GUILD_ID, ALICE) is alice
+    assert cache.get(GUILD_ID, BOB) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted_first():
+    cache = EmbedCache(max_size=2)
+    cache.put(GUILD_ID, ALICE, embed("alice"), [])
+    cache.put(GUILD_ID, BOB, embed("bob"), [])
+    cache.get(GUILD_ID, ALICE)
+    cache.put(GUILD_ID, 3, embed("carol"), [])
+
+    assert len(cache) == 2
+    assert cache.get(GUILD_ID, BOB) is None
+    assert cache.get(GUILD_ID, ALICE) is not None
+
+
+def test_member_invalidation_only_drops_that_member():
+    cache = EmbedCache()
+    cache.put(GUILD_ID, ALICE, embed("alice"), [MODS])
+    cache.put(GUILD_ID, BOB, embed("bob"), [MODS])
+    cache.put(GUILD_ID + 1, ALICE, embed("alice elsewhere"), [])
+
+    cache.invalidate_member(GUILD_ID, ALICE)
+
+    assert cache.get(GUILD_ID, ALICE) is None
+    assert cache.get(GUILD_ID, BOB) is not None
+    assert cache.get(GUILD_ID + 1, ALICE) is not None
+
+
+def test_role_invalidation_drops_every_member_listing_it():
+    cache = EmbedCache()
+    cache.put(GUILD_ID, ALICE, embed("alice"), [MODS, ADMINS])
+    cache.put(GUILD_ID, BOB, embed("bob"), [MODS])
+    cache.put(GUILD_ID, 3, embed("carol"), [])
+
+    cache.invalidate_role(ADMINS)
+    assert cache.get(GUILD_ID, ALICE) is None
+    assert cache.get(GUILD_ID, BOB) is not None
+
+    cache.invalidate_role(MODS)
+    assert cache.get(GUILD_ID, BOB) is None
+    assert cache.get(GUILD_ID, 3) is not None
+
+
+def test_replaced_entry_forgets_its_old_roles():
+    cache = EmbedCache()
+    cache.put(GUILD_ID, ALICE, embed("mod alice"), [MODS])
+    cache.put(GUILD_ID, ALICE, embed("alice"), [])
+
+    # Alice no longer lists the role, so changing it leaves her alone
+    cache.invalidate_role(MODS)
+    assert cache.get(GUILD_ID, ALICE).title == "alice"
+
+
+def test_evicted_entry_is_not_invalidated_later():
+    cache = EmbedCache(max_size=1)
+    cache.put(GUILD_ID, ALICE, embed("alice"), [MODS])
+    cache.put(GUILD_ID, BOB, embed("bob"), [ADMINS])
+
+    cache.invalidate_role(MODS)
+    cache.invalidate_role(ADMINS)
+    assert len(cache) == 0
+
+
+"""
+Listeners and the command, with members and roles standing in for hikari's
+"""
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = EmbedCache()
+    monkeypatch.setattr(userinfo, "embed_cache", cache)
+    monkeypatch.setattr(roles, "resolver", roles.RoleResolver())
+    return cache
+
+
+def fake_role(role_id: int, position: int) -> types.SimpleNamespace:
+    return types.SimpleNamespace(
+        id=role_id, position=position, mention=f"<@&{role_id}>"
+    )
+
+
+class FakeREST:
+    def __init__(self, guild_roles) -> None:
+        self.guild_roles = guild_roles
+        self.fetches = 0
+
+    async def fetch_roles(self, guild_id):
+        self.fetches += 1
+        return self.guild_roles
+
+
+def fake_member(member_id: int, role_ids, rest: FakeREST) -> types.SimpleNamespace:
+    when = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    return types.SimpleNamespace(
+        id=member_id,
+        guild_id=GUILD_ID,
+        app=types.SimpleNamespace(rest=rest),
+        role_ids=role_ids,
+        display_name=f"member{member_id}",
+        avatar_url=None,
+        default_avatar_url="https://cdn.discordapp.com/embed/avatars/0.png",
+        is_bot=False,
+        created_at=when,
+        joined_at=when,
+    )
+
+
+def test_listeners_invalidate_the_cache(cache):
+    cache.put(GUILD_ID, ALICE, embed("alice"), [MODS])
+    cache.put(GUILD_ID, BOB, embed("bob"), [ADMINS])
+    cache.put(GUILD_ID, 3, embed("carol"), [])
+    cache.put(GUILD_ID, 4, embed("dave"), [])
+
+    async def run():
+        await userinfo.on_role_update(
+            types.SimpleNamespace(guild_id=GUILD_ID, role_id=MODS)
+        )
+        await userinfo.on_role_delete(
+            types.SimpleNamespace(guild_id=GUILD_ID, role_id=ADMINS)
+        )
+        await userinfo.on_member_update(
+            types.SimpleNamespace(guild_id=GUILD_ID, user_id=3)
+        )
+
+    asyncio.run(run())
+    assert [cache.get(GUILD_ID, member_id) for member_id in (ALICE, BOB, 3)] == [
+        None,
+        None,
+        None,
+    ]
+    assert cache.get(GUILD_ID, 4).title == "dave"
+
+
+def test_role_update_also_refreshes_the_guild_roles(cache):
+    rest = FakeREST([fake_role(MODS, 1)])
+    member = fake_member(ALICE, [MODS], rest)
+
+    async def run():
+        await userinfo.render_member(member)
+        await userinfo.on_role_update(
+            types.SimpleNamespace(guild_id=GUILD_ID, role_id=MODS)
+        )
+        await userinfo.render_member(member)
+
+    asyncio.run(run())
+    assert rest.fetches == 2
+
+
+def test_command_renders_once_and_footers_a_copy(cache):
+    rest = FakeREST([fake_role(MODS, 1), fake_role(ADMINS, 2)])
+    alice = fake_member(ALICE, [MODS, ADMINS], rest)
+    bob = fake_member(BOB, [], rest)
+    members = {ALICE: alice, BOB: bob}
+    responses = []
+
+    async def respond(embed):
+        responses.append(embed)
+
+    def context(author, target):
+        return types.SimpleNamespace(
+            invoked=None,
+            command=types.SimpleNamespace(qualname="userinfo"),
+            options=types.SimpleNamespace(target=target),
+            user=author,
+            member=author,
+            get_guild=lambda: types.SimpleNamespace(get_member=members.get),
+            respond=respond,
+        )
+
+    async def run():
+        await userinfo.userinfo.callback(context(bob, ALICE))
+        await userinfo.userinfo.callback(context(alice, ALICE))
+
+    asyncio.run(run())
+    first, second = responses
+    assert rest.fetches == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert first.fields[3].value == f"<@&{ADMINS}>, <@&{MODS}>"
+    assert first.footer.text == f"Requested by member{BOB}"
+    assert second.footer.text == f"Requested by member{ALICE}"
+    assert cache.get(GUILD_ID, ALICE).footer is None